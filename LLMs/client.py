@@ -0,0 +1,269 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+
+import httpx
+from volcenginesdkarkruntime import AsyncArk
+from volcenginesdkarkruntime._exceptions import ArkAPIConnectionError, ArkAPIStatusError, ArkRateLimitError
+
+from .prompt_budget import PROMPT_BUDGET
+
+ARK_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
+
+# 这些 HTTP 状态码表示服务端暂时不可用，重试可能成功
+TRANSIENT_STATUS_CODES = {408, 409, 425, 429}
+
+
+class InvalidReplyError(Exception):
+    """The reply arrived but failed the caller's validation, e.g. it holds no parsable dictionary."""
+
+
+class LLMCallError(Exception):
+    """
+    An LLM call that failed for good.
+
+    ``transient`` tells whether the last failure was of a kind that can succeed later (timeouts,
+    connection errors, rate limits, server errors, invalid replies) and only ran out of attempts or
+    time, as opposed to a permanent one such as a bad request or a rejected API key.
+    """
+
+    def __init__(self, message, phase=None, transient=False):
+        super().__init__(message)
+        self.phase = phase
+        self.transient = transient
+
+
+def is_transient_error(error):
+    if isinstance(error, (ArkAPIConnectionError, httpx.TransportError, asyncio.TimeoutError, InvalidReplyError)):
+        return True
+    if isinstance(error, ArkAPIStatusError):
+        return error.status_code in TRANSIENT_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+class LLMClient:
+    """
+    Chat completions client shared by all ``llm_roles`` functions.
+
+    Requests run on one event loop owned by a background thread, through a single ``AsyncArk``
+    client whose HTTP connections are kept alive and reused. At most ``max_concurrency`` requests
+    are in flight at once, whichever thread or event loop they come from. ``achat`` can be awaited
+    from any event loop, and ``chat`` is its blocking wrapper for synchronous callers.
+
+    Any OpenAI-compatible server works as ``base_url``. The Ark-specific ``thinking`` field is
+    sent in the request body and ignored by servers that do not know it.
+
+    With a ``response_cache`` (``memory_cache.LLMResponseCache``), replies to a prompt already sent
+    with the same model and thinking mode are served from the cache without a request.
+
+    Each call belongs to a ``phase`` (e.g. "time_search") and must finish within that phase's
+    deadline, ``deadlines[phase]`` or else ``deadline`` seconds. Transient failures are retried with
+    exponential backoff and full jitter, up to ``max_retries`` times within the deadline; permanent
+    ones raise ``LLMCallError`` at once. A ``validate`` callback turns unusable replies into
+    transient failures. With ``hedge``, a duplicate request is sent once an attempt has been running
+    longer than the p95 latency of earlier successful attempts of the same phase, and the first reply
+    wins.
+
+    With a ``rate_limiter`` (``rate_limit.RateLimiter``), every request first reserves its estimated
+    tokens (prompt tokens counted locally plus the average completion so far) in the limiter's queue
+    for its caller thread or task. The estimate is corrected with ``response.usage`` afterwards.
+    """
+
+    def __init__(self, api_key, model, thinking: str = "disabled", base_url: str = ARK_BASE_URL,
+                 max_concurrency: int = 8, timeout: float = 1800, response_cache=None,
+                 max_retries: int = 4, deadline: float = 1800, deadlines: dict = None,
+                 backoff_base: float = 1.0, backoff_max: float = 30.0,
+                 hedge: bool = False, hedge_min_samples: int = 20, rate_limiter=None):
+        self.model = model
+        self.rate_limiter = rate_limiter
+        self.completion_tokens = deque([512], maxlen=100)
+        self.response_cache = response_cache
+        self.thinking = thinking
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self.deadlines = deadlines or {}
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies = {}
+        self.stats = {"requests": 0, "retries": 0, "hedges": 0, "hedge_wins": 0,
+                      "transient_errors": 0, "permanent_errors": 0, "failed_calls": 0}
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="llm-client", daemon=True)
+        self.thread.start()
+
+        async def setup():
+            # 信号量和连接池都绑定在后台事件循环上
+            self.semaphore = asyncio.Semaphore(max_concurrency)
+            self.http_client = httpx.AsyncClient(
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            )
+            # 重试由本类统一处理，关闭 SDK 自带的重试
+            self.client = AsyncArk(api_key=api_key, base_url=base_url, timeout=timeout,
+                                   http_client=self.http_client, max_retries=0)
+
+        asyncio.run_coroutine_threadsafe(setup(), self.loop).result()
+
+    def hedge_threshold(self, phase):
+        latencies = self.latencies.get(phase)
+        if not self.hedge or latencies is None or len(latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    async def _request(self, prompt, model, thinking, phase, queue_key):
+        estimated = 0
+        if self.rate_limiter is not None:
+            estimated = PROMPT_BUDGET.count(prompt) + int(sum(self.completion_tokens) / len(self.completion_tokens))
+            await self.rate_limiter.acquire(estimated, queue_key)
+        async with self.semaphore:
+            self.stats["requests"] += 1
+            start = time.perf_counter()
+            try:
+                response = await self.client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ],
+                    thinking={
+                        "type": thinking
+                    }
+                )
+            except ArkRateLimitError:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.throttle()
+                raise
+        self.latencies.setdefault(phase, deque(maxlen=200)).append(time.perf_counter() - start)
+        usage = getattr(response, "usage", None)
+        if self.rate_limiter is not None and usage is not None:
+            self.rate_limiter.reconcile(estimated, usage.total_tokens)
+            self.completion_tokens.append(usage.completion_tokens)
+        return response.choices[0].message.content
+
+    async def _hedged_request(self, prompt, model, thinking, phase, queue_key):
+        threshold = self.hedge_threshold(phase)
+        if threshold is None:
+            return await self._request(prompt, model, thinking, phase, queue_key)
+        tasks = [asyncio.ensure_future(self._request(prompt, model, thinking, phase, queue_key))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=threshold)
+            if not done:
+                self.stats["hedges"] += 1
+                tasks.append(asyncio.ensure_future(self._request(prompt, model, thinking, phase, queue_key)))
+            # 任一请求成功即返回；全部失败时抛出最后一个异常
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+            raise tasks[-1].exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _chat(self, prompt, model=None, thinking=None, phase=None, validate=None, queue_key=None):
+        model = model or self.model
+        thinking = thinking or self.thinking
+        if self.response_cache is not None:
+            # SQLite 读写放在线程池中，避免阻塞事件循环
+            content = await asyncio.to_thread(self.response_cache.get, model, thinking, prompt)
+            if content is not None and (validate is None or validate(content)):
+                return content
+
+        deadline = time.perf_counter() + self.deadlines.get(phase, self.deadline)
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                content = await asyncio.wait_for(self._hedged_request(prompt, model, thinking, phase, queue_key),
+                                                 remaining)
+                if validate is not None and not validate(content):
+                    raise InvalidReplyError(f"unusable reply: {str(content)[:200]}")
+            except Exception as e:
+                if not is_transient_error(e):
+                    self.stats["permanent_errors"] += 1
+                    self.stats["failed_calls"] += 1
+                    raise LLMCallError(f"{phase or 'LLM'} call failed permanently: {e!r}", phase, False) from e
+                self.stats["transient_errors"] += 1
+                last_error = e
+                if attempt < self.max_retries:
+                    self.stats["retries"] += 1
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                    print(f"LLM {phase or 'call'} attempt {attempt + 1} failed ({e!r}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(min(delay, max(deadline - time.perf_counter(), 0)))
+                continue
+
+            if self.response_cache is not None and content is not None:
+                await asyncio.to_thread(self.response_cache.put, model, thinking, prompt, content)
+            return content
+
+        self.stats["failed_calls"] += 1
+        raise LLMCallError(f"{phase or 'LLM'} call gave up after {attempt + 1} attempts: {last_error!r}",
+                           phase, True) from last_error
+
+    async def achat(self, prompt, model=None, thinking=None, phase=None, validate=None):
+        """
+        Send one user prompt and return the reply text.
+
+        Args:
+            prompt (str): User message
+            model (str): Model ID, defaults to the client's model
+            thinking (str): Thinking mode ("enabled"/"disabled"/"auto"), defaults to the client's mode
+            phase (str): Name of the calling phase, selects the deadline and the hedging latencies
+            validate (callable): Returns False for replies that should be retried
+
+        Returns:
+            str: Content of the first choice
+
+        Raises:
+            LLMCallError: The call failed permanently, or ran out of retries or time
+        """
+        # 同一调用方（任务或线程）的请求在限流器中共用一个公平队列
+        queue_key = id(asyncio.current_task())
+        future = asyncio.run_coroutine_threadsafe(self._chat(prompt, model, thinking, phase, validate, queue_key),
+                                                  self.loop)
+        return await asyncio.wrap_future(future)
+
+    async def achat_many(self, prompts, model=None, thinking=None, phase=None, validate=None):
+        """Send independent prompts concurrently; replies are returned in prompt order."""
+        return await asyncio.gather(*(self.achat(prompt, model, thinking, phase, validate) for prompt in prompts))
+
+    def chat(self, prompt, model=None, thinking=None, phase=None, validate=None):
+        """Blocking ``achat``. Safe to call from any thread except the client's own event loop."""
+        queue_key = threading.get_ident()
+        return asyncio.run_coroutine_threadsafe(self._chat(prompt, model, thinking, phase, validate, queue_key),
+                                                self.loop).result()
+
+    def chat_many(self, prompts, model=None, thinking=None, phase=None, validate=None):
+        """Blocking ``achat_many``."""
+        queue_key = threading.get_ident()
+        futures = [asyncio.run_coroutine_threadsafe(self._chat(prompt, model, thinking, phase, validate, queue_key),
+                                                    self.loop)
+                   for prompt in prompts]
+        return [future.result() for future in futures]
+
+    def cache_stats(self):
+        """Hit-rate and size statistics of the response cache, None without one."""
+        return self.response_cache.stats() if self.response_cache is not None else None
+
+    def call_stats(self):
+        """Request, retry, hedge and failure counts since the client was created, plus rate limiter queue waits."""
+        stats = dict(self.stats)
+        if self.rate_limiter is not None:
+            stats["rate_limiter"] = self.rate_limiter.stats()
+        return stats
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.http_client.aclose(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
@@ -1,14 +1,32 @@
 import json
 from .utils import *
-from volcenginesdkarkruntime import Ark
+from .client import LLMClient
+from .rate_limit import RateLimiter
+from memory_cache import MemoryCache, LLMResponseCache, make_cache_key
 
 def create_llm(args):
+    PROMPT_BUDGET.configure(args.max_prompt_tokens, args.prompt_tokenizer_path)
     if args.api_call:
         print("Using LLM API:",args.api_model)
         os.environ["ARK_API_KEY"] = args.api_key
-        client = Ark(
+        response_cache = None
+        if not args.llm_cache_bypass:
+            os.makedirs(args.cache_dir, exist_ok=True)
+            response_cache = LLMResponseCache(os.path.join(args.cache_dir, "llm_response_cache.sqlite"),
+                                              args.llm_cache_max_bytes, args.llm_cache_ttl)
+        client = LLMClient(
             api_key=os.environ.get("ARK_API_KEY"),
-            timeout=1800
+            model=args.api_model,
+            thinking=args.thinking,
+            base_url=args.api_base_url,
+            max_concurrency=args.llm_max_concurrency,
+            timeout=1800,
+            response_cache=response_cache,
+            max_retries=args.llm_max_retries,
+            deadline=args.llm_deadline,
+            deadlines=json.loads(args.llm_phase_deadlines) if args.llm_phase_deadlines else None,
+            hedge=args.llm_hedge,
+            rate_limiter=RateLimiter(args.llm_rpm, args.llm_tpm) if args.llm_rpm > 0 or args.llm_tpm > 0 else None
         )
         return client
 
@@ -16,59 +34,112 @@ def create_llm(args):
         raise("Only Supporting Using LLM with API Currently!")
 
 
+def video_context_hash(coarse_memory):
+    """Hash of the video context prefix shared by all prompts about the video, for LLM-side prefix caches."""
+    return get_prefix_hash(get_video_context_prefix(coarse_memory))
+
+
 def coarse_memory_summarization(coarse_memory,args,client=None):
     print("-" * 20)
     print("Summarizing Coarse Memory...")
     video_path = args.video_url
     cache_dir = args.cache_dir
+    memory_prompt = get_summary_prompt(coarse_memory)
+
+    # 粗粒度记忆过长时分段摘要再合并
+    chunk_tokens = args.summary_chunk_tokens
+    map_reduce = chunk_tokens > 0 and PROMPT_BUDGET.count(memory_prompt) > chunk_tokens
+
+    # 摘要由粗粒度记忆内容和 LLM 唯一决定，以二者的哈希作为缓存键
+    memory_cache = MemoryCache(os.path.join(cache_dir, "coarse_memory"), args.coarse_cache_max_bytes)
+    if map_reduce:
+        cache_key = make_cache_key("summary", memory_prompt, args.api_model, args.thinking, "map_reduce", chunk_tokens)
+    else:
+        cache_key = make_cache_key("summary", memory_prompt, args.api_model, args.thinking)
+    results = memory_cache.get(cache_key, suffix="_Summarization.json")
+    if results is not None:
+        print("Coarse Memory Summarization Existed in:", memory_cache.path(cache_key, suffix="_Summarization.json"))
+        return results
+
     video_path = get_video_path(video_path,cache_dir)
     video_path = video_path.split("VideoDataset/")[-1]
     save_name = "_".join(video_path.split(".")[0].split("/")) + "_Summarization" + ".json"
-
-    if os.path.exists(os.path.join(cache_dir, "coarse_memory", save_name)):
-        print("Coarse Memory Summarization Existed in:", os.path.join(cache_dir, "coarse_memory", save_name))
+    if not args.ignore_legacy_coarse_memory and os.path.exists(os.path.join(cache_dir, "coarse_memory", save_name)):
+        print("Legacy Coarse Memory Summarization Existed in:", os.path.join(cache_dir, "coarse_memory", save_name))
         with open(os.path.join(cache_dir, "coarse_memory", save_name), "r") as f:
             results = json.load(f)
         return results
 
-    memory_prompt = get_summary_prompt(coarse_memory)
-
     if client:
-        response = client.chat.completions.create(
-            # 替换 <Model> 为模型的Model ID
-            model=args.api_model,
-            messages=[
-                {"role": "user", "content": memory_prompt}
-            ],
-            thinking={
-                "type": args.thinking
-            }
-        )
-        response = response.choices[0].message.content
+        if map_reduce:
+            response = map_reduce_summarization(coarse_memory, memory_cache, args, client)
+        else:
+            response = client.chat(memory_prompt, args.api_model, args.thinking, phase="summary")
 
     else:
         raise ("Only Supporting Using LLM with API Currently!")
 
     responses = [response]
-    with open(os.path.join(cache_dir, "coarse_memory",save_name), 'w', encoding='utf-8') as f:
-        json.dump(responses, f, ensure_ascii=False, indent=4)
+    memory_cache.put(cache_key, responses, meta={"video": args.video_url}, suffix="_Summarization.json")
 
     return responses
 
 
+def summarize_parts(prompts, memory_cache, args, client):
+    """Send summary prompts concurrently, reusing the cached summaries of parts that did not change."""
+    keys = [make_cache_key("summary_part", prompt, args.api_model, args.thinking) for prompt in prompts]
+    summaries = [memory_cache.get(key, suffix="_SummaryPart.json") for key in keys]
+    missing = [i for i, summary in enumerate(summaries) if summary is None]
+    print("Summarizing {} Parts ({} Cached)".format(len(missing), len(prompts) - len(missing)))
+    responses = client.chat_many([prompts[i] for i in missing], args.api_model, args.thinking, phase="summary")
+    for i, response in zip(missing, responses):
+        summaries[i] = [response]
+        memory_cache.put(keys[i], summaries[i], meta={"kind": "summary_part", "video": args.video_url},
+                         suffix="_SummaryPart.json")
+    return [summary[0] for summary in summaries]
+
+
+def map_reduce_summarization(coarse_memory, memory_cache, args, client):
+    """
+    Summarize a coarse memory too long for one prompt hierarchically.
+
+    Adjacent coarse memories are packed into parts of at most ``args.summary_chunk_tokens`` tokens
+    and summarized concurrently. Adjacent part summaries are then merged the same way, level by
+    level, until they fit into one prompt that asks for the introduction of the whole video. Every
+    part summary is cached under the hash of its prompt. Parts are packed from the start of the
+    video, so when segments are appended only the last part of each level is summarized again.
+
+    Returns:
+        str: Introduction of the whole video
+    """
+    chunk_tokens = args.summary_chunk_tokens
+    count = PROMPT_BUDGET.count
+    groups = pack_in_order([count(format_coarse_entry(i, mem)) for i, mem in enumerate(coarse_memory)], chunk_tokens)
+    texts = summarize_parts([get_summary_part_prompt(coarse_memory, start, stop) for start, stop in groups],
+                            memory_cache, args, client)
+    summary_parts = [(coarse_memory[start]['time_period'][0], coarse_memory[stop - 1]['time_period'][1], text)
+                     for (start, stop), text in zip(groups, texts)]
+
+    while len(summary_parts) > 1:
+        costs = [count(format_summary_part(i, part)) for i, part in enumerate(summary_parts)]
+        if sum(costs) <= chunk_tokens:
+            break
+        # 每组至少合并两段，保证逐层收敛
+        groups = pack_in_order(costs, chunk_tokens, min_items=2)
+        texts = summarize_parts([get_summary_merge_prompt(summary_parts[start:stop]) for start, stop in groups],
+                                memory_cache, args, client)
+        summary_parts = [(summary_parts[start][0], summary_parts[stop - 1][1], text)
+                         for (start, stop), text in zip(groups, texts)]
+
+    return client.chat(get_summary_merge_prompt(summary_parts, coarse_memory), args.api_model, args.thinking,
+                       phase="summary")
+
+
 def video_question_answer_with_summary(summary,question,args,client=None):
     memory_prompt = direct_answer_with_summary_prompt(summary,question)
     if client:
-        response = client.chat.completions.create(
-            model=args.api_model,
-            messages=[
-                {"role": "user", "content": memory_prompt}
-            ],
-            thinking={
-                "type": args.thinking
-            }
-        )
-        response = response.choices[0].message.content
+        response = client.chat(memory_prompt, args.api_model, args.thinking, phase="answer_with_summary",
+                               validate=reply_has_keys("Confidence", "Answer"))
         responses = [response]
     else:
         raise ("Only Supporting Using LLM with API Currently!")
@@ -78,16 +149,8 @@ def video_question_answer_with_summary(summary,question,args,client=None):
 def video_question_option_with_summary(summary,question,options,args,client=None):
     memory_prompt = option_answer_with_summary_prompt(summary,question,options)
     if client:
-        response = client.chat.completions.create(
-            model=args.api_model,
-            messages=[
-                {"role": "user", "content": memory_prompt}
-            ],
-            thinking={
-                "type": args.thinking
-            }
-        )
-        response = response.choices[0].message.content
+        response = client.chat(memory_prompt, args.api_model, args.thinking, phase="option_with_summary",
+                               validate=reply_has_keys("Confidence", "Answer"))
         responses = [response]
     else:
         raise ("Only Supporting Using LLM with API Currently!")
@@ -97,16 +160,8 @@ def video_question_option_with_summary(summary,question,options,args,client=None
 def answer_and_options_matching_judge(question,answer,options,args,client=None):
     memory_prompt = get_answer_judge_prompt(question,answer,options)
     if client:
-        response = client.chat.completions.create(
-            model=args.api_model,
-            messages=[
-                {"role": "user", "content": memory_prompt}
-            ],
-            thinking={
-                "type": args.thinking
-            }
-        )
-        response = response.choices[0].message.content
+        response = client.chat(memory_prompt, args.api_model, args.thinking, phase="option_matching",
+                               validate=reply_has_keys("Matching", "Option"))
         responses = [response]
     else:
         raise("Only Supporting Using LLM with API Currently!")
@@ -116,92 +171,63 @@ def answer_and_options_matching_judge(question,answer,options,args,client=None):
 def video_question_answer_with_coarse_memory(coarse_memory,question,options,args,client=None):
     memory_prompt = answer_with_coarse_memory_prompt(coarse_memory,question,options)
     if client:
-        response = client.chat.completions.create(
-            model=args.api_model,
-            messages=[
-                {"role": "user", "content": memory_prompt}
-            ],
-            thinking={
-                "type": args.thinking
-            }
-        )
-        response = response.choices[0].message.content
+        response = client.chat(memory_prompt, args.api_model, args.thinking, phase="coarse_answer",
+                               validate=reply_has_keys("Confidence", "Answer"))
         responses = [response]
     else:
         raise("Only Supporting Using LLM with API Currently!")
     return responses[0]
 
 
-def video_question_answer_with_coarse_and_fine_memory(coarse_memory,entire_fine_memory_list,divided_fine_memory_list,entire_super_fine_memory_list,divided_super_fine_memory_list,question,options,args,client=None,duration=0):
-    memory_prompt = answer_with_coarse_and_fine_memory_prompt(coarse_memory,entire_fine_memory_list,divided_fine_memory_list,entire_super_fine_memory_list,divided_super_fine_memory_list,question,options,duration)
+def video_question_answer_with_coarse_and_fine_memory(coarse_memory,entire_fine_memory_list,divided_fine_memory_list,entire_super_fine_memory_list,divided_super_fine_memory_list,question,options,args,client=None,focus_periods=None):
+    memory_prompt = answer_with_coarse_and_fine_memory_prompt(coarse_memory,entire_fine_memory_list,divided_fine_memory_list,entire_super_fine_memory_list,divided_super_fine_memory_list,question,options,focus_periods)
     if client:
-        response = client.chat.completions.create(
-            model=args.api_model,
-            messages=[
-                {"role": "user", "content": memory_prompt}
-            ],
-            thinking={
-                "type": args.thinking
-            }
-        )
-        response = response.choices[0].message.content
+        response = client.chat(memory_prompt, args.api_model, args.thinking, phase="fine_answer",
+                               validate=reply_has_keys("Confidence", "Answer"))
         responses = [response]
     else:
         raise("Only Supporting Using LLM with API Currently!")
     return responses[0]
 
 
-def video_question_must_answer_with_coarse_and_fine_memory(coarse_memory,entire_fine_memory_list,divided_fine_memory_list,entire_super_fine_memory_list,divided_super_fine_memory_list,question,options,args,client=None,duration=0):
-    memory_prompt = must_answer_with_coarse_and_fine_memory_prompt(coarse_memory,entire_fine_memory_list,divided_fine_memory_list,entire_super_fine_memory_list,divided_super_fine_memory_list,question,options,duration)
+def video_question_must_answer_with_coarse_and_fine_memory(coarse_memory,entire_fine_memory_list,divided_fine_memory_list,entire_super_fine_memory_list,divided_super_fine_memory_list,question,options,args,client=None):
+    memory_prompt = must_answer_with_coarse_and_fine_memory_prompt(coarse_memory,entire_fine_memory_list,divided_fine_memory_list,entire_super_fine_memory_list,divided_super_fine_memory_list,question,options)
     if client:
-        response = client.chat.completions.create(
-            model=args.api_model,
-            messages=[
-                {"role": "user", "content": memory_prompt}
-            ],
-            thinking={
-                "type": args.thinking
-            }
-        )
-        response = response.choices[0].message.content
+        response = client.chat(memory_prompt, args.api_model, args.thinking, phase="must_answer",
+                               validate=reply_has_keys("Answer"))
         responses = [response]
     else:
         raise("Only Supporting Using LLM with API Currently!")
     return responses[0]
 
 
-def video_question_get_single_related_time_with_coarse_memory(coarse_memory,entire_fine_memory_list_history,divided_fine_memory_list_history,question,options,excluded_time_periods,args,client=None,duration=0):
-    memory_prompt = get_single_related_time_prompt(coarse_memory,entire_fine_memory_list_history,divided_fine_memory_list_history,question,options,excluded_time_periods,duration)
+def video_question_get_single_related_time_with_coarse_memory(coarse_memory,entire_fine_memory_list_history,divided_fine_memory_list_history,question,options,excluded_time_periods,args,client=None,focus_periods=None,candidates=None):
+    memory_prompt = get_single_related_time_prompt(coarse_memory,entire_fine_memory_list_history,divided_fine_memory_list_history,question,options,excluded_time_periods,focus_periods,candidates)
     if client:
-        response = client.chat.completions.create(
-            model=args.api_model,
-            messages=[
-                {"role": "user", "content": memory_prompt}
-            ],
-            thinking={
-                "type": args.thinking
-            }
-        )
-        response = response.choices[0].message.content
+        response = client.chat(memory_prompt, args.api_model, args.thinking, phase="time_search",
+                               validate=reply_has_keys("Time Period", "Instruction"))
         responses = [response]
     else:
         raise("Only Supporting Using LLM with API Currently!")
     return responses[0]
 
 
-def video_question_type_judge_with_coarse_memory(coarse_memory,question,options,args,client=None):
-    memory_prompt = question_type_judge_prompt(coarse_memory,question,options)
+def video_question_get_top_k_related_times_with_coarse_memory(coarse_memory,question,options,top_k,args,client=None,focus_periods=None,candidates=None):
+    memory_prompt = get_top_k_related_times_prompt(coarse_memory,question,options,top_k,focus_periods,candidates)
     if client:
-        response = client.chat.completions.create(
-            model=args.api_model,
-            messages=[
-                {"role": "user", "content": memory_prompt}
-            ],
-            thinking={
-                "type": args.thinking
-            }
-        )
-        response = response.choices[0].message.content
+        response = client.chat(memory_prompt, args.api_model, args.thinking, phase="top_k_search",
+                               validate=reply_has_keys("Time Periods", "Instruction"))
+        responses = [response]
+    else:
+        raise("Only Supporting Using LLM with API Currently!")
+    return responses[0]
+
+
+def video_question_type_judge_with_coarse_memory(coarse_memory,question,options,args,client=None,candidates=None):
+    memory_prompt = question_type_judge_prompt(coarse_memory,question,options,candidates)
+    if client:
+        response = client.chat(memory_prompt, args.api_model, args.thinking, phase="type_judge",
+                               validate=reply_has_keys("Flag", "Time Period"))
         responses = [response]
     else:
         raise("Only Supporting Using LLM with API Currently!")
@@ -0,0 +1,123 @@
+import re
+import threading
+from functools import lru_cache
+
+# 问题中不参与相关性打分的常见词，检索索引（memory_index.py）也使用同一份
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "been", "of", "in", "on", "at", "to", "for", "from",
+    "by", "with", "and", "or", "what", "which", "who", "whom", "whose", "when", "where", "why", "how", "does",
+    "do", "did", "this", "that", "these", "those", "it", "its", "video", "there", "as", "after", "before",
+    "then", "while",
+}
+
+
+def query_terms(text: str):
+    return {w for w in re.findall(r"\w+", text.lower()) if w not in STOPWORDS and len(w) > 1}
+
+
+def query_relevance(text: str, terms: set):
+    """Fraction of the question terms that appear in a memory description."""
+    if not terms:
+        return 0.0
+    words = set(re.findall(r"\w+", text.lower()))
+    return len(terms & words) / len(terms)
+
+
+class TokenCounter:
+    """
+    Count prompt tokens locally.
+
+    With a tokenizer path, counts come from that Hugging Face tokenizer. Without one, they are
+    estimated as one token per four ASCII characters plus one per other character, which
+    over-counts English and Chinese text for the usual chat models. Counts of texts up to
+    ``memo_max_chars`` are memoized, since the same memory descriptions appear in every prompt about
+    a video; whole prompts are longer and counted afresh, so the memo never holds them.
+    """
+
+    def __init__(self, tokenizer_path: str = "", memo_max_chars: int = 4096, memo_size: int = 8192):
+        self.tokenizer = None
+        if tokenizer_path:
+            from transformers import AutoTokenizer
+            self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
+        self.memo_max_chars = memo_max_chars
+        self._memo_count = lru_cache(maxsize=memo_size)(self._count)
+
+    def count(self, text: str):
+        if len(text) <= self.memo_max_chars:
+            return self._memo_count(text)
+        return self._count(text)
+
+    def _count(self, text: str):
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        ascii_chars = len(text.encode('ascii', 'ignore'))
+        return (ascii_chars + 3) // 4 + len(text) - ascii_chars
+
+
+class PromptBudget:
+    """Token cap shared by the prompt builders; 0 disables it."""
+
+    def __init__(self, max_tokens: int = 0):
+        self.max_tokens = max_tokens
+        self.counter = TokenCounter()
+        self.tokenizer_path = ""
+        self.lock = threading.Lock()
+
+    def configure(self, max_tokens: int, tokenizer_path: str = ""):
+        with self.lock:
+            self.max_tokens = max_tokens
+            if tokenizer_path != self.tokenizer_path:
+                self.counter = TokenCounter(tokenizer_path)
+                self.tokenizer_path = tokenizer_path
+
+    def count(self, text: str):
+        return self.counter.count(text)
+
+
+PROMPT_BUDGET = PromptBudget()
+
+
+def select_within_budget(candidates, budget: int):
+    """
+    Keep the highest-scoring candidates whose costs fit into the budget.
+
+    Args:
+        candidates (list): (score, cost, key) tuples
+        budget (int): tokens available for the candidates
+
+    Returns:
+        set: keys of the kept candidates
+    """
+    kept = set()
+    for score, cost, key in sorted(candidates, key=lambda c: -c[0]):
+        if cost <= budget:
+            kept.add(key)
+            budget -= cost
+    return kept
+
+
+def pack_in_order(costs: list, budget: int, min_items: int = 1):
+    """
+    Split a sequence into consecutive groups whose costs fit into the budget, filling each greedily.
+
+    A group only depends on the items before its end, so appending items changes the last group
+    at most. Groups hold at least ``min_items`` items even when those exceed the budget.
+
+    Args:
+        costs (list): token cost of each item
+        budget (int): tokens available per group
+        min_items (int): minimal number of items per group
+
+    Returns:
+        list: (start, stop) slices of the groups
+    """
+    groups = []
+    start = total = 0
+    for i, cost in enumerate(costs):
+        if i - start >= min_items and total + cost > budget:
+            groups.append((start, i))
+            start, total = i, 0
+        total += cost
+    if start < len(costs):
+        groups.append((start, len(costs)))
+    return groups
@@ -0,0 +1,146 @@
+import asyncio
+import time
+from collections import deque
+
+
+class TokenBucket:
+    """Bucket refilled at ``rate_per_minute / 60`` per second, holding at most ``burst_seconds`` of refill."""
+
+    def __init__(self, rate_per_minute: float, burst_seconds: float = 1.0):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount, now):
+        """Seconds until ``amount`` can be taken; amounts above the capacity only need a full bucket."""
+        self.refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(missing, 0.0) / self.rate
+
+    def take(self, amount):
+        # 可以透支，透支部分由后续补充抵扣
+        self.level -= amount
+
+    def give(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """
+    Client-side requests-per-minute and tokens-per-minute limiter shared by all LLM calls.
+
+    Each request reserves one request and its estimated tokens before it is sent, and
+    ``reconcile`` corrects the token bucket with the usage the server reports. Buckets refill
+    continuously and hold at most ``burst_seconds`` worth of quota, so requests are paced evenly
+    instead of bursting up to the per-minute limit. Waiting requests are queued per key (one key per
+    question), and the queues share the quota by tokens with start-time fair queueing. A question
+    sending long prompts thus cannot hold back questions sending short ones. Must be used from a
+    single event loop.
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0, burst_seconds: float = 1.0):
+        self.requests = TokenBucket(requests_per_minute, burst_seconds) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds) if tokens_per_minute > 0 else None
+        self.queues = {}
+        # 公平队列的虚拟时间：每个队列已获得的 token 数，以及最近一次放行的起始标签
+        self.virtual = {}
+        self.clock = 0.0
+        self.scheduler = None
+        self.waits = deque(maxlen=1000)
+        self.granted = 0
+        self.estimated_tokens = 0
+        self.actual_tokens = 0
+
+    def _time_until(self, tokens, now):
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.time_until(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.time_until(tokens, now))
+        return wait
+
+    async def _schedule(self):
+        while self.queues:
+            key = min(self.queues, key=lambda k: self.virtual[k] + self.queues[k][0][0])
+            queue = self.queues[key]
+            tokens, future = queue[0]
+            if future.cancelled():
+                queue.popleft()
+                if not queue:
+                    del self.queues[key]
+                continue
+            wait = self._time_until(tokens, time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+            queue.popleft()
+            future.set_result(None)
+            self.clock = self.virtual[key]
+            self.virtual[key] += tokens
+            if not queue:
+                del self.queues[key]
+            # 空闲且虚拟时间已被追上的键重新排队时本就从当前虚拟时间开始，删除以免短命线程的键越积越多
+            for idle in [k for k, v in self.virtual.items() if k not in self.queues and v <= self.clock]:
+                del self.virtual[idle]
+
+    async def acquire(self, tokens: int, key=None):
+        """
+        Wait until a request with ``tokens`` estimated tokens fits into the quota.
+
+        Args:
+            tokens (int): Estimated prompt plus completion tokens
+            key: Fair-queueing key, e.g. the question the request belongs to
+
+        Returns:
+            float: Seconds spent waiting in the queue
+        """
+        start = time.monotonic()
+        if self.requests is not None or self.tokens is not None:
+            future = asyncio.get_running_loop().create_future()
+            if key not in self.queues:
+                # 新进入排队的问题从当前虚拟时间开始，不能用过去的空闲换取突发
+                self.virtual[key] = max(self.virtual.get(key, 0.0), self.clock)
+                self.queues[key] = deque()
+            self.queues[key].append((tokens, future))
+            if self.scheduler is None or self.scheduler.done():
+                self.scheduler = asyncio.ensure_future(self._schedule())
+            await future
+        wait = time.monotonic() - start
+        self.waits.append(wait)
+        self.granted += 1
+        self.estimated_tokens += tokens
+        return wait
+
+    def reconcile(self, estimated: int, actual: int):
+        """Correct the token bucket once the real usage of a request is known."""
+        self.actual_tokens += actual
+        if self.tokens is not None:
+            if actual > estimated:
+                self.tokens.take(actual - estimated)
+            else:
+                self.tokens.give(estimated - actual)
+
+    def throttle(self):
+        """Empty the buckets after the server rejected a request for its rate, pausing everyone briefly."""
+        now = time.monotonic()
+        for bucket in (self.requests, self.tokens):
+            if bucket is not None:
+                bucket.refill(now)
+                bucket.level = min(bucket.level, 0.0)
+
+    def stats(self):
+        waits = sorted(self.waits)
+        return {"granted": self.granted, "queued": sum(len(q) for q in self.queues.values()),
+                "queue_wait_avg": sum(waits) / len(waits) if waits else 0.0,
+                "queue_wait_p95": waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+                "queue_wait_max": waits[-1] if waits else 0.0,
+                "estimated_tokens": self.estimated_tokens, "actual_tokens": self.actual_tokens}
@@ -1,7 +1,10 @@
-import copy
+import ast
 import os
+import re
 import hashlib
 
+from .prompt_budget import PROMPT_BUDGET, query_terms, query_relevance, select_within_budget, pack_in_order
+
 def get_video_path(video_path,cache_dir: str = 'cache'):
     video_hash = hashlib.md5(video_path.encode('utf-8')).hexdigest()
     if video_path.startswith('http://') or video_path.startswith('https://'):
@@ -10,19 +13,190 @@ def get_video_path(video_path,cache_dir: str = 'cache'):
         video_file_path = video_path
     return video_file_path
 
-def answer_with_coarse_memory_prompt(memory:list,question:str,options:list):
-    memory_prompt = "The following provides a rough description of what's shown in the video during different time periods:\n"
-    for i, mem in enumerate(memory):
-        caption = mem['general_memory']
-        start_time = mem['time_period'][0]
-        end_time = mem['time_period'][1]
-        time_period = 'from {}s to {}s. '.format(start_time,end_time)
-        memory_prompt = memory_prompt + str(i+1) + ". Time Period: " + time_period + "Content Description: "+caption + "\n\n"
-    memory_prompt = memory_prompt + "Note that since these descriptions are not very complete and detailed, some key information in the video segments of each time period may not all appear in these content descriptions. \n"
-
-    memory_prompt = memory_prompt + "Now, a question has been raised regarding the content descriptions of this video.\n" + question + "\n"
+def reply_has_keys(*keys):
+    """Reply validator for ``LLMClient.chat``: the last dictionary in the reply parses and holds all ``keys``."""
+    def validate(reply):
+        if not reply:
+            return False
+        # 与 utils.parse_answer 的解析方式一致
+        matches = re.findall(r'\{[^{}]*\}', reply.split("</think>")[-1])
+        if not matches:
+            return False
+        try:
+            parsed = ast.literal_eval(matches[-1].replace("false", "False").replace("true", "True").replace("\n", ""))
+        except (SyntaxError, ValueError, TypeError):
+            return False
+        return isinstance(parsed, dict) and all(key in parsed for key in keys)
+    return validate
+
+
+def get_video_duration(coarse_memory:list):
+    return coarse_memory[-1]['time_period'][1] - coarse_memory[0]['time_period'][0]
+
+
+def get_video_context_header(coarse_memory:list):
+    return ("There is currently a video with a total duration of {} seconds.\n".format(get_video_duration(coarse_memory)) +
+            "The following gives a general description of what is shown in the video during different time periods:\n")
+
+
+def format_coarse_entry(i:int,mem:dict):
+    return "{}. Time Period: from {}s to {}s. Content Description: {}\n\n".format(
+        i + 1, mem['time_period'][0], mem['time_period'][1], mem['general_memory'])
+
+
+def get_video_context_prefix(coarse_memory:list):
+    """
+    Video context that every prompt about a video starts with: its duration and all coarse memories.
+
+    It depends on nothing but the coarse memory, so it is byte-identical across the phases,
+    iterations and questions of a video, and LLM-side prefix or context caches can reuse it.
+    """
+    parts = [get_video_context_header(coarse_memory)]
+    for i, mem in enumerate(coarse_memory):
+        parts.append(format_coarse_entry(i, mem))
+    return "".join(parts)
+
+
+def get_prefix_hash(prefix:str):
+    return hashlib.sha256(prefix.encode('utf-8')).hexdigest()[:16]
+
+
+def get_question_block(question:str,options:list):
+    parts = ["Now, a question has been raised regarding this video.\n", question, "\n"]
     for opt in options:
-        memory_prompt = memory_prompt + opt + '\n'
+        parts.append(opt + '\n')
+    return "".join(parts)
+
+
+FINE_MEMORY_HEADER = "In addition, more detailed descriptions have been obtained for the video of some time periods:\n"
+FINE_MEMORY_BLOCK_HEADER = "Note that for the video within this time period from {} seconds to {} seconds, there is the following more detailed description:\n"
+# 超细粒度记忆沿用原版的措辞，使 LLM 能区分两个层级
+SUPER_FINE_MEMORY_BLOCK_HEADER = "Note that for the video within this time period from {} seconds to {} seconds, there is the following more detailed and accurate description:\n"
+
+
+def format_fine_memory_block(entire_mems:list,divided_mems:list,super_fine:bool=False):
+    block_header = SUPER_FINE_MEMORY_BLOCK_HEADER if super_fine else FINE_MEMORY_BLOCK_HEADER
+    parts = [block_header.format(entire_mems[0]['time_period'][0], entire_mems[-1]['time_period'][1])]
+    for mem in entire_mems:
+        parts.append("Time Period: from {}s to {}s. Content Description: {}\n".format(
+            mem['time_period'][0], mem['time_period'][1], mem['general_memory']))
+    for j, mem in enumerate(divided_mems):
+        if super_fine:
+            parts.append("    [{}]. Time Stamp: {}s. Content Description: {}\n".format(
+                j + 1, mem['time_period'][0], mem['general_memory']))
+        else:
+            parts.append("    ({}). Time Period: from {}s to {}s. Content Description: {}\n".format(
+                j + 1, mem['time_period'][0], mem['time_period'][1], mem['general_memory']))
+    parts.append("\n")
+    return "".join(parts)
+
+
+def get_fine_memory_delta(entire_fine_memory_list:list,divided_fine_memory_list:list,entire_super_fine_memory_list:list=(),divided_super_fine_memory_list:list=()):
+    """
+    Fine memories gathered so far, in the order they were extracted.
+
+    New memories are appended at the end, so the prompt of one iteration extends the one before it.
+    """
+    if len(entire_fine_memory_list) == 0 and len(entire_super_fine_memory_list) == 0:
+        return ""
+    parts = [FINE_MEMORY_HEADER]
+    for entire_mems, divided_mems in zip(entire_fine_memory_list, divided_fine_memory_list):
+        parts.append(format_fine_memory_block(entire_mems, divided_mems))
+    for entire_mems, divided_mems in zip(entire_super_fine_memory_list, divided_super_fine_memory_list):
+        parts.append(format_fine_memory_block(entire_mems, divided_mems, super_fine=True))
+    return "".join(parts)
+
+
+def get_focus_periods_note(focus_periods:list):
+    if not focus_periods:
+        return ""
+    memory_prompt = "The time periods most likely related to the question are the following, so you should give priority to them:\n"
+    for period in focus_periods:
+        memory_prompt = memory_prompt + "({},{});\n".format(period[0], period[1])
+    return memory_prompt
+
+
+def get_omitted_periods_note(num_omitted:int):
+    return "Note that the descriptions of {} other time periods are omitted here because of the length limit.\n\n".format(num_omitted)
+
+
+def periods_touch(period_a,period_b):
+    return period_a[0] <= period_b[1] and period_b[0] <= period_a[1]
+
+
+def assemble_memory_prompt(coarse_memory:list,question:str,options:list,instruction_prompt:str,fine_memories:tuple=((), (), (), ()),focus_periods:list=None,candidates:list=None):
+    """
+    Lay out a prompt as video context prefix, question, fine memory delta, focus note and instructions.
+
+    Within ``PROMPT_BUDGET`` the prompt is exactly that concatenation, so the video context prefix
+    stays byte-stable. Over it, whole coarse entries and fine memory blocks are dropped until it fits.
+    Fine memory blocks are kept first, the most recent ones first. Coarse entries that overlap or
+    touch a focus or fine memory period come next, then the rest, and within each group the entries
+    mentioning more question terms win. Kept entries keep their original order and numbering.
+
+    With ``candidates``, only those coarse entries are shown, e.g. the ones a retrieval index found
+    for the question, and the video context prefix is no longer shared with other prompts.
+
+    Args:
+        coarse_memory (list): coarse memories of the whole video
+        question (str): the question
+        options (list): options of the question, may be empty
+        instruction_prompt (str): phase-specific instructions closing the prompt
+        fine_memories (tuple): (entire_fine, divided_fine, entire_super_fine, divided_super_fine) memory lists
+        focus_periods (list): periods the type judge picked, may be None
+        candidates (list): indices of the coarse entries to show, None for all
+
+    Returns:
+        str: the prompt
+    """
+    entire_fine, divided_fine, entire_super_fine, divided_super_fine = fine_memories
+    header = get_video_context_header(coarse_memory)
+    coarse_lines = [format_coarse_entry(i, mem) for i, mem in enumerate(coarse_memory)]
+    fine_blocks = ([format_fine_memory_block(e, d) for e, d in zip(entire_fine, divided_fine)] +
+                   [format_fine_memory_block(e, d, super_fine=True) for e, d in zip(entire_super_fine, divided_super_fine)])
+    tail = get_question_block(question, options)
+    suffix = get_focus_periods_note(focus_periods) + instruction_prompt
+
+    kept_coarse = range(len(coarse_lines)) if candidates is None else sorted(candidates)
+    kept_fine = range(len(fine_blocks))
+    omitted_note = ""
+    max_tokens = PROMPT_BUDGET.max_tokens
+    if max_tokens > 0:
+        count = PROMPT_BUDGET.count
+        fixed = count(header) + count(tail) + count(suffix) + (count(FINE_MEMORY_HEADER) if fine_blocks else 0)
+        coarse_costs = {i: count(coarse_lines[i]) for i in kept_coarse}
+        fine_costs = [count(block) for block in fine_blocks]
+        if fixed + sum(coarse_costs.values()) + sum(fine_costs) > max_tokens:
+            # 细粒度记忆优先（越新越优先），其次是与关注时间段或细粒度时间段相邻的粗粒度记忆，再按与问题的词重合度排序
+            anchors = list(focus_periods or [])
+            anchors += [(e[0]['time_period'][0], e[-1]['time_period'][1]) for e in list(entire_fine) + list(entire_super_fine)]
+            terms = query_terms(question + " " + " ".join(options))
+            ranked = [(3.0 + (j + 1) / len(fine_blocks), cost, ('fine', j)) for j, cost in enumerate(fine_costs)]
+            for i in kept_coarse:
+                mem = coarse_memory[i]
+                adjacent = any(periods_touch(mem['time_period'], anchor) for anchor in anchors)
+                score = (1.0 if adjacent else 0.0) + query_relevance(mem['general_memory'], terms)
+                ranked.append((score, coarse_costs[i], ('coarse', i)))
+            kept = select_within_budget(ranked, max_tokens - fixed - count(get_omitted_periods_note(len(coarse_lines))))
+            kept_coarse = [i for i in kept_coarse if ('coarse', i) in kept]
+            kept_fine = [j for j in range(len(fine_blocks)) if ('fine', j) in kept]
+
+    if len(kept_coarse) < len(coarse_lines):
+        omitted_note = get_omitted_periods_note(len(coarse_lines) - len(kept_coarse))
+
+    parts = [header]
+    parts.extend(coarse_lines[i] for i in kept_coarse)
+    parts.append(omitted_note)
+    parts.append(tail)
+    if len(kept_fine) > 0:
+        parts.append(FINE_MEMORY_HEADER)
+        parts.extend(fine_blocks[j] for j in kept_fine)
+    parts.append(suffix)
+    return "".join(parts)
+
+
+def answer_with_coarse_memory_prompt(memory:list,question:str,options:list):
+    memory_prompt = "Note that since these descriptions are not very complete and detailed, some key information in the video segments of each time period may not all appear in these content descriptions. \n"
 
     memory_prompt = memory_prompt + "Please read the given video content descriptions and the question in depth, and determine whether you can accurately answer the given question solely based on the currently provided descriptions.\n"
 
@@ -39,23 +213,62 @@ def answer_with_coarse_memory_prompt(memory:list,question:str,options:list):
     memory_prompt = memory_prompt + '"Reason": A String. This string must be enclosed in double quotes. Show me your reasoning about your judgment. You need to ensure and check that your reasoning must be able to absolutely support your answer. \n'
     memory_prompt = memory_prompt + "Note that no additional comments should be added within the dictionary."
     memory_prompt = memory_prompt + "You must note that if an ordinal number appears in the provided question, in the vast majority of cases, you should not simply assume that this ordinal number represents the ordinal of the provided time period. You need to focus on understanding the specific meaning of this ordinal number within the question based on all the content descriptions. \n"
-    return memory_prompt
+    return assemble_memory_prompt(memory, question, options, memory_prompt)
+
+
 
+SUMMARY_INSTRUCTION = "According to the theme of the video, please write a comprehensive introduction to the video content that best highlights this theme. The introduction should be presented in a sequential narrative form, with concise and clear content, natural transitions between each part, and demonstrate the core content and development process of the video from beginning to end. \n"
+
+SUMMARY_PART_INSTRUCTION = "Please write a concise summary of this part of the video in a sequential narrative form. Keep the key people, places, objects and events together with the time periods in which they appear, since this summary will later be combined with the summaries of the other parts into an introduction to the whole video. \n"
 
 
 def get_summary_prompt(coarse_memory:list):
-    memory_prompt = "The following provides a description of what's shown in the video during different time periods.\n"
-    for i, mem in enumerate(coarse_memory):
-        caption = mem['general_memory']
-        start_time = mem['time_period'][0]
-        end_time = mem['time_period'][1]
-        time_period = 'from {}s to {}s. '.format(start_time, end_time)
-        memory_prompt = memory_prompt + str(
-            i + 1) + ". Time Period: " + time_period + "Content Description: " + caption + "\n\n"
-    memory_prompt = memory_prompt + "Please think about and understand the main content and theme of this video based on the descriptions of these different time periods. According to the theme of the video, please write a comprehensive introduction to the video content that best highlights this theme. The introduction should be presented in a sequential narrative form, with concise and clear content, natural transitions between each part, and demonstrate the core content and development process of the video from beginning to end. \n"
+    memory_prompt = get_video_context_prefix(coarse_memory)
+    memory_prompt = memory_prompt + "Please think about and understand the main content and theme of this video based on the descriptions of these different time periods. " + SUMMARY_INSTRUCTION
     return memory_prompt
 
 
+def format_summary_part(i:int,part:tuple):
+    return "Part {}. Time Period: from {}s to {}s. Summary: {}\n\n".format(i + 1, part[0], part[1], part[2])
+
+
+def get_summary_part_prompt(coarse_memory:list,start:int,stop:int):
+    """
+    Map step of the hierarchical summarization: summarize the coarse memories ``start`` to ``stop``.
+
+    The prompt does not mention the total duration of the video, so it stays the same when
+    segments are appended to the video and its cached summary can be reused.
+    """
+    parts = ["The following gives a general description of what is shown in one part of a video, from {}s to {}s, during different time periods:\n".format(
+        coarse_memory[start]['time_period'][0], coarse_memory[stop - 1]['time_period'][1])]
+    for i in range(start, stop):
+        parts.append(format_coarse_entry(i, coarse_memory[i]))
+    parts.append(SUMMARY_PART_INSTRUCTION)
+    return "".join(parts)
+
+
+def get_summary_merge_prompt(summary_parts:list,coarse_memory:list=None):
+    """
+    Reduce step of the hierarchical summarization over (start, end, summary) parts in timeline order.
+
+    With the coarse memory, this is the final step and asks for the introduction of the whole video;
+    otherwise the parts are merged into the summary of a longer part.
+    """
+    if coarse_memory is not None:
+        parts = ["There is currently a video with a total duration of {} seconds.\n".format(get_video_duration(coarse_memory)) +
+                 "The following gives summaries of consecutive parts of the video, from beginning to end:\n"]
+    else:
+        parts = ["The following gives summaries of consecutive parts of one part of a video, from {}s to {}s:\n".format(
+            summary_parts[0][0], summary_parts[-1][1])]
+    for i, part in enumerate(summary_parts):
+        parts.append(format_summary_part(i, part))
+    if coarse_memory is not None:
+        parts.append("Please think about and understand the main content and theme of this video based on the summaries of these parts. " + SUMMARY_INSTRUCTION)
+    else:
+        parts.append(SUMMARY_PART_INSTRUCTION)
+    return "".join(parts)
+
+
 def direct_answer_with_summary_prompt(summary:list,question:str):
     memory_prompt = "The following presents a rough description of the content of a video from beginning to end:\n"
     memory_prompt = memory_prompt + summary[0] + '\n\n'
@@ -97,70 +310,8 @@ def option_answer_with_summary_prompt(summary:list,question:str,options:list):
 
 
 
-def answer_with_coarse_and_fine_memory_prompt(coarse_memory:list,entire_fine_memory_list:list,divided_fine_memory_list:list,entire_super_fine_memory_list:list,divided_super_fine_memory_list:list,question:str,options:list,duration:int):
-    coarse_memory_copy = copy.deepcopy(coarse_memory)
-    fine_memory_time_period_list = []
-    super_fine_memory_time_period_list = []
-
-    for fine_memory in entire_fine_memory_list:
-        start_time = fine_memory[0]['time_period'][0]
-        end_time = fine_memory[-1]['time_period'][1]
-        fine_memory_time_period_list.append([start_time,end_time])
-
-    for super_fine_memory in entire_super_fine_memory_list:
-        start_time = super_fine_memory[0]['time_period'][0]
-        end_time = super_fine_memory[-1]['time_period'][1]
-        super_fine_memory_time_period_list.append([start_time,end_time])
-
-    coarse_memory_copy_saved = []
-    for mem in coarse_memory_copy:
-        time_period = list(mem['time_period'])
-        if time_period not in fine_memory_time_period_list:
-            coarse_memory_copy_saved.append(mem)
-
-    total_memories = coarse_memory_copy_saved
-
-    for fine_memory in entire_fine_memory_list:
-        total_memories += fine_memory
-
-    total_memories = sorted(total_memories, key=lambda x: x['time_period'][0])
-    memory_prompt = "There is currently a video with a total duration of {} seconds.\n".format(duration)
-    memory_prompt = memory_prompt+"The following gives a general description of what is shown in the video during certain time periods:\n"
-    for i, mem in enumerate(total_memories):
-        caption = mem['general_memory']
-        start_time = mem['time_period'][0]
-        end_time = mem['time_period'][1]
-        time_period = 'from {}s to {}s. '.format(start_time, end_time)
-        memory_prompt = memory_prompt + str(i + 1) + ". Time Period: " + time_period + "Content Description: " + caption + "\n\n"
-        if [start_time,end_time] in fine_memory_time_period_list:
-            idx = fine_memory_time_period_list.index([start_time,end_time])
-            divided_mems = divided_fine_memory_list[idx]
-            memory_prompt = memory_prompt + "Note that for the video within this time period from {} seconds to {} seconds, there is the following more detailed description:\n".format(start_time,end_time)
-            for j, divided_mem in enumerate(divided_mems):
-                caption = divided_mem['general_memory']
-                start_time = divided_mem['time_period'][0]
-                end_time = divided_mem['time_period'][1]
-                time_period = 'from {}s to {}s. '.format(start_time, end_time)
-
-                if [start_time,end_time] not in super_fine_memory_time_period_list:
-                    memory_prompt = memory_prompt + "    ({})".format(j+1) + ". Time Period: " + time_period + "Content Description: " + caption + "\n"
-                else:
-                    idx = super_fine_memory_time_period_list.index([start_time, end_time])
-                    divided_mems = divided_super_fine_memory_list[idx]
-                    memory_prompt = memory_prompt + "    ({})".format(j + 1) + ". Time Period: " + time_period + "Content Description: " + entire_super_fine_memory_list[idx][0]['general_memory'] + "\n"
-
-                    memory_prompt = memory_prompt + "Note that for the video within this time period from {} seconds to {} seconds, there is the following more detailed description:\n".format(
-                        start_time, end_time)
-                    for k, divided_mem in enumerate(divided_mems):
-                        caption = divided_mem['general_memory']
-                        start_time = divided_mem['time_period'][0]
-                        end_time = divided_mem['time_period'][1]
-                        memory_prompt = memory_prompt + "    [{}]".format(k + 1) + ". Time Stamp: " + "{}s. ".format(start_time) + "Content Description: " + caption + "\n"
-    memory_prompt = memory_prompt + "Now, a question has been raised regarding the content descriptions of this video.\n" + question + "\n"
-    for opt in options:
-        memory_prompt = memory_prompt + opt + '\n'
-
-    memory_prompt = memory_prompt + "Please read the given video content descriptions and the question in depth, and determine whether you can accurately answer the given question solely based on the currently provided descriptions.\n"
+def answer_with_coarse_and_fine_memory_prompt(coarse_memory:list,entire_fine_memory_list:list,divided_fine_memory_list:list,entire_super_fine_memory_list:list,divided_super_fine_memory_list:list,question:str,options:list,focus_periods:list=None):
+    memory_prompt = "Please read the given video content descriptions and the question in depth, and determine whether you can accurately answer the given question solely based on the currently provided descriptions.\n"
 
     memory_prompt = memory_prompt + "If you can answer it with absolute confidence, please answer this question and provide the time periods of the video content you are referring to. The answer you provide must have completely and absolutely objective support in the video descriptions. Do not make inferences arbitrarily.\n"
 
@@ -176,82 +327,14 @@ def answer_with_coarse_and_fine_memory_prompt(coarse_memory:list,entire_fine_mem
     memory_prompt = memory_prompt + '"Reason": A String. This string must be enclosed in double quotes. Show me your reasoning about your judgment. You need to ensure and check that your reasoning must be able to absolutely support your answer. \n'
     memory_prompt = memory_prompt + "No additional comments should be added within the dictionary."
     memory_prompt = memory_prompt + "You must note that if an ordinal number appears in the provided question, in the vast majority of cases, you should not simply assume that this ordinal number represents the ordinal of the provided time period. You need to focus on understanding the specific meaning of this ordinal number within the question based on all the content descriptions. \n"
-    return memory_prompt
+    return assemble_memory_prompt(coarse_memory, question, options, memory_prompt,
+                                  (entire_fine_memory_list, divided_fine_memory_list,
+                                   entire_super_fine_memory_list, divided_super_fine_memory_list), focus_periods)
 
 
 
-def must_answer_with_coarse_and_fine_memory_prompt(coarse_memory:list,entire_fine_memory_list:list,divided_fine_memory_list:list,entire_super_fine_memory_list:list,divided_super_fine_memory_list:list,question:str,options:list,duration:int):
-    coarse_memory_copy = copy.deepcopy(coarse_memory)
-    fine_memory_time_period_list = []
-    super_fine_memory_time_period_list = []
-
-    for fine_memory in entire_fine_memory_list:
-        start_time = fine_memory[0]['time_period'][0]
-        end_time = fine_memory[-1]['time_period'][1]
-        fine_memory_time_period_list.append([start_time, end_time])
-
-    for super_fine_memory in entire_super_fine_memory_list:
-        start_time = super_fine_memory[0]['time_period'][0]
-        end_time = super_fine_memory[-1]['time_period'][1]
-        super_fine_memory_time_period_list.append([start_time, end_time])
-
-    coarse_memory_copy_saved = []
-    for mem in coarse_memory_copy:
-        time_period = list(mem['time_period'])
-        if time_period not in fine_memory_time_period_list:
-            coarse_memory_copy_saved.append(mem)
-
-    total_memories = coarse_memory_copy_saved
-
-    for fine_memory in entire_fine_memory_list:
-        total_memories += fine_memory
-
-    total_memories = sorted(total_memories, key=lambda x: x['time_period'][0])
-    memory_prompt = "There is currently a video with a total duration of {} seconds.\n".format(duration)
-    memory_prompt = memory_prompt + "The following gives a general description of what is shown in the video during certain time periods:\n"
-    for i, mem in enumerate(total_memories):
-        caption = mem['general_memory']
-        start_time = mem['time_period'][0]
-        end_time = mem['time_period'][1]
-        time_period = 'from {}s to {}s. '.format(start_time, end_time)
-        memory_prompt = memory_prompt + str(
-            i + 1) + ". Time Period: " + time_period + "Content Description: " + caption + "\n\n"
-        if [start_time, end_time] in fine_memory_time_period_list:
-            idx = fine_memory_time_period_list.index([start_time, end_time])
-            divided_mems = divided_fine_memory_list[idx]
-            memory_prompt = memory_prompt + "Note that for the video within this time period from {} seconds to {} seconds, there is the following more detailed and accurate description:\n".format(
-                start_time, end_time)
-            for j, divided_mem in enumerate(divided_mems):
-                caption = divided_mem['general_memory']
-                start_time = divided_mem['time_period'][0]
-                end_time = divided_mem['time_period'][1]
-                time_period = 'from {}s to {}s. '.format(start_time, end_time)
-
-                if [start_time, end_time] not in super_fine_memory_time_period_list:
-                    memory_prompt = memory_prompt + "    ({})".format(
-                        j + 1) + ". Time Period: " + time_period + "Content Description: " + caption + "\n"
-                else:
-                    idx = super_fine_memory_time_period_list.index([start_time, end_time])
-                    divided_mems = divided_super_fine_memory_list[idx]
-                    memory_prompt = memory_prompt + "    ({})".format(
-                        j + 1) + ". Time Period: " + time_period + "Content Description: " + \
-                                    entire_super_fine_memory_list[idx][0]['general_memory'] + "\n"
-
-                    memory_prompt = memory_prompt + "Note that for the video within this time period from {} seconds to {} seconds, there is the following more detailed and accurate description:\n".format(
-                        start_time, end_time)
-                    for k, divided_mem in enumerate(divided_mems):
-                        caption = divided_mem['general_memory']
-                        start_time = divided_mem['time_period'][0]
-                        end_time = divided_mem['time_period'][1]
-                        memory_prompt = memory_prompt + "    [{}]".format(
-                            k + 1) + ". Time Stamp: " + "{}s. ".format(start_time) + "Content Description: " + caption + "\n"
-
-    memory_prompt = memory_prompt + "Now, a question has been raised regarding the content descriptions of this video.\n" + question + "\n"
-
-    for opt in options:
-        memory_prompt = memory_prompt + opt + '\n'
-
-    memory_prompt = memory_prompt + "Please read and understand the given video content and question in depth. "
+def must_answer_with_coarse_and_fine_memory_prompt(coarse_memory:list,entire_fine_memory_list:list,divided_fine_memory_list:list,entire_super_fine_memory_list:list,divided_super_fine_memory_list:list,question:str,options:list):
+    memory_prompt = "Please read and understand the given video content and question in depth. "
 
     if len(options) != 0:
         memory_prompt = memory_prompt + "Strictly based on the video content, select the single best option. You must choose an option from these provided options. The answer you provide must include the English letters of the options [A, B, C, D]. \n"
@@ -264,7 +347,9 @@ def must_answer_with_coarse_and_fine_memory_prompt(coarse_memory:list,entire_fin
     memory_prompt = memory_prompt + '"Time Period": A list. Fill in the list with time periods corresponding to the best answer, each in the format of a tuple (start time, end time).\n'
     memory_prompt = memory_prompt + '"Reason": A String. This string must be enclosed in double quotes. Show me your reasoning about your judgment. You need to ensure and check that your reasoning must be able to absolutely support your answer. \n'
     memory_prompt = memory_prompt + "No additional comments should be added within the dictionary."
-    return memory_prompt
+    return assemble_memory_prompt(coarse_memory, question, options, memory_prompt,
+                                  (entire_fine_memory_list, divided_fine_memory_list,
+                                   entire_super_fine_memory_list, divided_super_fine_memory_list))
 
 
 def get_answer_judge_prompt(question:str,direct_answer:str,options:list):
@@ -287,54 +372,8 @@ def get_answer_judge_prompt(question:str,direct_answer:str,options:list):
     return prompt
 
 
-def get_single_related_time_prompt(coarse_memory:list,entire_fine_memory_list:list,divided_fine_memory_list:list,question:str,options:list,excluded_periods:list,duration:float):
-    coarse_memory_copy = copy.deepcopy(coarse_memory)
-    fine_memory_time_period_list = []
-
-    for fine_memory in entire_fine_memory_list:
-        start_time = fine_memory[0]['time_period'][0]
-        end_time = fine_memory[-1]['time_period'][1]
-        fine_memory_time_period_list.append([start_time, end_time])
-
-    coarse_memory_copy_saved = []
-    for mem in coarse_memory_copy:
-        time_period = list(mem['time_period'])
-        if time_period not in fine_memory_time_period_list:
-            coarse_memory_copy_saved.append(mem)
-
-    total_memories = coarse_memory_copy_saved
-
-    for fine_memory in entire_fine_memory_list:
-        total_memories += fine_memory
-
-    total_memories = sorted(total_memories, key=lambda x: x['time_period'][0])
-    memory_prompt = "There is currently a video with a total duration of {} seconds.\n".format(duration)
-    memory_prompt = memory_prompt + "The following gives a general description of what is shown in the video during certain time periods:\n"
-    for i, mem in enumerate(total_memories):
-        caption = mem['general_memory']
-        start_time = mem['time_period'][0]
-        end_time = mem['time_period'][1]
-        time_period = 'from {}s to {}s. '.format(start_time, end_time)
-        memory_prompt = memory_prompt + str(
-            i + 1) + ". Time Period: " + time_period + "Content Description: " + caption + "\n\n"
-        # memory_prompt = memory_prompt + "Time Period: " + time_period + "Content Description: " + caption + "\n\n"
-        if [start_time, end_time] in fine_memory_time_period_list:
-            idx = fine_memory_time_period_list.index([start_time, end_time])
-            divided_mems = divided_fine_memory_list[idx]
-            memory_prompt = memory_prompt + "Note that for the video within this time period from {} seconds to {} seconds, there is the following more detailed description:\n".format(
-                start_time, end_time)
-            for j, divided_mem in enumerate(divided_mems):
-                caption = divided_mem['general_memory']
-                start_time = divided_mem['time_period'][0]
-                end_time = divided_mem['time_period'][1]
-                time_period = 'from {}s to {}s. '.format(start_time, end_time)
-                memory_prompt = memory_prompt + "    ({})".format(
-                    j + 1) + ". Time Period: " + time_period + "Content Description: " + caption + "\n"
-
-    memory_prompt = memory_prompt + "Now, a question has been raised regarding this entire video which has a duration of {} seconds.\n".format(duration) + question + "\n"
-    for opt in options:
-        memory_prompt = memory_prompt + opt + '\n'
-    memory_prompt = memory_prompt + "Please read the given video content descriptions and the question in depth.\n"
+def get_single_related_time_prompt(coarse_memory:list,entire_fine_memory_list:list,divided_fine_memory_list:list,question:str,options:list,excluded_periods:list,focus_periods:list=None,candidates:list=None):
+    memory_prompt = "Please read the given video content descriptions and the question in depth.\n"
     memory_prompt = memory_prompt + "You do not need to answer this question.\n"
 
     memory_prompt = memory_prompt + "Your first task is to identify, based on the video content in each time period, the single time period that is most relevant to the question and that you think requires further elaboration of its video content details to make the answer to this question more explicit.\n"
@@ -357,23 +396,34 @@ def get_single_related_time_prompt(coarse_memory:list,entire_fine_memory_list:li
     memory_prompt = memory_prompt + '"Reason": A String. This string must be enclosed in double quotes. Show me your reasons for the time period and instruction you provided.\n'
     memory_prompt = memory_prompt + "No additional comments should be added within the dictionary."
     memory_prompt = memory_prompt + "You must note that if an ordinal number appears in the provided question, in the vast majority of cases, you should not simply assume that this ordinal number represents the ordinal of the provided time period. You need to focus on understanding the specific meaning of this ordinal number within the question based on all the content descriptions. \n"
-    return memory_prompt
+    return assemble_memory_prompt(coarse_memory, question, options, memory_prompt,
+                                  (entire_fine_memory_list, divided_fine_memory_list, (), ()), focus_periods, candidates)
 
 
-def question_type_judge_prompt(memory:list,question:str,options:list):
-    memory_prompt = "The following provides a rough description of what's shown in the video during different time periods:\n"
-    for i, mem in enumerate(memory):
-        caption = mem['general_memory']
-        start_time = mem['time_period'][0]
-        end_time = mem['time_period'][1]
-        time_period = 'from {}s to {}s. '.format(start_time,end_time)
-        memory_prompt = memory_prompt + str(i+1) + ". Time Period: " + time_period + "Content Description: "+caption + "\n\n"
-        #memory_prompt = memory_prompt + "Time Period: " + time_period + "Content Description: " + caption + "\n\n"
-    memory_prompt = memory_prompt + "Now, a question has been raised regarding this video.\n" + question + "\n"
-    for opt in options:
-        memory_prompt = memory_prompt + opt + '\n'
+def get_top_k_related_times_prompt(coarse_memory:list,question:str,options:list,top_k:int,focus_periods:list=None,candidates:list=None):
+    memory_prompt = "Please read the given video content descriptions and the question in depth.\n"
+    memory_prompt = memory_prompt + "You do not need to answer this question.\n"
+
+    memory_prompt = memory_prompt + "Your first task is to identify, based on the video content in each time period, at most {} time periods that are most relevant to the question and that you think require further elaboration of their video content details to make the answer to this question more explicit. Rank them from the most relevant to the least relevant.\n".format(top_k)
+
+    memory_prompt = memory_prompt + "In addition, assume there is now a caption model that can describe the videos of the selected time periods according to your instruction.\n"
+    memory_prompt = memory_prompt +  "Your second task is to consider what detailed content in the videos of the time periods you have selected you want the model to focus on describing, and provide a single instruction that applies to all of them.\n"
+    memory_prompt = memory_prompt + "For example, assume that the entire video segment is about an offensive play in a certain football game, and you want to focus on the passing situation of the football during this offensive play. The instruction you give to the model could be:\n"
+    memory_prompt = memory_prompt + "Please observe all the details in this video very carefully and provide a detailed and objective description of what is shown in the video. If this video is about an offensive play in a football match, you should focus particularly on the passing situation of the football during this offensive play. \n"
+
+    memory_prompt = memory_prompt + "Note that you should organize your instruction by strictly referring to the language expressions in the above example.\n"
+
+    memory_prompt = memory_prompt + "You should output in a strictly standardized dictionary format containing three key-value pairs:\n"
+    memory_prompt = memory_prompt + '"Time Periods": A list. Fill in the list with at most {} most relevant time periods ranked by relevance, each in the tuple format (start time, end time).\n'.format(top_k)
+    memory_prompt = memory_prompt + '"Instruction": A String. This string must be enclosed in double quotes. Show me the instruction you want to give to the caption model for the second task. \n'
+    memory_prompt = memory_prompt + '"Reason": A String. This string must be enclosed in double quotes. Show me your reasons for the time periods and instruction you provided.\n'
+    memory_prompt = memory_prompt + "No additional comments should be added within the dictionary."
+    memory_prompt = memory_prompt + "You must note that if an ordinal number appears in the provided question, in the vast majority of cases, you should not simply assume that this ordinal number represents the ordinal of the provided time period. You need to focus on understanding the specific meaning of this ordinal number within the question based on all the content descriptions. \n"
+    return assemble_memory_prompt(coarse_memory, question, options, memory_prompt, focus_periods=focus_periods, candidates=candidates)
+
 
-    memory_prompt = memory_prompt + "Please read the given video content descriptions and the question in depth.\n"
+def question_type_judge_prompt(memory:list,question:str,options:list,candidates:list=None):
+    memory_prompt = "Please read the given video content descriptions and the question in depth.\n"
 
     memory_prompt = memory_prompt + "Since most of these descriptions are rather rough and some detailed information is lost, my task is to try my best to find the time periods related to the given question, and then provide more detailed descriptions of the video content of these time periods. \n"
     memory_prompt = memory_prompt + "In order to assist me in completing my task, your task is to:\n"
@@ -396,4 +446,4 @@ def question_type_judge_prompt(memory:list,question:str,options:list):
     memory_prompt = memory_prompt + '"Reason": A String. This string must be enclosed in double quotes. Show me your reasons for the time periods you provided.\n'
     memory_prompt = memory_prompt + "No additional comments should be added within the dictionary."
 
-    return memory_prompt
\ No newline at end of file
+    return assemble_memory_prompt(memory, question, options, memory_prompt, candidates=candidates)
\ No newline at end of file
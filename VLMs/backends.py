@@ -0,0 +1,160 @@
+import base64
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import httpx
+
+from .utils import *
+
+
+def prepare_vlm_inputs(processor, messages):
+    """CPU side of a batch: chat template, vision preprocessing and tokenization."""
+    texts = [
+        processor.apply_chat_template(msg, tokenize=False, add_generation_prompt=True)
+        for msg in messages
+    ]
+    image_inputs, video_inputs, video_kwargs = process_clip_vision_info(messages)
+    fps_inputs = video_kwargs['fps']
+    inputs = processor(
+        text=texts,
+        images=image_inputs,
+        videos=video_inputs,
+        fps=fps_inputs,
+        padding=True,
+        return_tensors="pt",
+    )
+    return inputs
+
+
+def generate_vlm_outputs(model, processor, inputs, max_new_tokens: int = 2048):
+    """Accelerator side of a batch: transfer, generate and decode."""
+    inputs = inputs.to("cuda")
+
+    generated_ids = model.generate(**inputs, max_new_tokens=max_new_tokens)
+    generated_ids_trimmed = [
+        out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
+    ]
+    output_texts = processor.batch_decode(
+        generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=True
+    )
+    return output_texts
+
+
+def completed_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class HFBackend:
+    """
+    In-process Hugging Face ``model.generate`` on static, padded batches.
+
+    ``submit`` runs the whole batch before returning, so its futures are always done.
+    """
+    remote = False
+    max_in_flight = 0
+
+    def __init__(self, model, processor, max_new_tokens: int = 2048):
+        self.model = model
+        self.processor = processor
+        self.max_new_tokens = max_new_tokens
+
+    def count_text_tokens(self, message):
+        text = self.processor.apply_chat_template(message, tokenize=False, add_generation_prompt=True)
+        return len(self.processor.tokenizer(text)["input_ids"])
+
+    def prepare(self, messages):
+        return prepare_vlm_inputs(self.processor, messages)
+
+    def submit(self, prepared):
+        output_texts = generate_vlm_outputs(self.model, self.processor, prepared, self.max_new_tokens)
+        return [completed_future(output_text) for output_text in output_texts]
+
+
+class OpenAIServerBackend:
+    """
+    Clip captioning against an OpenAI-compatible chat completions server such as vLLM.
+
+    Every clip is sent as its own request, with its frames sampled and resized exactly as for the
+    in-process model and sent as a ``data:video/jpeg`` URL. Requests run concurrently on a shared,
+    keep-alive connection pool. The server batches whatever is in flight (continuous batching), so
+    a slow clip no longer holds back the rest of its batch.
+    """
+    remote = True
+
+    def __init__(self, base_url, model_name, api_key: str = "EMPTY", max_concurrency: int = 16,
+                 max_new_tokens: int = 2048, timeout: float = 1800, jpeg_quality: int = 95):
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.model_name = model_name
+        self.max_new_tokens = max_new_tokens
+        self.jpeg_quality = jpeg_quality
+        # 在途请求上限为并发数的两倍，使服务端始终有排队的请求可以补入批次
+        self.max_in_flight = 2 * max_concurrency
+        self.client = httpx.Client(
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        )
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    def count_text_tokens(self, message):
+        return None
+
+    def encode_video(self, vision_info):
+        video, sample_fps = fetch_video_frames(vision_info)
+        frames = video.clamp(0, 255).round().byte().permute(0, 2, 3, 1).numpy()
+        encoded = []
+        for frame in frames:
+            ok, buffer = cv2.imencode('.jpg', cv2.cvtColor(frame, cv2.COLOR_RGB2BGR),
+                                      [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            if not ok:
+                raise ValueError("Failed to encode a clip frame as JPEG.")
+            encoded.append(base64.b64encode(buffer.tobytes()).decode('ascii'))
+        return "data:video/jpeg;base64," + ",".join(encoded), sample_fps
+
+    def to_request(self, message):
+        request_messages = []
+        sample_fps = None
+        for turn in message:
+            if isinstance(turn["content"], str):
+                request_messages.append(turn)
+                continue
+            content = []
+            for ele in turn["content"]:
+                if "video" in ele:
+                    video_url, sample_fps = self.encode_video(ele)
+                    content.append({"type": "video_url", "video_url": {"url": video_url}})
+                else:
+                    content.append({"type": "text", "text": ele["text"]})
+            request_messages.append({"role": turn["role"], "content": content})
+        request = {
+            "model": self.model_name,
+            "messages": request_messages,
+            "max_tokens": self.max_new_tokens,
+            "temperature": 0.0,
+        }
+        if sample_fps is not None:
+            request["mm_processor_kwargs"] = {"fps": sample_fps}
+        return request
+
+    def prepare(self, messages):
+        return [self.to_request(message) for message in messages]
+
+    def complete(self, request):
+        response = self.client.post(self.url, json=request)
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+    def submit(self, prepared):
+        return [self.executor.submit(self.complete, request) for request in prepared]
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.client.close()
+
+
+def get_vlm_backend(model, processor):
+    """Wrap an in-process model into an ``HFBackend``; backends from ``create_vlm`` pass through."""
+    if hasattr(model, "submit"):
+        return model
+    return HFBackend(model, processor)
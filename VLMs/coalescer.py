@@ -0,0 +1,85 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class CoalescingBackend:
+    """
+    Share one VLM backend between concurrent extraction calls, merging their clips into common batches.
+
+    ``submit`` only queues the clip messages. A dispatcher thread collects up to ``batch_size``
+    messages, waiting at most ``max_wait`` seconds after the first one for others to arrive, and runs
+    them through the wrapped backend as one batch. Questions extracting fine memory at the same time
+    thus fill each other's batches, and the model is only ever driven from the dispatcher thread.
+    """
+
+    def __init__(self, backend, batch_size: int, max_wait: float = 0.05):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        # 允许每个调用方提交多批，以便与其他调用方的短视频合并
+        self.max_in_flight = 2 * batch_size
+        self.remote = backend.remote
+        self.batches = 0
+        self.clips = 0
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._dispatch, name="vlm-coalescer", daemon=True)
+        self.thread.start()
+
+    def count_text_tokens(self, message):
+        return None
+
+    def prepare(self, messages):
+        return messages
+
+    def submit(self, prepared):
+        futures = []
+        for message in prepared:
+            future = Future()
+            self.queue.put((message, future))
+            futures.append(future)
+        return futures
+
+    def _collect(self, first):
+        pending = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(pending) < self.batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                self.queue.put(None)
+                break
+            pending.append(item)
+        return pending
+
+    def _dispatch(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            pending = self._collect(item)
+            self.batches += 1
+            self.clips += len(pending)
+            try:
+                outputs = self.backend.submit(self.backend.prepare([message for message, _ in pending]))
+                results = [output.result() for output in outputs]
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(pending, results):
+                future.set_result(result)
+
+    def stats(self):
+        return {"batches": self.batches, "clips": self.clips,
+                "clips_per_batch": self.clips / self.batches if self.batches else 0.0}
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
@@ -0,0 +1,137 @@
+import queue
+import threading
+import time
+
+
+class StageStats:
+    """Busy time of one pipeline stage, summed over all of its workers."""
+
+    def __init__(self, name, workers: int = 1):
+        self.name = name
+        self.workers = workers
+        self.busy_seconds = 0.0
+        self.items = 0
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.busy_seconds += seconds
+            self.items += 1
+
+    def utilization(self, wall_seconds):
+        return self.busy_seconds / (wall_seconds * self.workers) if wall_seconds > 0 else 0.0
+
+
+class PipelineReport:
+    def __init__(self, stages):
+        self.stages = stages
+        self.start_time = time.perf_counter()
+        self.wall_seconds = 0.0
+
+    def finish(self):
+        self.wall_seconds = time.perf_counter() - self.start_time
+
+    def utilization(self):
+        return {stage.name: stage.utilization(self.wall_seconds) for stage in self.stages}
+
+    def __str__(self):
+        parts = [f"{stage.name} {stage.utilization(self.wall_seconds) * 100:.1f}% ({stage.busy_seconds:.1f}s)"
+                 for stage in self.stages]
+        return f"wall {self.wall_seconds:.1f}s, " + ", ".join(parts)
+
+
+def run_pipelined(batches, prepare_fn, generate_fn, prefetch: int = 2, num_workers: int = 1, report: list = None):
+    """
+    Overlap CPU-side batch preparation with model generation.
+
+    Worker threads pull batches from ``batches`` (decode), run ``prepare_fn(batch_idx, batch)`` (preprocess)
+    and hand the result to the calling thread, which runs ``generate_fn(prepared)``. At most ``prefetch``
+    batches are in flight between the source and the generate stage, so memory stays bounded while
+    batch N+1 is prepared during the generation of batch N.
+
+    Args:
+        batches: Iterable of batches, consumed by one worker at a time
+        prepare_fn: CPU work for a batch, called on worker threads
+        generate_fn: Accelerator work for a prepared batch, called on the calling thread
+        prefetch (int): Maximum number of batches pulled from the source but not yet generated
+        num_workers (int): Number of preparation threads
+        report (list): If given, a ``PipelineReport`` with per-stage utilization is appended once done
+
+    Yields:
+        tuple: (batch index, generate_fn output), in source order
+    """
+    decode_stats = StageStats("decode", num_workers)
+    prepare_stats = StageStats("prepare", num_workers)
+    generate_stats = StageStats("generate")
+    pipeline_report = PipelineReport([decode_stats, prepare_stats, generate_stats])
+
+    source = enumerate(batches)
+    source_lock = threading.Lock()
+    slots = threading.Semaphore(max(prefetch, 1))
+    ready = queue.Queue()
+    stop = threading.Event()
+
+    def worker():
+        while not stop.is_set():
+            slots.acquire()
+            if stop.is_set():
+                return
+            start = time.perf_counter()
+            with source_lock:
+                try:
+                    batch_idx, batch = next(source)
+                except StopIteration:
+                    # 归还许可，否则 num_workers > prefetch 时其余线程会一直阻塞在 acquire 上
+                    slots.release()
+                    ready.put(None)
+                    return
+                except Exception as e:
+                    slots.release()
+                    ready.put((-1, e))
+                    return
+            decode_stats.add(time.perf_counter() - start)
+            start = time.perf_counter()
+            try:
+                prepared = prepare_fn(batch_idx, batch)
+            except Exception as e:
+                slots.release()
+                ready.put((-1, e))
+                return
+            prepare_stats.add(time.perf_counter() - start)
+            ready.put((batch_idx, prepared))
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(num_workers, 1))]
+    for thread in threads:
+        thread.start()
+
+    pending = {}
+    next_idx = 0
+    finished_workers = 0
+    try:
+        while finished_workers < len(threads) or pending:
+            if next_idx not in pending:
+                if finished_workers == len(threads):
+                    break
+                item = ready.get()
+                if item is None:
+                    finished_workers += 1
+                    continue
+                batch_idx, prepared = item
+                if batch_idx < 0:
+                    raise prepared
+                pending[batch_idx] = prepared
+                continue
+            prepared = pending.pop(next_idx)
+            start = time.perf_counter()
+            outputs = generate_fn(prepared)
+            generate_stats.add(time.perf_counter() - start)
+            slots.release()
+            yield next_idx, outputs
+            next_idx += 1
+    finally:
+        stop.set()
+        for _ in threads:
+            slots.release()
+        pipeline_report.finish()
+        if report is not None:
+            report.append(pipeline_report)
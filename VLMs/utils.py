@@ -3,6 +3,25 @@ from decord import VideoReader, cpu
 import cv2
 import os
 import subprocess
+import threading
+import json
+from collections import OrderedDict
+import numpy as np
+from memory_cache import make_cache_key
+import torch
+from torchvision import transforms
+from torchvision.transforms import InterpolationMode
+from qwen_vl_utils.vision_process import (FRAME_FACTOR, IMAGE_FACTOR, VIDEO_MAX_PIXELS, VIDEO_MIN_PIXELS,
+                                          VIDEO_TOTAL_PIXELS, extract_vision_info, fetch_image, fetch_video,
+                                          smart_nframes, smart_resize)
+
+# 批量解码时单个 batch 的内存上限（字节）
+DECODE_BATCH_BYTES = 256 * 1024 * 1024
+# 送入 Qwen processor 的短视频像素预算
+CLIP_TOTAL_PIXELS = 128000 * 28 * 28 * 0.9
+CLIP_MIN_PIXELS = 16 * 28 * 28
+# 解码帧 LRU 缓存的默认容量（字节）
+FRAME_CACHE_BYTES = 1024 * 1024 * 1024
 
 def download_bilibili_video(url, dest_path):
     if '.mp4' in dest_path:
@@ -29,8 +48,318 @@ def get_video_path(video_path,cache_dir: str = 'cache'):
     return video_file_path
 
 
-def get_video_frames(video_path, cache_dir: str = 'cache', frames_per_second: float = 1.0,
-                     short_video_frames: int = 100, time_period= None, overlapping_frames:int=0,temp_video_dir:str='temp_videos'):
+def get_video_fingerprint(video_path, chunk_size: int = 1024 * 1024):
+    """
+    Fast content fingerprint of a video file.
+
+    Hashes the file size together with ``chunk_size`` bytes from the head, middle and tail of the
+    file, so identical files share a fingerprint regardless of their path or source URL.
+    """
+    file_size = os.path.getsize(video_path)
+    md5 = hashlib.md5(str(file_size).encode('utf-8'))
+    with open(video_path, 'rb') as f:
+        for offset in sorted({0, max(file_size // 2 - chunk_size // 2, 0), max(file_size - chunk_size, 0)}):
+            f.seek(offset)
+            md5.update(f.read(chunk_size))
+    return md5.hexdigest()
+
+
+class FrameCache:
+    """
+    Process-level LRU cache of decoded frames, bounded by a byte budget.
+
+    Keys are ``(video fingerprint, frame index, (height, width))`` where the size is the decode size,
+    or ``(-1, -1)`` for native resolution.
+    """
+
+    def __init__(self, max_bytes: int = FRAME_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.frames = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is None:
+                self.misses += 1
+                return None
+            self.frames.move_to_end(key)
+            self.hits += 1
+            return frame
+
+    def put(self, key, frame):
+        if frame.nbytes > self.max_bytes:
+            return
+        frame = frame.copy()
+        frame.flags.writeable = False
+        with self.lock:
+            if key in self.frames:
+                self.current_bytes -= self.frames.pop(key).nbytes
+            self.frames[key] = frame
+            self.current_bytes += frame.nbytes
+            self._evict()
+
+    def set_max_bytes(self, max_bytes: int):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self.frames:
+            _, frame = self.frames.popitem(last=False)
+            self.current_bytes -= frame.nbytes
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "frames": len(self.frames),
+                "bytes": self.current_bytes,
+            }
+
+
+FRAME_CACHE = FrameCache()
+
+
+class VideoIndex:
+    """
+    Container metadata and keyframe table of a video, loaded from its sidecar files.
+
+    ``key_indices`` is memory-mapped from disk, so opening the index of a long video costs a
+    JSON read and an mmap rather than a full demux of the file.
+    """
+
+    def __init__(self, metadata: dict, key_indices):
+        self.fingerprint = metadata['fingerprint']
+        self.fps = metadata['fps']
+        self.total_frames = metadata['total_frames']
+        self.duration = metadata['duration']
+        self.height = metadata['height']
+        self.width = metadata['width']
+        self.key_indices = key_indices
+
+    def anchor(self, frame_index: int) -> int:
+        """Last keyframe at or before ``frame_index``, i.e. where a seek for that frame should land."""
+        pos = int(np.searchsorted(self.key_indices, frame_index, side='right')) - 1
+        return int(self.key_indices[pos]) if pos >= 0 else 0
+
+
+def load_video_index(video_path, cache_dir: str = 'cache', index_dir: str = 'video_index'):
+    """
+    Load the sidecar index of a video from ``cache_dir/index_dir``, building it on first use.
+
+    The sidecar is ``<fingerprint>.json`` (fps, frame count, duration, frame size) plus
+    ``<fingerprint>_keyframes.npy`` (keyframe indices, the seek table).
+    """
+    fingerprint = get_video_fingerprint(video_path)
+    os.makedirs(os.path.join(cache_dir, index_dir), exist_ok=True)
+    meta_path = os.path.join(cache_dir, index_dir, f'{fingerprint}.json')
+    key_path = os.path.join(cache_dir, index_dir, f'{fingerprint}_keyframes.npy')
+
+    if not (os.path.exists(meta_path) and os.path.exists(key_path)):
+        vr = VideoReader(video_path, ctx=cpu(0))
+        height, width, _ = vr[0].shape
+        metadata = {
+            "fingerprint": fingerprint,
+            "fps": vr.get_avg_fps(),
+            "total_frames": len(vr),
+            "duration": len(vr) / vr.get_avg_fps(),
+            "height": height,
+            "width": width,
+        }
+        key_indices = np.asarray(vr.get_key_indices(), dtype=np.int64)
+        # 先写临时文件再原子替换，避免并发进程读到不完整的 sidecar
+        tmp_key_path = f'{key_path}.{os.getpid()}.tmp.npy'
+        np.save(tmp_key_path, key_indices)
+        os.replace(tmp_key_path, key_path)
+        tmp_meta_path = f'{meta_path}.{os.getpid()}.tmp'
+        with open(tmp_meta_path, 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, indent=4)
+        os.replace(tmp_meta_path, meta_path)
+        print("Video Index Built in:", meta_path)
+
+    with open(meta_path, 'r') as f:
+        metadata = json.load(f)
+    return VideoIndex(metadata, np.load(key_path, mmap_mode='r'))
+
+
+class SeekingFrameReader:
+    """
+    Reader for a short span of a long video that seeks to the keyframe before each requested frame
+    and decodes forward from there, instead of building a decord index over the whole file.
+
+    ``get_batch`` takes sorted frame indices and returns an RGB array of shape (N, H, W, 3).
+    Frames are numbered and decoded by cv2 and resized with ``cv2.INTER_AREA``, so they can differ
+    slightly from decord-decoded frames of the same period (decord scales in its decoder and may
+    count frames differently around edit lists or variable frame rates). Call ``close`` to release
+    the ``cv2.VideoCapture``.
+    """
+
+    def __init__(self, video_path, video_index: VideoIndex, frame_size=(-1, -1)):
+        self.video_index = video_index
+        self.frame_size = frame_size
+        self.cap = cv2.VideoCapture(video_path)
+        self.position = None
+        self.last_frame = None
+
+    def get_batch(self, frame_indices):
+        frames = []
+        for idx in frame_indices:
+            if self.position is not None and idx == self.position - 1 and self.last_frame is not None:
+                frames.append(self.last_frame)
+                continue
+            anchor = self.video_index.anchor(idx)
+            if self.position is None or idx < self.position or anchor > self.position:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, anchor)
+                self.position = anchor
+            while self.position < idx:
+                self.cap.grab()
+                self.position += 1
+            ok, frame = self.cap.read()
+            self.position += 1
+            if not ok:
+                raise RuntimeError(f"Failed to decode frame {idx}")
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            if self.frame_size != (-1, -1):
+                frame = cv2.resize(frame, (self.frame_size[1], self.frame_size[0]), interpolation=cv2.INTER_AREA)
+            self.last_frame = frame
+            frames.append(frame)
+        return np.stack(frames)
+
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def __del__(self):
+        self.close()
+
+
+def sample_frame_indices(fps, total_frames, frames_per_second, time_period=None):
+    """
+    Compute the sampled frame indices in one vectorized pass.
+
+    Sample times are ``start + k / frames_per_second`` rather than an accumulated float, so long
+    videos no longer drift by a frame every few thousand samples.
+
+    Returns:
+        tuple: (non-decreasing int64 array of frame indices, start frame of the sampled period)
+    """
+    # 根据 time_period 确定子视频的起始和结束帧
+    if time_period:
+        start_time, end_time = time_period
+        start_frame = int(start_time * fps)
+        end_frame = min(int(end_time * fps), total_frames)
+    else:
+        start_time, end_time = 0, total_frames / fps
+        start_frame = 0
+        end_frame = total_frames
+
+    num_samples = max(int(np.ceil((end_time - start_time) * frames_per_second)) + 1, 0)
+    sample_times = start_time + np.arange(num_samples) / frames_per_second
+    frame_indices = (sample_times[sample_times < end_time] * fps).astype(np.int64)
+    frame_indices = frame_indices[(frame_indices >= start_frame) & (frame_indices < end_frame)]
+    return frame_indices, start_frame
+
+
+def decode_frames(vr, frame_indices, max_batch_bytes: int = DECODE_BATCH_BYTES):
+    """
+    Decode frames with bulk ``get_batch`` calls instead of one seek per frame.
+
+    Indices must be sorted so every batch decodes forward. The batch size is derived from the
+    decoded frame size so a single batch stays within ``max_batch_bytes``.
+    """
+    frame_indices = [int(idx) for idx in frame_indices]
+    frames = []
+    batch_size = 1
+    start = 0
+    while start < len(frame_indices):
+        batch = vr.get_batch(frame_indices[start: start + batch_size])
+        batch = batch.asnumpy() if hasattr(batch, 'asnumpy') else batch
+        frames.extend(batch)
+        start += len(batch)
+        batch_size = max(1, max_batch_bytes // batch[0].nbytes)
+    return frames
+
+
+def get_clip_frame_size(height: int, width: int, nframes: int, max_pixels: int,
+                        min_pixels: int = CLIP_MIN_PIXELS, total_pixels: float = CLIP_TOTAL_PIXELS):
+    """
+    Frame size ``fetch_video`` resizes a clip of ``nframes`` sampled frames to.
+
+    Mirrors the pixel-budget rules of ``qwen_vl_utils.fetch_video`` so that frames decoded at this
+    size pass through the processor's ``smart_resize`` unchanged.
+
+    Returns:
+        tuple: (resized_height, resized_width)
+    """
+    max_pixels = min(max_pixels, max(min(VIDEO_MAX_PIXELS, total_pixels / nframes * FRAME_FACTOR),
+                                     int(min_pixels * 1.05)))
+    return smart_resize(height, width, factor=IMAGE_FACTOR, min_pixels=min_pixels, max_pixels=max_pixels)
+
+
+def decode_cached_frames(open_reader, frame_indices, frame_cache: FrameCache, key_prefix,
+                         max_batch_bytes: int = DECODE_BATCH_BYTES):
+    """
+    Like ``decode_frames``, but serves frames from ``frame_cache`` and only decodes the misses.
+
+    ``open_reader`` is called to get the reader only if something has to be decoded, and
+    ``key_prefix`` is ``(video fingerprint, decode size)``.
+    """
+    fingerprint, frame_size = key_prefix
+    frames = {}
+    for idx in frame_indices:
+        idx = int(idx)
+        if idx not in frames:
+            frames[idx] = frame_cache.get((fingerprint, idx, frame_size))
+    missing = sorted(idx for idx, frame in frames.items() if frame is None)
+    if missing:
+        for idx, frame in zip(missing, decode_frames(open_reader(), missing, max_batch_bytes)):
+            frames[idx] = frame
+            frame_cache.put((fingerprint, idx, frame_size), frame)
+    return [frames[int(idx)] for idx in frame_indices]
+
+
+def split_clip_windows(num_frames: int, short_video_frames: int, overlapping_frames: int, frames_per_second: float):
+    """
+    Cut ``num_frames`` sampled frames into clip windows of ``short_video_frames`` frames.
+
+    A trailing remainder of at most one second of frames is dropped, and consecutive windows
+    share ``overlapping_frames`` frames.
+
+    Returns:
+        list: (start, end) positions into the sampled frames, one per clip
+    """
+    if 0 < num_frames % short_video_frames <= frames_per_second:
+        num_frames = num_frames - num_frames % short_video_frames
+
+    # 每 short_video_frames 帧构成一个短视频，考虑重叠帧数
+    windows = []
+    i = 0
+    while i < num_frames:
+        end_index = min(i + short_video_frames, num_frames)
+        windows.append((i, end_index))
+        if end_index == num_frames:
+            break
+        i = max(i + 1, end_index - overlapping_frames)
+    return windows
+
+
+def plan_video_clips(fps, total_frames, frames_per_second: float, short_video_frames: int, time_period=None,
+                     overlapping_frames: int = 0):
+    """
+    Work out which frames are sampled and how they are cut into clips, without decoding anything.
+
+    Returns:
+        tuple: (sampled frame indices, clip windows as (start, end) positions into them,
+                clip time ranges in seconds)
+    """
     # 确保 frames_per_second 大于 0
     assert frames_per_second > 0, "frames_per_second 必须大于 0"
     # 确保 short_video_frames 是正整数
@@ -41,69 +370,320 @@ def get_video_frames(video_path, cache_dir: str = 'cache', frames_per_second: fl
     # 确保 overlapping_frames 是非负整数
     assert isinstance(overlapping_frames, int) and overlapping_frames >= 0, "overlapping_frames 必须是非负整数"
 
+    frame_indices, start_frame = sample_frame_indices(fps, total_frames, frames_per_second, time_period)
+    windows = split_clip_windows(len(frame_indices), short_video_frames, overlapping_frames, frames_per_second)
+    time_ranges = [(start_frame / fps + i / frames_per_second, start_frame / fps + end_index / frames_per_second)
+                   for i, end_index in windows]
+    return frame_indices, windows, time_ranges
+
+
+def iter_video_clips(video_path, frames_per_second: float = 1.0, short_video_frames: int = 100, time_period=None,
+                     overlapping_frames: int = 0, decode_batch_bytes: int = DECODE_BATCH_BYTES,
+                     max_pixels: int = None, min_pixels: int = CLIP_MIN_PIXELS,
+                     total_pixels: float = CLIP_TOTAL_PIXELS, frame_cache: FrameCache = None,
+                     video_index=None, clip_ids=None):
+    """
+    Stream a video as short clips, decoding one clip window at a time.
+
+    Yields ``(clip_frames, time_range)`` with ``clip_frames`` an RGB array of shape (T, H, W, 3).
+    Only the current window (plus the frames it shares with the next one) is held in memory,
+    so memory use no longer grows with video length.
+
+    If ``max_pixels`` is given, the decoder scales frames straight to the size the processor would
+    resize them to (see ``get_clip_frame_size``) instead of producing full-resolution frames.
+    With ``frame_cache`` set, decoded frames are looked up in and added to that cache.
+    With a ``video_index`` (see ``load_video_index``) no reader is opened just for metadata, and a
+    ``time_period`` is decoded with keyframe-anchored seeks instead of a full decord reader.
+    ``clip_ids`` restricts (and orders) the clips to decode, as positions in ``plan_video_clips``.
+    """
     video_file_path = video_path
-    vr = VideoReader(video_file_path, ctx=cpu(0))
-    fps = vr.get_avg_fps()
-    total_frames = len(vr)
+    if video_index is None:
+        vr = VideoReader(video_file_path, ctx=cpu(0))
+        fps = vr.get_avg_fps()
+        total_frames = len(vr)
+    else:
+        vr = None
+        fps = video_index.fps
+        total_frames = video_index.total_frames
     total_seconds = total_frames / fps
 
-    # 根据 time_period 确定子视频的起始和结束帧
-    if time_period:
-        start_time, end_time = time_period
-        start_frame = int(start_time * fps)
-        end_frame = min(int(end_time * fps), total_frames)
-    else:
-        start_frame = 0
-        end_frame = total_frames
+    frame_indices, windows, time_ranges = plan_video_clips(fps, total_frames, frames_per_second, short_video_frames,
+                                                           time_period, overlapping_frames)
 
-    all_frames = []
-    interval = 1 / frames_per_second  # 计算抽帧间隔（秒）
-    current_time = start_time if time_period else 0
-    while current_time < (end_time if time_period else total_seconds):
-        frame_index = int(current_time * fps)
-        if start_frame <= frame_index < end_frame:
-            all_frames.append(vr[frame_index].asnumpy())
-        current_time += interval
+    # 直接按模型输入尺寸解码，避免全分辨率解码后再缩放
+    frame_size = (-1, -1)
+    if max_pixels is not None and windows:
+        height, width = (video_index.height, video_index.width) if video_index is not None else vr[0].shape[:2]
+        window_frames = windows[0][1] - windows[0][0]
+        nframes = smart_nframes({"fps": frames_per_second}, total_frames=window_frames, video_fps=frames_per_second)
+        resized_height, resized_width = get_clip_frame_size(height, width, nframes, max_pixels, min_pixels, total_pixels)
+        if (resized_height, resized_width) != (height, width):
+            frame_size = (resized_height, resized_width)
+
+    readers = {}
+
+    def open_reader():
+        if 'vr' not in readers:
+            if video_index is not None and time_period:
+                # 短时间段：从关键帧定位后只解码一小段，无需初始化完整的 VideoReader
+                readers['vr'] = SeekingFrameReader(video_file_path, video_index, frame_size)
+            elif frame_size == (-1, -1):
+                readers['vr'] = vr if vr is not None else VideoReader(video_file_path, ctx=cpu(0))
+            else:
+                readers['vr'] = VideoReader(video_file_path, ctx=cpu(0), width=frame_size[1], height=frame_size[0])
+        return readers['vr']
+
+    if frame_cache is not None:
+        fingerprint = video_index.fingerprint if video_index is not None else get_video_fingerprint(video_file_path)
+        key_prefix = (fingerprint, frame_size)
 
     print("Original Video Frames:", total_frames)
     print("Original Video Seconds:", total_seconds)
     print("Sampling FPS:", frames_per_second)
+    print("Sampled Video Frames:", windows[-1][1] if windows else 0)
+    print("Each Short Video Frames:", short_video_frames)
+    print('Short Video Numbers:', len(windows))
 
-    if 0 < len(all_frames) % short_video_frames <= frames_per_second:
-        all_frames = all_frames[:len(all_frames)-len(all_frames) % short_video_frames]
+    # 只保留与下一个窗口重叠的帧，避免重复解码
+    carried_start, carried_frames = 0, []
+    try:
+        for clip_id in (range(len(windows)) if clip_ids is None else clip_ids):
+            i, end_index = windows[clip_id]
+            reused = carried_frames[i - carried_start: end_index - carried_start] if carried_start <= i else []
+            new_indices = frame_indices[i + len(reused): end_index]
+            if frame_cache is not None:
+                decoded = decode_cached_frames(open_reader, new_indices, frame_cache, key_prefix, decode_batch_bytes)
+            else:
+                decoded = decode_frames(open_reader(), new_indices, decode_batch_bytes)
+            clip_frames = np.stack(list(reused) + decoded)
+            carried_start, carried_frames = i, clip_frames
+            yield clip_frames, time_ranges[clip_id]
+    finally:
+        # 生成器结束或被提前关闭时释放 cv2 句柄，不等垃圾回收
+        if isinstance(readers.get('vr'), SeekingFrameReader):
+            readers['vr'].close()
 
-    print("Sampled Video Frames:", len(all_frames))
 
-    # 每 short_video_frames 帧构成一个短视频，考虑重叠帧数
+def get_model_identity(model_path):
+    # 以模型目录名作为模型标识，使不同机器上的同一模型共享缓存
+    return os.path.basename(os.path.normpath(model_path))
+
+
+def coarse_memory_params(args):
+    """Every extraction parameter a coarse memory depends on, plus the VLM identity."""
+    return {
+        "prompt": args.coarse_memory_extract_prompt,
+        "sampling_fps": args.sampling_fps,
+        "short_video_frames": args.short_video_frames,
+        "max_pixels": args.coarse_memory_max_pixels,
+        "overlapping_frames": args.coarse_overlapping_frames,
+        "in_memory_clips": args.in_memory_clips,
+        "model": get_model_identity(args.vlm_model_path),
+    }
+
+
+def coarse_memory_cache_key(video_path, args):
+    """
+    Cache key of a video's coarse memory: its content fingerprint plus every extraction parameter
+    and the VLM identity, so changing any of them never serves stale memories.
+    """
+    return make_cache_key("coarse_memory", get_video_fingerprint(video_path), coarse_memory_params(args))
+
+
+def followed_coarse_memory_key(video_path, args):
+    """
+    Key of the coarse memory log of a video followed while it is being written. The content
+    fingerprint changes as the file grows, so the log is keyed by the absolute path instead.
+    """
+    return make_cache_key("coarse_memory_follow", os.path.abspath(video_path), coarse_memory_params(args))
+
+
+def fine_memory_params_key(args):
+    """Key of the parameters a fine memory clip depends on, besides the video and the clip interval."""
+    return make_cache_key("fine_memory", {
+        "prompt": hashlib.sha256(args.fine_memory_extract_prompt.encode('utf-8')).hexdigest(),
+        "sampling_fps": args.fine_sampling_fps,
+        "short_video_frames": args.fine_short_video_frames,
+        "max_pixels": args.fine_memory_max_pixels,
+        "overlapping_frames": args.fine_overlapping_frames,
+        "in_memory_clips": args.in_memory_clips,
+        "model": get_model_identity(args.vlm_model_path),
+    })
+
+
+def get_video_frames(video_path, cache_dir: str = 'cache', frames_per_second: float = 1.0,
+                     short_video_frames: int = 100, time_period= None, overlapping_frames:int=0,temp_video_dir:str='temp_videos',
+                     in_memory: bool = False, decode_batch_bytes: int = DECODE_BATCH_BYTES,
+                     max_pixels: int = None, frame_cache: FrameCache = None, video_index=None, clip_ids=None):
+    """
+    Sample frames from a video and cut them into short clips.
+
+    When ``in_memory`` is True the clips are returned as RGB frame arrays of shape (T, H, W, 3)
+    instead of being re-encoded to temporary MP4 files, so they can be handed to the processor
+    directly (see ``process_clip_vision_info``). Clip boundaries and time ranges are the same in both modes.
+    Use ``iter_video_clips`` instead when the clips of a long video should not all be held at once.
+    ``max_pixels`` makes the decoder output frames at the processor's target size, and ``frame_cache``
+    lets repeated calls on the same period reuse decoded frames. ``video_index`` and ``clip_ids`` are
+    passed on to ``iter_video_clips``.
+    """
     short_video_paths = []
     short_video_time_ranges = []
-    i = 0
-    while i < len(all_frames):
-        end_index = min(i + short_video_frames, len(all_frames))
-        short_video = all_frames[i: end_index]
-        if short_video:
-            if time_period:
-                start_time = start_frame / fps + i / frames_per_second
-                end_time = start_frame / fps + (i + len(short_video)) / frames_per_second
-            else:
-                start_time = i / frames_per_second
-                end_time = (i + len(short_video)) / frames_per_second
-            short_video_time_ranges.append((start_time, end_time))
+    for short_video, time_range in iter_video_clips(video_path, frames_per_second, short_video_frames, time_period,
+                                                    overlapping_frames, decode_batch_bytes, max_pixels,
+                                                    frame_cache=frame_cache, video_index=video_index,
+                                                    clip_ids=clip_ids):
+        short_video_time_ranges.append(time_range)
+        if in_memory:
+            short_video_paths.append(short_video)
+        else:
             temp_video_path = os.path.join(cache_dir, temp_video_dir, f'temp_video_{len(short_video_paths)}.mp4')
-            height, width, layers = short_video[0].shape
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            out = cv2.VideoWriter(temp_video_path, fourcc, frames_per_second, (width, height))
-            for frame in short_video:
-                # 将 RGB 转换为 BGR
-                bgr_frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-                out.write(bgr_frame)
-            out.release()
-            short_video_paths.append(temp_video_path)
-
-        if end_index == len(all_frames):
-            break
-        i = max(i + 1, end_index - overlapping_frames)
+            short_video_paths.append(write_temp_video(short_video, temp_video_path, frames_per_second))
+    return short_video_paths, short_video_time_ranges
 
-    print("Each Short Video Frames:", short_video_frames)
-    print('Short Video Numbers:', len(short_video_paths))
-    return short_video_paths, short_video_time_ranges
\ No newline at end of file
+
+def batched(iterable, batch_size: int):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def estimate_clip_tokens(num_frames: int, height: int, width: int, max_pixels: int, frames_per_second: float,
+                         text_tokens: int = 0, min_pixels: int = CLIP_MIN_PIXELS,
+                         total_pixels: float = CLIP_TOTAL_PIXELS):
+    """
+    Number of LLM tokens a clip occupies in a batch, before padding.
+
+    Follows the frame sampling of ``fetch_video_frames`` and the patching of Qwen2.5-VL: every
+    ``FRAME_FACTOR`` frames form one temporal patch and every ``IMAGE_FACTOR`` x ``IMAGE_FACTOR``
+    pixels of it one merged visual token.
+
+    Args:
+        num_frames (int): Number of frames of the clip
+        height (int): Frame height of the clip
+        width (int): Frame width of the clip
+        max_pixels (int): Per-frame pixel budget passed to the processor
+        frames_per_second (float): Frame rate of the clip
+        text_tokens (int): Tokens of the prompt and chat template
+
+    Returns:
+        int: Estimated number of tokens
+    """
+    nframes = smart_nframes({"fps": frames_per_second}, total_frames=num_frames, video_fps=frames_per_second)
+    resized_height, resized_width = get_clip_frame_size(height, width, nframes, max_pixels, min_pixels, total_pixels)
+    visual_tokens = (nframes // FRAME_FACTOR) * (resized_height // IMAGE_FACTOR) * (resized_width // IMAGE_FACTOR)
+    return text_tokens + visual_tokens
+
+
+def token_budget_batches(items, token_fn, token_budget: int, max_batch_size: int, window: int):
+    """
+    Pack items into batches whose padded size stays under a token budget.
+
+    The processor pads every sequence of a batch to the longest one, so a batch costs
+    ``len(batch) * max(tokens)``. Items are read ``window`` at a time, sorted by length and packed
+    greedily, so that clips of similar length share a batch. An item larger than the budget is
+    batched alone. Batches are not in source order; callers restore it from the outputs.
+
+    Args:
+        items: Iterable of items
+        token_fn: Maps an item to its token count
+        token_budget (int): Maximum padded tokens per batch
+        max_batch_size (int): Maximum number of items per batch
+        window (int): Number of items read ahead and reordered at a time
+
+    Yields:
+        list: Batch of items
+    """
+    for group in batched(items, max(window, 1)):
+        group = sorted(group, key=token_fn, reverse=True)
+        batch, batch_tokens = [], 0
+        for item in group:
+            tokens = token_fn(item)
+            # 按长度降序排列，批内最长序列即第一个元素
+            if batch and ((len(batch) + 1) * batch_tokens > token_budget or len(batch) == max_batch_size):
+                yield batch
+                batch = []
+            if not batch:
+                batch_tokens = tokens
+            batch.append(item)
+        if batch:
+            yield batch
+
+
+def write_temp_video(frames, temp_video_path, frames_per_second):
+    height, width, layers = frames[0].shape
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    out = cv2.VideoWriter(temp_video_path, fourcc, frames_per_second, (width, height))
+    for frame in frames:
+        # 将 RGB 转换为 BGR
+        bgr_frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        out.write(bgr_frame)
+    out.release()
+    return temp_video_path
+
+
+def fetch_video_frames(ele: dict, image_factor: int = IMAGE_FACTOR):
+    """
+    In-memory counterpart of ``qwen_vl_utils.fetch_video`` for a clip given as RGB frames.
+
+    Applies the same frame sampling (``smart_nframes``), pixel budget and bicubic resize that
+    ``fetch_video`` applies to a temporary clip written at ``ele['fps']``, minus the lossy MP4 round-trip.
+
+    Returns:
+        tuple: (video tensor of shape (T, C, H, W), sample fps)
+    """
+    frames = ele["video"]
+    if not isinstance(frames, np.ndarray):
+        frames = np.stack(frames)
+    video_fps = ele["fps"]
+    total_frames = len(frames)
+    nframes = smart_nframes({"fps": video_fps}, total_frames=total_frames, video_fps=video_fps)
+    idx = torch.linspace(0, total_frames - 1, nframes).round().long()
+    video = torch.from_numpy(frames).permute(0, 3, 1, 2)[idx]
+    sample_fps = nframes / max(total_frames, 1e-6) * video_fps
+
+    _, _, height, width = video.shape
+    min_pixels = ele.get("min_pixels", VIDEO_MIN_PIXELS)
+    total_pixels = ele.get("total_pixels", VIDEO_TOTAL_PIXELS)
+    max_pixels = max(min(VIDEO_MAX_PIXELS, total_pixels / nframes * FRAME_FACTOR), int(min_pixels * 1.05))
+    max_pixels = min(ele.get("max_pixels", max_pixels), max_pixels)
+    resized_height, resized_width = smart_resize(height, width, factor=image_factor,
+                                                 min_pixels=min_pixels, max_pixels=max_pixels)
+    video = transforms.functional.resize(
+        video,
+        [resized_height, resized_width],
+        interpolation=InterpolationMode.BICUBIC,
+        antialias=True,
+    ).float()
+    return video, sample_fps
+
+
+def process_clip_vision_info(conversations):
+    """
+    Drop-in replacement for ``process_vision_info(conversations, return_video_kwargs=True)`` that
+    also accepts clips given as in-memory frame arrays from ``get_video_frames(in_memory=True)``.
+    """
+    image_inputs = []
+    video_inputs = []
+    video_sample_fps_list = []
+    for vision_info in extract_vision_info(conversations):
+        if "image" in vision_info or "image_url" in vision_info:
+            image_inputs.append(fetch_image(vision_info))
+        elif "video" in vision_info:
+            if isinstance(vision_info["video"], str):
+                video_input, video_sample_fps = fetch_video(vision_info, return_video_sample_fps=True)
+            else:
+                video_input, video_sample_fps = fetch_video_frames(vision_info)
+            video_sample_fps_list.append(video_sample_fps)
+            video_inputs.append(video_input)
+        else:
+            raise ValueError("image, image_url or video should in content.")
+    if len(image_inputs) == 0:
+        image_inputs = None
+    if len(video_inputs) == 0:
+        video_inputs = None
+    return image_inputs, video_inputs, {'fps': video_sample_fps_list}
@@ -1,13 +1,31 @@
 import torch
 from transformers import Qwen2_5_VLForConditionalGeneration, AutoProcessor
-from qwen_vl_utils import process_vision_info
+import copy
+import itertools
 import json
+import multiprocessing
+import time
+from collections import deque
 from .utils import *
+from .backends import OpenAIServerBackend, get_vlm_backend
+from .pipeline import run_pipelined
+from memory_cache import MemoryCache, MemoryLog, FineMemoryStore
 
 
 def create_vlm(args):
     model_path = args.vlm_model_path
 
+    if args.vllm:
+        # 通过 OpenAI 兼容接口（如 vLLM）调用服务端模型，本地不加载权重
+        print("Using VLM Server:", args.vllm_base_url)
+        backend = OpenAIServerBackend(
+            args.vllm_base_url,
+            args.vllm_model or model_path,
+            api_key=args.vllm_api_key,
+            max_concurrency=args.vllm_max_concurrency,
+        )
+        return backend, None
+
     model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
         model_path,
         torch_dtype=torch.bfloat16,
@@ -20,179 +38,513 @@ def create_vlm(args):
     return model, processor
 
 
-def video_coarse_memory_extraction(model,processor,args):
+def build_clip_messages(short_videos, prompt, max_pixels, frames_per_second):
+    messages = []
+    for short_video in short_videos:
+        message = [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": [
+                {"type": "text", "text": prompt},
+                {"video": short_video, "total_pixels": CLIP_TOTAL_PIXELS, "min_pixels": CLIP_MIN_PIXELS,
+                 "max_pixels": max_pixels, 'fps': frames_per_second},
+            ]}
+        ]
+        messages.append(message)
+    return messages
+
+
+def schedule_clip_batches(backend, clip_iter, prompt, max_pixels, frames_per_second, args):
+    """
+    Batch ``(clip_frames, time_range)`` clips, by count or, with ``--batch_token_budget``, by padded tokens.
+    """
+    batch_size = args.infer_batch_size
+    message = build_clip_messages([None], prompt, max_pixels, frames_per_second)[0]
+    text_tokens = backend.count_text_tokens(message) if args.batch_token_budget > 0 else None
+    # 服务端自行做连续批处理，无需按 token 打包
+    if text_tokens is None:
+        return batched(clip_iter, batch_size)
+
+    def clip_tokens(clip):
+        clip_frames, _ = clip
+        num_frames, height, width = clip_frames.shape[:3]
+        return estimate_clip_tokens(num_frames, height, width, max_pixels, frames_per_second, text_tokens)
+
+    return token_budget_batches(clip_iter, clip_tokens, args.batch_token_budget, batch_size,
+                                window=2 * batch_size)
+
+
+def run_clip_batches(backend, clip_batches, prompt, max_pixels, frames_per_second, args):
+    """
+    Caption batches of ``(clip_frames, time_range)`` clips, preparing batch N+1 on worker threads
+    while batch N is generating.
+
+    Batches are submitted to the backend as soon as they are prepared. Up to ``backend.max_in_flight``
+    clips may be awaiting their outputs at a time, so a server backend keeps receiving new requests
+    while earlier ones are still running.
+
+    Yields:
+        tuple: (time ranges of the batch, output texts of the batch)
+    """
+    cache_dir = args.cache_dir
+    temp_video_dir = args.temp_video_dir
+    in_memory = args.in_memory_clips or backend.remote
+    batch_size = args.infer_batch_size
+
+    def prepare(batch_idx, batch_clips):
+        short_videos = []
+        for j, (clip_frames, time_range) in enumerate(batch_clips):
+            if in_memory:
+                short_videos.append(clip_frames)
+            else:
+                temp_video_path = os.path.join(cache_dir, temp_video_dir, f'temp_video_{batch_idx * batch_size + j}.mp4')
+                short_videos.append(write_temp_video(clip_frames, temp_video_path, frames_per_second))
+        messages = build_clip_messages(short_videos, prompt, max_pixels, frames_per_second)
+        return [time_range for _, time_range in batch_clips], backend.prepare(messages)
+
+    def submit(prepared):
+        time_ranges, inputs = prepared
+        return time_ranges, backend.submit(inputs)
+
+    report = []
+    in_flight = deque()
+    num_in_flight = 0
+    for _, (time_ranges, futures) in run_pipelined(clip_batches, prepare, submit, prefetch=args.prefetch_batches,
+                                                   num_workers=args.preprocess_workers, report=report):
+        in_flight.append((time_ranges, futures))
+        num_in_flight += len(futures)
+        while in_flight and (num_in_flight > backend.max_in_flight or all(f.done() for f in in_flight[0][1])):
+            time_ranges, futures = in_flight.popleft()
+            num_in_flight -= len(futures)
+            yield time_ranges, [future.result() for future in futures]
+    while in_flight:
+        time_ranges, futures = in_flight.popleft()
+        yield time_ranges, [future.result() for future in futures]
+    print("Pipeline Utilization:", report[0])
+
+
+def extract_coarse_memory_clips(backend, video_path, video_index, clip_ids, checkpoint, args):
+    """
+    Caption the coarse memory clips ``clip_ids`` of a video, appending every finished batch to ``checkpoint``.
+
+    Returns:
+        dict: clip index -> checkpoint record ({"clip", "time_period", "general_memory"}) of the captioned clips
+    """
+    prompt = args.coarse_memory_extract_prompt
+    frames_per_second = args.sampling_fps
+    short_video_frames = args.short_video_frames
+    max_pixels = args.coarse_memory_max_pixels
+    overlapping_frames = args.coarse_overlapping_frames
+    _, _, clip_time_ranges = plan_video_clips(video_index.fps, video_index.total_frames, frames_per_second,
+                                              short_video_frames, overlapping_frames=overlapping_frames)
+    clip_positions = {time_range: clip_id for clip_id, time_range in enumerate(clip_time_ranges)}
+
+    clip_iter = iter_video_clips(video_path, frames_per_second, short_video_frames,
+                                 overlapping_frames=overlapping_frames, max_pixels=max_pixels,
+                                 video_index=video_index, clip_ids=clip_ids)
+
+    # 流式批量推理：解码与预处理在后台线程中进行，与模型生成重叠
+    clip_batches = schedule_clip_batches(backend, clip_iter, prompt, max_pixels, frames_per_second, args)
+    extracted = {}
+    for time_ranges, output_texts in run_clip_batches(backend, clip_batches,
+                                                      prompt, max_pixels, frames_per_second, args):
+        records = []
+        for output_text, time_range in zip(output_texts, time_ranges):
+            records.append({
+                "clip": clip_positions[time_range],
+                "time_period": (round(time_range[0],1),round(time_range[1],1)),
+                "general_memory": output_text
+            })
+        checkpoint.append(records)
+        for record in records:
+            print(f"Short Video {record['clip']} Coarse Memory Extracted")
+            extracted[record["clip"]] = record
+    return extracted
+
+
+def coarse_memory_shard_worker(args, clip_ids, checkpoint_path, device, model_factory):
+    """Entry point of a coarse extraction worker process: load a model of its own and caption one shard."""
+    if device:
+        os.environ["CUDA_VISIBLE_DEVICES"] = device
+    else:
+        # CPU 上运行时各进程平分线程，避免互相争抢
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // args.coarse_shards))
+    if not args.in_memory_clips:
+        os.makedirs(os.path.join(args.cache_dir, args.temp_video_dir), exist_ok=True)
+    model, processor = model_factory(args)
+    video_path = get_video_path(args.video_url, args.cache_dir)
+    extract_coarse_memory_clips(get_vlm_backend(model, processor), video_path,
+                                load_video_index(video_path, args.cache_dir), clip_ids, MemoryLog(checkpoint_path), args)
+
+
+def visible_cuda_devices():
+    """CUDA devices of this process, as values for a worker's ``CUDA_VISIBLE_DEVICES``; empty without CUDA."""
+    if not torch.cuda.is_available():
+        return []
+    visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+    if visible is not None:
+        return [device.strip() for device in visible.split(",") if device.strip()]
+    return [str(i) for i in range(torch.cuda.device_count())]
+
+
+def run_coarse_memory_shards(clip_ids, checkpoint, args, model_factory=None):
+    """
+    Caption ``clip_ids`` in ``args.coarse_shards`` worker processes, one contiguous shard of clips each.
+
+    Every worker loads its own model with ``model_factory(args)`` (``create_vlm`` by default) on the
+    device ``args.coarse_shard_devices`` assigns to it, or else on the visible CUDA devices in turn,
+    and appends its batches to the shared checkpoint. Only on a host without CUDA do the workers run
+    on the CPU. Clips finished by a failed worker are kept in the checkpoint for the next run.
+    """
+    num_shards = min(args.coarse_shards, len(clip_ids))
+    devices = [device.strip() for device in args.coarse_shard_devices.split(",") if device.strip()]
+    if not devices:
+        # 未指定设备时轮流分配可见的 GPU，否则每个进程都会以 device_map="auto" 占满所有 GPU
+        devices = visible_cuda_devices()
+    # spawn 启动的子进程不继承父进程的 CUDA 状态
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for shard in range(num_shards):
+        shard_clip_ids = clip_ids[shard * len(clip_ids) // num_shards:(shard + 1) * len(clip_ids) // num_shards]
+        shard_args = copy.copy(args)
+        shard_args.temp_video_dir = f"{args.temp_video_dir}_shard{shard}"
+        device = devices[shard % len(devices)] if devices else ""
+        print(f"Coarse Memory Shard {shard}: Short Videos {shard_clip_ids[0]}-{shard_clip_ids[-1]}"
+              + (f" on Device {device}" if device else ""))
+        process = context.Process(target=coarse_memory_shard_worker, name=f"coarse-shard-{shard}",
+                                  args=(shard_args, shard_clip_ids, checkpoint.path, device, model_factory or create_vlm))
+        process.start()
+        processes.append(process)
+    for process in processes:
+        process.join()
+    failed = [process.name for process in processes if process.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"Coarse memory shards {failed} failed, finished clips are kept in {checkpoint.path}")
+
+
+def load_legacy_coarse_memory(video_path, args):
+    """Coarse memory from the old cache files named after the video path, or None when there is none."""
+    # 兼容旧版按路径命名的缓存（不校验提取参数）
+    save_name = "_".join(video_path.split("VideoDataset/")[-1].split(".")[0].split("/")) + ".json"
+    legacy_path = os.path.join(args.cache_dir, "coarse_memory", save_name)
+    if args.ignore_legacy_coarse_memory or not os.path.exists(legacy_path):
+        return None
+    print("Legacy Coarse Memory Existed in:", legacy_path)
+    with open(legacy_path, "r") as f:
+        return json.load(f)
+
+
+def load_cached_coarse_memory(args):
+    """
+    Coarse memory of ``args.video_url`` as cached by ``video_coarse_memory_extraction``, without
+    extracting anything; None when it has not been extracted with the current parameters.
+    """
+    video_path = get_video_path(args.video_url, args.cache_dir)
+    if os.path.exists(video_path):
+        memory_cache = MemoryCache(os.path.join(args.cache_dir, "coarse_memory"), args.coarse_cache_max_bytes)
+        cache_key = coarse_memory_cache_key(video_path, args)
+        results = memory_cache.get(cache_key)
+        if results is not None:
+            print("Coarse Memory Existed in:", memory_cache.path(cache_key))
+            return results
+    return load_legacy_coarse_memory(video_path, args)
+
+
+def video_coarse_memory_extraction(model,processor,args,model_factory=None):
+    """
+    Coarse memory of the whole video, from the cache or extracted clip by clip.
+
+    With ``args.coarse_shards`` > 1, the missing clips are captioned by that many worker processes
+    (see ``run_coarse_memory_shards``), which load their own models with ``model_factory``;
+    ``model`` and ``processor`` are then not used and may be None, so callers can load their own
+    model only after the shards are done.
+    """
     print("-" * 20)
     print("Coarse Memory Extracting...")
     video_url = args.video_url
-    prompt = args.coarse_memory_extract_prompt
     cache_dir = args.cache_dir
-    batch_size = args.infer_batch_size
     frames_per_second = args.sampling_fps
     short_video_frames = args.short_video_frames
-    max_pixels = args.coarse_memory_max_pixels
     overlapping_frames = args.coarse_overlapping_frames
     temp_video_dir = args.temp_video_dir
+    in_memory = args.in_memory_clips
 
     os.makedirs(cache_dir, exist_ok=True)
-    os.makedirs(os.path.join(cache_dir, temp_video_dir), exist_ok=True)
+    if not in_memory:
+        os.makedirs(os.path.join(cache_dir, temp_video_dir), exist_ok=True)
     os.makedirs(os.path.join(cache_dir, "coarse_memory"), exist_ok=True)
 
     video_path = get_video_path(video_url,cache_dir)
 
-    save_name = "_".join(video_path.split("VideoDataset/")[-1].split(".")[0].split("/")) + ".json"
+    memory_cache = MemoryCache(os.path.join(cache_dir, "coarse_memory"), args.coarse_cache_max_bytes)
+    # 视频文件已不在时无法计算指纹，只能使用旧版缓存
+    cache_key = coarse_memory_cache_key(video_path, args) if os.path.exists(video_path) else None
     # 如果记忆存在，则直接返回记忆
-    if os.path.exists(os.path.join(cache_dir, "coarse_memory", save_name)):
-        print("Coarse Memory Existed in:", os.path.join(cache_dir, "coarse_memory", save_name))
-        with open(os.path.join(cache_dir, "coarse_memory", save_name), "r") as f:
-            results = json.load(f)
+    results = memory_cache.get(cache_key) if cache_key is not None else None
+    if results is not None:
+        print("Coarse Memory Existed in:", memory_cache.path(cache_key))
         print("-" * 20)
         return results
 
-    short_video_paths, short_video_time_ranges = get_video_frames(video_path, cache_dir, frames_per_second,
-                                                                              short_video_frames,overlapping_frames=overlapping_frames,temp_video_dir=temp_video_dir)
-
-
-    # 批量推理
-    all_output_texts = []
-    for i in range(0, len(short_video_paths), batch_size):
-        batch_short_video_paths = short_video_paths[i: i + batch_size]
-        messages = []
-
-        for j, short_video_path in enumerate(batch_short_video_paths):
-            message = [
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": [
-                    {"type": "text", "text": prompt},
-                    {"video": short_video_path, "total_pixels": 128000 * 28 * 28 * 0.9, "min_pixels": 16 * 28 * 28,
-                     "max_pixels": max_pixels, 'fps': frames_per_second},
-                ]}
-            ]
-            messages.append(message)
-
-        texts = [
-            processor.apply_chat_template(msg, tokenize=False, add_generation_prompt=True)
-            for msg in messages
-        ]
-        image_inputs, video_inputs, video_kwargs = process_vision_info(messages, return_video_kwargs=True)
-        fps_inputs = video_kwargs['fps']
-        inputs = processor(
-            text=texts,
-            images=image_inputs,
-            videos=video_inputs,
-            fps=fps_inputs,
-            padding=True,
-            return_tensors="pt",
-        )
-        inputs = inputs.to("cuda")
-
-        generated_ids = model.generate(**inputs, max_new_tokens=2048)
-        generated_ids_trimmed = [
-            out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
-        ]
-        output_texts = processor.batch_decode(
-            generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=True
-        )
-
-        for j, output_text in enumerate(output_texts):
-            print(f"Short Video {i + j} Coarse Memory Extracted")
-            all_output_texts.append(output_text)
-
+    results = load_legacy_coarse_memory(video_path, args)
+    if results is not None:
+        print("-" * 20)
+        return results
+    if cache_key is None:
+        raise FileNotFoundError(f"Video {video_url} does not exist and has no cached coarse memory.")
+
+    video_index = load_video_index(video_path, cache_dir)
+    _, _, clip_time_ranges = plan_video_clips(video_index.fps, video_index.total_frames, frames_per_second,
+                                              short_video_frames, overlapping_frames=overlapping_frames)
+
+    # 每个批次完成后追加写入检查点，中断后重新运行时跳过已完成的短视频
+    checkpoint = MemoryLog(memory_cache.path(cache_key, suffix=".checkpoint.jsonl"))
+    extracted = {}
+    for record in checkpoint.load():
+        if record["clip"] < len(clip_time_ranges):
+            extracted[record["clip"]] = record
+    clip_ids = [clip_id for clip_id in range(len(clip_time_ranges)) if clip_id not in extracted]
+    if extracted:
+        print(f"Resuming from Checkpoint: {len(extracted)} of {len(clip_time_ranges)} Short Videos Done, "
+              f"Continuing from Short Video {clip_ids[0] if clip_ids else len(clip_time_ranges)}")
+
+    if clip_ids and args.coarse_shards > 1:
+        run_coarse_memory_shards(clip_ids, checkpoint, args, model_factory)
+        for record in checkpoint.load():
+            extracted[record["clip"]] = record
+    elif clip_ids:
+        extracted.update(extract_coarse_memory_clips(get_vlm_backend(model, processor), video_path, video_index,
+                                                     clip_ids, checkpoint, args))
+
+    # 按 token 预算打包的批次不保持原顺序，按短视频序号恢复时间轴顺序
     results = []
-    for output_text, time_range in zip(all_output_texts, short_video_time_ranges):
+    for clip_id in range(len(clip_time_ranges)):
         result = {
-            "time_period": (round(time_range[0],1),round(time_range[1],1)),
-            "general_memory": output_text
+            "time_period": tuple(extracted[clip_id]["time_period"]),
+            "general_memory": extracted[clip_id]["general_memory"]
         }
         results.append(result)
 
-    with open(os.path.join(cache_dir, "coarse_memory",save_name), 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=4)
+    memory_cache.put(cache_key, results, meta={"video": video_url, "video_path": video_path})
+    checkpoint.remove()
 
     print("-" * 20)
     return results
 
 
+def followed_coarse_memory_log(args):
+    video_path = get_video_path(args.video_url, args.cache_dir)
+    key = followed_coarse_memory_key(video_path, args)
+    return MemoryLog(os.path.join(args.cache_dir, "coarse_memory", key + ".jsonl"))
+
+
+def load_followed_coarse_memory(args):
+    """Coarse memory of a followed video up to its last closed window, as logged so far."""
+    return followed_coarse_memory_log(args).load()
+
+
+def video_coarse_memory_follow(model,processor,args,stop_event=None):
+    """
+    Extract the coarse memory of a video file that is still being written, window by window.
+
+    The file is polled every ``args.follow_poll_seconds``. Whenever it holds new complete windows of
+    ``args.short_video_frames`` sampled frames (leaving out its last second, which the recorder may
+    still be writing), those windows are captioned and appended to the memory log in timeline
+    order. Questions read the log with ``load_followed_coarse_memory`` and so see the memory up to
+    the last closed window. A restarted follower resumes after the last logged window.
+
+    Following ends once the file has not grown for ``args.follow_idle_seconds`` or ``stop_event`` is
+    set. The rest of the video is then captioned the way ``video_coarse_memory_extraction`` would, and
+    the complete memory is stored in the coarse memory cache as well.
+
+    The file must be readable while it grows, e.g. MPEG-TS; an MP4 is only readable once recording ends.
+
+    Returns:
+        list: Coarse memory of the whole video
+    """
+    print("-" * 20)
+    print("Coarse Memory Following...")
+    video_url = args.video_url
+    prompt = args.coarse_memory_extract_prompt
+    cache_dir = args.cache_dir
+    frames_per_second = args.sampling_fps
+    short_video_frames = args.short_video_frames
+    max_pixels = args.coarse_memory_max_pixels
+    overlapping_frames = args.coarse_overlapping_frames
+    backend = get_vlm_backend(model, processor)
+
+    if not args.in_memory_clips:
+        os.makedirs(os.path.join(cache_dir, args.temp_video_dir), exist_ok=True)
+    video_path = get_video_path(video_url, cache_dir)
+    memory_log = followed_coarse_memory_log(args)
+    results = memory_log.load()
+    if results:
+        print(f"Resuming after {len(results)} Logged Short Videos in:", memory_log.path)
+
+    last_size = -1
+    last_growth = time.monotonic()
+    lags = []
+    while True:
+        size = os.path.getsize(video_path) if os.path.exists(video_path) else 0
+        if size != last_size:
+            last_size, last_growth = size, time.monotonic()
+        finished = ((stop_event is not None and stop_event.is_set()) or
+                    time.monotonic() - last_growth >= args.follow_idle_seconds)
+        try:
+            vr = VideoReader(video_path, ctx=cpu(0))
+            fps, total_frames = vr.get_avg_fps(), len(vr)
+            del vr
+        except Exception as e:
+            # 录制刚开始时文件可能还无法解析
+            if finished:
+                break
+            print("Video Not Readable Yet:", e)
+            time.sleep(args.follow_poll_seconds)
+            continue
+
+        # 录制中的文件最后一秒可能尚未写完，只处理完整的窗口
+        available_frames = total_frames if finished else max(total_frames - int(round(fps)), 0)
+        time_ranges = []
+        if available_frames > 0:
+            _, windows, time_ranges = plan_video_clips(fps, available_frames, frames_per_second, short_video_frames,
+                                                       overlapping_frames=overlapping_frames)
+            if not finished:
+                time_ranges = [time_range for (i, end_index), time_range in zip(windows, time_ranges)
+                               if end_index - i == short_video_frames]
+        clip_ids = list(range(len(results), len(time_ranges)))
+
+        if clip_ids:
+            detected = time.monotonic()
+            clip_iter = iter_video_clips(video_path, frames_per_second, short_video_frames,
+                                         overlapping_frames=overlapping_frames, max_pixels=max_pixels,
+                                         clip_ids=clip_ids)
+            clip_batches = schedule_clip_batches(backend, clip_iter, prompt, max_pixels, frames_per_second, args)
+            # 批次可能乱序完成，按时间轴顺序追加到记忆日志
+            pending = {}
+            for batch_ranges, output_texts in run_clip_batches(backend, clip_batches,
+                                                               prompt, max_pixels, frames_per_second, args):
+                for output_text, time_range in zip(output_texts, batch_ranges):
+                    pending[(round(time_range[0], 1), round(time_range[1], 1))] = output_text
+                new_results = []
+                while len(results) + len(new_results) < len(time_ranges):
+                    time_range = time_ranges[len(results) + len(new_results)]
+                    key = (round(time_range[0], 1), round(time_range[1], 1))
+                    if key not in pending:
+                        break
+                    new_results.append({"time_period": key, "general_memory": pending.pop(key)})
+                if new_results:
+                    memory_log.append(new_results)
+                    results.extend(new_results)
+                    lags.append(time.monotonic() - detected)
+                    print(f"Short Video {len(results) - 1} Coarse Memory Appended, Ingest Lag {lags[-1]:.1f}s")
+
+        if finished:
+            break
+        if stop_event is not None:
+            stop_event.wait(args.follow_poll_seconds)
+        else:
+            time.sleep(args.follow_poll_seconds)
+
+    if lags:
+        print(f"Ingest Lag: avg {sum(lags) / len(lags):.1f}s, max {max(lags):.1f}s")
+    if results:
+        memory_cache = MemoryCache(os.path.join(cache_dir, "coarse_memory"), args.coarse_cache_max_bytes)
+        memory_cache.put(coarse_memory_cache_key(video_path, args), results,
+                         meta={"video": video_url, "video_path": video_path})
+    print("-" * 20)
+    return results
+
+
 def video_fine_memory_extraction(model,processor,time_period,qid,args,split='entire'):
+    return video_multi_period_fine_memory_extraction(model, processor, [time_period], qid, args, split)[0]
+
+
+def video_multi_period_fine_memory_extraction(model,processor,time_periods,qid,args,split='entire'):
+    """
+    Fine memory of several time periods, with the missing clips of all periods captioned in one batched run.
+
+    Returns:
+        list: Fine memory of each time period, in the order of ``time_periods``
+    """
     print("-" * 20)
     print("Fine Memory Extracting...")
     video_url = args.video_url
     prompt = args.fine_memory_extract_prompt
     cache_dir = args.cache_dir
-    batch_size = args.infer_batch_size
     frames_per_second = args.fine_sampling_fps
     short_video_frames = args.fine_short_video_frames
     max_pixels = args.fine_memory_max_pixels
     fine_memory_dir = args.fine_memory_dir
     temp_video_dir = args.temp_video_dir
     overlapping_frames = args.fine_overlapping_frames
+    in_memory = args.in_memory_clips
+    FRAME_CACHE.set_max_bytes(args.frame_cache_bytes)
+    backend = get_vlm_backend(model, processor)
 
     os.makedirs(cache_dir, exist_ok=True)
-    os.makedirs(os.path.join(cache_dir, temp_video_dir), exist_ok=True)
+    if not in_memory:
+        os.makedirs(os.path.join(cache_dir, temp_video_dir), exist_ok=True)
     os.makedirs(os.path.join(cache_dir, fine_memory_dir), exist_ok=True)
 
     video_path = get_video_path(video_url, cache_dir)
 
-    save_name = "{}s_{}s_".format(time_period[0], time_period[1]) + "_".join(
-        video_path.split("VideoDataset/")[-1].split(".")[0].split("/")) +"_" + str(qid) + '_'+split+".json"
-
-    short_video_paths, short_video_time_ranges = get_video_frames(video_path, cache_dir, frames_per_second,
-                                                                              short_video_frames,time_period,overlapping_frames,temp_video_dir=temp_video_dir)
-
-    # 批量推理
-    all_output_texts = []
-    for i in range(0, len(short_video_paths), batch_size):
-        batch_short_video_paths = short_video_paths[i: i + batch_size]
-        messages = []
-
-        for j, short_video_path in enumerate(batch_short_video_paths):
-            message = [
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": [
-                    {"type": "text", "text": prompt},
-                    {"video": short_video_path, "total_pixels": 128000 * 28 * 28 * 0.9, "min_pixels": 16 * 28 * 28,
-                     "max_pixels": max_pixels, 'fps': frames_per_second},
-                ]}
-            ]
-            messages.append(message)
-
-        texts = [
-            processor.apply_chat_template(msg, tokenize=False, add_generation_prompt=True)
-            for msg in messages
-        ]
-        image_inputs, video_inputs, video_kwargs = process_vision_info(messages, return_video_kwargs=True)
-        fps_inputs = video_kwargs['fps']
-        inputs = processor(
-            text=texts,
-            images=image_inputs,
-            videos=video_inputs,
-            fps=fps_inputs,
-            padding=True,
-            return_tensors="pt",
-        )
-        inputs = inputs.to("cuda")
-
-        generated_ids = model.generate(**inputs, max_new_tokens=2048)
-        generated_ids_trimmed = [
-            out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
-        ]
-        output_texts = processor.batch_decode(
-            generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=True
+    # 先查询细粒度记忆库，只对缺失的短视频做推理
+    video_index = load_video_index(video_path, cache_dir)
+    fine_memory_store = FineMemoryStore(os.path.join(cache_dir, "fine_memory_store.sqlite"),
+                                        args.fine_memory_store_max_bytes)
+    params_key = fine_memory_params_key(args)
+    period_time_ranges = []
+    stored_memories = {}
+    missing_clip_ids = []
+    scheduled = set()
+    for time_period in time_periods:
+        _, _, short_video_time_ranges = plan_video_clips(video_index.fps, video_index.total_frames, frames_per_second,
+                                                         short_video_frames, time_period, overlapping_frames)
+        period_time_ranges.append(short_video_time_ranges)
+        stored_memories.update(fine_memory_store.lookup(video_index.fingerprint, params_key, short_video_time_ranges))
+        # 多个时间段重叠时，同一短视频只推理一次
+        clip_ids = []
+        for k, time_range in enumerate(short_video_time_ranges):
+            if time_range not in stored_memories and time_range not in scheduled:
+                clip_ids.append(k)
+                scheduled.add(time_range)
+        missing_clip_ids.append(clip_ids)
+    print(f"Fine Memory Store: {len(stored_memories)} clips reused, {len(scheduled)} clips to extract")
+
+    # 所有时间段的缺失短视频合并为一次批量推理
+    new_memories = []
+    if scheduled:
+        clip_iter = itertools.chain.from_iterable(
+            iter_video_clips(video_path, frames_per_second, short_video_frames, time_period, overlapping_frames,
+                             max_pixels=max_pixels, frame_cache=FRAME_CACHE, video_index=video_index,
+                             clip_ids=clip_ids)
+            for time_period, clip_ids in zip(time_periods, missing_clip_ids) if clip_ids
         )
-
-        for j, output_text in enumerate(output_texts):
-            print(f"Short Video {i + j} Fine Memory Extracted")
-            all_output_texts.append(output_text)
-
-    results = []
-    for output_text, time_range in zip(all_output_texts, short_video_time_ranges):
-        result = {
-            "time_period": (round(time_range[0],1),round(time_range[1],1)),
-            "general_memory": output_text
-        }
-        results.append(result)
-
-    with open(os.path.join(cache_dir, fine_memory_dir,save_name), 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=4)
+        clip_batches = schedule_clip_batches(backend, clip_iter, prompt, max_pixels, frames_per_second, args)
+        for time_ranges, output_texts in run_clip_batches(backend, clip_batches,
+                                                          prompt, max_pixels, frames_per_second, args):
+            for output_text, time_range in zip(output_texts, time_ranges):
+                print(f"Short Video {len(new_memories)} Fine Memory Extracted")
+                new_memories.append((time_range, output_text))
+        print("Frame Cache:", FRAME_CACHE.stats())
+
+    fine_memory_store.put(video_index.fingerprint, params_key, new_memories)
+    stored_memories.update(new_memories)
+
+    period_results = []
+    for time_period, short_video_time_ranges in zip(time_periods, period_time_ranges):
+        results = []
+        for time_range in short_video_time_ranges:
+            result = {
+                "time_period": (round(time_range[0],1),round(time_range[1],1)),
+                "general_memory": stored_memories[time_range]
+            }
+            results.append(result)
+
+        save_name = "{}s_{}s_".format(time_period[0], time_period[1]) + "_".join(
+            video_path.split("VideoDataset/")[-1].split(".")[0].split("/")) +"_" + str(qid) + '_'+split+".json"
+        with open(os.path.join(cache_dir, fine_memory_dir,save_name), 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
+        period_results.append(results)
 
     print("-" * 20)
-    return results
+    return period_results
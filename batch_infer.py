@@ -0,0 +1,139 @@
+import copy
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from VLMs import vlm_roles
+from VLMs.backends import get_vlm_backend
+from VLMs.coalescer import CoalescingBackend
+from LLMs import llm_roles
+from demo import parse_args, demo_infer
+from utils import *
+
+
+class JsonlWriter:
+    """Append records to a JSONL file as they complete, one flushed line per record."""
+
+    def __init__(self, path):
+        self.file = open(path, 'a', encoding='utf-8')
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def load_question_records(path):
+    """
+    Read (video, question, options) records and group them by video, keeping the file order.
+
+    Args:
+        path (str): JSONL file with one {"video", "question", "options"} record per line; "id" is optional
+
+    Returns:
+        OrderedDict: video -> list of records
+    """
+    videos = OrderedDict()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_idx, line in enumerate(f):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record.setdefault("id", line_idx)
+            record.setdefault("options", [])
+            videos.setdefault(record["video"], []).append(record)
+    return videos
+
+
+def answer_video_questions(video_url, records, vlm_backend, client, args, writer):
+    """
+    Answer all questions about one video concurrently.
+
+    The coarse memory and its summary are produced once and shared by every question, and the fine
+    memory extractions of all questions go through the same coalescing VLM backend.
+    """
+    video_args = copy.copy(args)
+    video_args.video_url = video_url
+
+    if (not os.path.exists(video_url) and
+            not (video_url.startswith('http://') or video_url.startswith('https://'))):
+        for record in records:
+            writer.write({**record, "answer": None, "error": f"Video {video_url} does not exist."})
+        return
+
+    coarse_memory = vlm_roles.video_coarse_memory_extraction(vlm_backend.backend, None, video_args)
+    coarse_summary = llm_roles.coarse_memory_summarization(coarse_memory, video_args, client=client)
+
+    def answer_question(record):
+        # demo_infer 会修改细粒度提取参数，每个问题使用独立的 args 和临时目录
+        question_args = copy.copy(video_args)
+        question_args.fine_memory_dir = f"{args.fine_memory_dir}_{record['id']}"
+        question_args.temp_video_dir = f"{args.temp_video_dir}_{record['id']}"
+        start_time = time.perf_counter()
+        try:
+            answer = demo_infer(vlm_backend, None, question_args, record["question"], client,
+                                options=record["options"], coarse_memory=coarse_memory,
+                                coarse_summary=coarse_summary)
+            error = None
+        except Exception as e:
+            answer = None
+            error = repr(e)
+        writer.write({**record, "answer": answer, "error": error,
+                      "seconds": round(time.perf_counter() - start_time, 1)})
+
+    with ThreadPoolExecutor(max_workers=args.concurrent_questions) as pool:
+        list(pool.map(answer_question, records))
+
+
+if __name__ == "__main__":
+    # Setup logging
+    logger = Logger('videolucy_batch_infer.txt')
+    sys.stdout = logger
+
+    # Initialize
+    args = parse_args()
+    if not args.questions_jsonl:
+        raise ValueError("Please provide the questions with --questions_jsonl.")
+    client = llm_roles.create_llm(args)
+
+    # Setup directories with timestamp
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+    args.fine_memory_dir = f"{args.fine_memory_dir}_{timestamp}"
+    args.temp_video_dir = f"{args.temp_video_dir}_{timestamp}"
+
+    videos = load_question_records(args.questions_jsonl)
+    print(f"Loaded {sum(len(records) for records in videos.values())} questions about {len(videos)} videos")
+
+    if args.coarse_shards > 1:
+        # 分片进程各自加载模型；先提取所有视频的粗粒度记忆，分片进程退出后主进程再加载模型
+        for video_url in videos:
+            if os.path.exists(video_url) or video_url.startswith('http://') or video_url.startswith('https://'):
+                video_args = copy.copy(args)
+                video_args.video_url = video_url
+                vlm_roles.video_coarse_memory_extraction(None, None, video_args)
+    vlm_model, vlm_processor = vlm_roles.create_vlm(args)
+    vlm_backend = CoalescingBackend(get_vlm_backend(vlm_model, vlm_processor),
+                                    batch_size=args.infer_batch_size, max_wait=args.coalesce_wait)
+
+    writer = JsonlWriter(args.output_jsonl)
+    start_time = time.perf_counter()
+    for video_url, records in videos.items():
+        answer_video_questions(video_url, records, vlm_backend, client, args, writer)
+        print(f"Finished {len(records)} questions about {video_url}, "
+              f"coalesced VLM batches: {vlm_backend.stats()}")
+    writer.close()
+    vlm_backend.close()
+
+    print("=" * 30)
+    print(f"Answers written to {args.output_jsonl} in {time.perf_counter() - start_time:.1f}s")
+    print(f"LLM Response Cache: {client.cache_stats()}")
+    print(f"LLM Calls: {client.call_stats()}")
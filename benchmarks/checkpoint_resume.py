@@ -0,0 +1,83 @@
+"""
+Resuming an interrupted coarse memory extraction from its checkpoint.
+
+``video_coarse_memory_extraction`` runs on a synthetic video with the stub VLM of
+``period_search_modes.py``, which raises a simulated out-of-memory error after ``--crash_after``
+clips. The extraction is then restarted with a healthy stub. Reported: clips captioned before the
+crash, clips the restart had to caption, wall time of both runs against an uninterrupted run, and
+whether the resumed memory equals the uninterrupted one.
+
+    python benchmarks/checkpoint_resume.py --minutes 30 --crash_after 20
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from VLMs import vlm_roles
+from frame_decoding import make_synthetic_video
+from period_search_modes import StubModel, StubProcessor
+
+
+class CrashingStubModel(StubModel):
+    def __init__(self, batch_latency, clip_latency, crash_after):
+        super().__init__(batch_latency, clip_latency)
+        self.crash_after = crash_after
+
+    def generate(self, input_ids=None, **kwargs):
+        if self.clips + len(input_ids) > self.crash_after:
+            raise RuntimeError("simulated CUDA out of memory")
+        return super().generate(input_ids=input_ids, **kwargs)
+
+
+def extract(model, args):
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    start = time.perf_counter()
+    try:
+        return vlm_roles.video_coarse_memory_extraction(model, StubProcessor(), args), time.perf_counter() - start
+    except RuntimeError:
+        return None, time.perf_counter() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--minutes', type=int, default=30)
+    parser.add_argument('--crash_after', type=int, default=20, help="clips captioned before the simulated crash")
+    parser.add_argument('--vlm_batch_latency', type=float, default=0.2)
+    parser.add_argument('--vlm_clip_latency', type=float, default=0.05)
+    cli = parser.parse_args()
+
+    sys.argv = ["demo"]
+    import demo
+    video_path = os.path.join(tempfile.mkdtemp(prefix="checkpoint_video_"), "video.mp4")
+    make_synthetic_video(video_path, cli.minutes * 60, 2, 320, 180)
+
+    def make_args():
+        args = demo.parse_args()
+        args.video_url = video_path
+        args.cache_dir = tempfile.mkdtemp(prefix="checkpoint_resume_")
+        args.in_memory_clips = True
+        return args
+
+    reference, full_seconds = extract(StubModel(cli.vlm_batch_latency, cli.vlm_clip_latency), make_args())
+
+    args = make_args()
+    crashing = CrashingStubModel(cli.vlm_batch_latency, cli.vlm_clip_latency, cli.crash_after)
+    crashed, crash_seconds = extract(crashing, args)
+    assert crashed is None
+    resumed_model = StubModel(cli.vlm_batch_latency, cli.vlm_clip_latency)
+    resumed, resume_seconds = extract(resumed_model, args)
+
+    print(f"{len(reference)} clips, uninterrupted run {full_seconds:.1f}s")
+    print(f"crashed after {crashing.clips} clips in {crash_seconds:.1f}s, "
+          f"restart captioned {resumed_model.clips} clips in {resume_seconds:.1f}s")
+    print(f"resumed memory equals uninterrupted memory: {resumed == reference}")
+
+
+if __name__ == "__main__":
+    main()
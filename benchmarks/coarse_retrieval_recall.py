@@ -0,0 +1,115 @@
+"""
+Recall of the coarse memory retrieval index against the periods the LLM picks itself.
+
+For each demo question, the LLM sees the full coarse memory in the type-judge and top-k
+time-search prompts, and the coarse entries overlapping its chosen periods are the reference.
+The script reports which share of them the BM25 (or fused) index returns in its top k, and how many
+prompt tokens the type-judge prompt saves when restricted to those k entries.
+
+The LLM picks are written to ``--llm_periods_jsonl`` (in the system temp directory by default) and
+reused on later runs, so only the first run needs an API key:
+
+    python benchmarks/coarse_retrieval_recall.py --api_key <key> --top_k 2 4 6
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from LLMs import llm_roles
+from LLMs.utils import PROMPT_BUDGET, question_type_judge_prompt
+from memory_index import load_coarse_memory_index
+from utils import parse_answer
+
+DEMO_COARSE_MEMORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "demo_cache",
+                                  "coarse_memory", "demo_cache_c5f204b254f3fe1aad603c79779d2ae1.json")
+# 与 demo.py 中的示例问题相同
+DEMO_QUESTIONS = [
+    "Which restaurant did the protagonist go to for dinner in the evening? Additionally, in which year was this restaurant established, and what historical background does it have?",
+    "When the protagonist was eating oysters, how many kinds of sauces were paired with them, and what were they?",
+    "Where did the protagonist eat the lamb rice bowl? What did this lamb rice bowl look like, and what were its features?",
+    "Where did the girl the protagonist met while eating on the street come from? What was distinctive about her clothing today?",
+    "What was the previous profession of the girl the protagonist met while eating by the roadside, and what is her current occupation? What are her comments on the prospects and development of her present career?"
+]
+
+
+def overlapping_entries(coarse_memory, periods):
+    hits = set()
+    for period in periods:
+        for i, mem in enumerate(coarse_memory):
+            if mem['time_period'][0] < period[1] and period[0] < mem['time_period'][1]:
+                hits.add(i)
+    return hits
+
+
+def ask_llm_periods(coarse_memory, question, args, client):
+    periods = []
+    judge = parse_answer(llm_roles.video_question_type_judge_with_coarse_memory(
+        coarse_memory, question, options=[], args=args, client=client))
+    if judge is not None and judge['Flag']:
+        periods += [list(p) for p in judge['Time Period']]
+    search = parse_answer(llm_roles.video_question_get_top_k_related_times_with_coarse_memory(
+        coarse_memory, question, options=[], top_k=3, args=args, client=client))
+    if search is not None:
+        periods += [list(p) for p in search['Time Periods']]
+    return periods
+
+
+def main():
+    sys.argv, cli_argv = ["demo"], sys.argv[1:]
+    import demo
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--coarse_memory', type=str, default=DEMO_COARSE_MEMORY)
+    parser.add_argument('--llm_periods_jsonl', type=str,
+                        default=os.path.join(tempfile.gettempdir(), "retrieval_llm_periods.jsonl"))
+    parser.add_argument('--top_k', type=int, nargs='+', default=[2, 4, 6])
+    parser.add_argument('--retrieval_embedding_model', type=str, default="")
+    parser.add_argument('--api_key', type=str, default="")
+    parser.add_argument('--api_base_url', type=str, default="")
+    cli = parser.parse_args(cli_argv)
+
+    args = demo.parse_args()
+    args.cache_dir = tempfile.mkdtemp(prefix="retrieval_")
+    args.retrieval_embedding_model = cli.retrieval_embedding_model
+    if cli.api_key:
+        args.api_key = cli.api_key
+    if cli.api_base_url:
+        args.api_base_url = cli.api_base_url
+    with open(cli.coarse_memory, 'r', encoding='utf-8') as f:
+        coarse_memory = json.load(f)
+
+    llm_periods = {}
+    if os.path.exists(cli.llm_periods_jsonl):
+        with open(cli.llm_periods_jsonl, 'r', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                llm_periods[record["question"]] = record["periods"]
+    missing = [q for q in DEMO_QUESTIONS if q not in llm_periods]
+    if missing:
+        client = llm_roles.create_llm(args)
+        for question in missing:
+            llm_periods[question] = ask_llm_periods(coarse_memory, question, args, client)
+            # 每得到一个回答才追加写入，调用失败时不会留下空文件
+            with open(cli.llm_periods_jsonl, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"question": question, "periods": llm_periods[question]}, ensure_ascii=False) + "\n")
+        client.close()
+
+    index = load_coarse_memory_index(coarse_memory, args)
+    full_tokens = PROMPT_BUDGET.count(question_type_judge_prompt(coarse_memory, DEMO_QUESTIONS[0], []))
+    print(f"{len(coarse_memory)} coarse entries, type-judge prompt {full_tokens} tokens with all of them")
+    print(f"{'k':>3} {'recall':>7} {'judge tokens':>12}")
+    for k in cli.top_k:
+        found = total = tokens = 0
+        for question in DEMO_QUESTIONS:
+            reference = overlapping_entries(coarse_memory, llm_periods[question])
+            retrieved = set(index.search(question, k))
+            found += len(reference & retrieved)
+            total += len(reference)
+            tokens += PROMPT_BUDGET.count(question_type_judge_prompt(coarse_memory, question, [], sorted(retrieved)))
+        print(f"{k:>3} {found / max(total, 1):>7.1%} {tokens / len(DEMO_QUESTIONS):>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Throughput of the staged job queue runner against the per-video loop of ``batch_infer.py``.
+
+``--videos`` synthetic videos with ``--questions`` questions each are processed twice with the stub
+VLM of ``period_search_modes.py`` and a ``MockOpenAIServer``: once video after video as
+``batch_infer.py`` does, and once through ``queue_infer.run_job_queue`` with separate download,
+coarse, summary and QA worker pools. Downloads are simulated with ``--download_latency`` seconds
+of sleep, and in the queue run the first attempt of every ``--fail_every``-th QA job raises, to
+exercise retries. Reported: wall time, answers written, busy share of the coarse (GPU) stage and
+retried attempts.
+
+    python benchmarks/job_queue_pipeline.py --videos 6 --questions 2 --download_latency 3
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from LLMs import llm_roles
+from VLMs.backends import get_vlm_backend
+from VLMs.coalescer import CoalescingBackend
+from frame_decoding import make_synthetic_video
+from mock_openai_server import MockOpenAIServer
+from period_search_modes import StubModel, StubProcessor, make_llm_reply
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--videos', type=int, default=6)
+    parser.add_argument('--questions', type=int, default=2)
+    parser.add_argument('--minutes', type=int, default=10)
+    parser.add_argument('--download_latency', type=float, default=3.0)
+    parser.add_argument('--llm_latency', type=float, default=0.5)
+    parser.add_argument('--vlm_batch_latency', type=float, default=0.5)
+    parser.add_argument('--vlm_clip_latency', type=float, default=0.1)
+    parser.add_argument('--fail_every', type=int, default=4)
+    cli = parser.parse_args()
+
+    sys.argv = ["demo"]
+    import batch_infer
+    import demo
+    import queue_infer
+    from job_queue import JobQueue
+
+    video_dir = tempfile.mkdtemp(prefix="job_queue_videos_")
+    manifest = os.path.join(video_dir, "questions.jsonl")
+    with open(manifest, 'w', encoding='utf-8') as f:
+        for v in range(cli.videos):
+            video_path = os.path.join(video_dir, f"video_{v}.mp4")
+            make_synthetic_video(video_path, cli.minutes * 60 + v, 2, 320, 180)
+            for q in range(cli.questions):
+                f.write(json.dumps({"video": video_path, "question": f"What happens in scene {q}?"}) + "\n")
+    periods = [[float(start), float(start + 60)] for start in range(0, cli.minutes * 60, 60)]
+    target_period = periods[len(periods) // 2]
+    ranked = [p for p in periods if p != target_period]
+    ranked.insert(1, target_period)
+
+    def make_args(server):
+        args = demo.parse_args()
+        args.cache_dir = tempfile.mkdtemp(prefix="job_queue_")
+        args.in_memory_clips = True
+        args.api_base_url = server.base_url
+        args.llm_cache_bypass = True
+        args.output_jsonl = os.path.join(args.cache_dir, "answers.jsonl")
+        args.questions_jsonl = manifest
+        args.queue_poll_seconds = 0.1
+        args.report_seconds = 1e9
+        args.job_retry_backoff = 0.5
+        return args
+
+    def count_lines(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return sum(1 for _ in f)
+
+    run_download = queue_infer.STAGE_HANDLERS["download"]
+    run_qa = queue_infer.STAGE_HANDLERS["qa"]
+
+    def slow_download(job, args, resources):
+        time.sleep(cli.download_latency)
+        return run_download(job, args, resources)
+
+    def flaky_qa(job, args, resources):
+        if job["attempts"] == 1 and int(job["payload"]["record"]["id"]) % cli.fail_every == 0:
+            raise RuntimeError("simulated QA failure")
+        return run_qa(job, args, resources)
+
+    print(f"{'runner':>10} {'seconds':>8} {'answers':>8} {'coarse busy':>12} {'retries':>8}")
+    with MockOpenAIServer(make_llm_reply(ranked, target_period), latency=cli.llm_latency) as server:
+        stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+        try:
+            # 逐个视频处理，与 batch_infer.py 相同
+            args = make_args(server)
+            model = StubModel(cli.vlm_batch_latency, cli.vlm_clip_latency)
+            vlm = CoalescingBackend(get_vlm_backend(model, StubProcessor()), batch_size=args.infer_batch_size)
+            client = llm_roles.create_llm(args)
+            writer = batch_infer.JsonlWriter(args.output_jsonl)
+            start = time.perf_counter()
+            coarse_seconds = 0.0
+            for video_url, records in batch_infer.load_question_records(manifest).items():
+                time.sleep(cli.download_latency)
+                coarse_start = time.perf_counter()
+                queue_infer.vlm_roles.video_coarse_memory_extraction(vlm.backend, None,
+                                                                      queue_infer.get_video_args(args, video_url))
+                coarse_seconds += time.perf_counter() - coarse_start
+                batch_infer.answer_video_questions(video_url, records, vlm, client, args, writer)
+            sequential = (time.perf_counter() - start, count_lines(args.output_jsonl), coarse_seconds, 0)
+            writer.close()
+            vlm.close()
+            client.close()
+
+            args = make_args(server)
+            queue_infer.STAGE_HANDLERS["download"] = slow_download
+            queue_infer.STAGE_HANDLERS["qa"] = flaky_qa
+            model = StubModel(cli.vlm_batch_latency, cli.vlm_clip_latency)
+            resources = {"vlm": CoalescingBackend(get_vlm_backend(model, StubProcessor()), batch_size=args.infer_batch_size),
+                         "client": llm_roles.create_llm(args),
+                         "writer": batch_infer.JsonlWriter(args.output_jsonl)}
+            queue = JobQueue(os.path.join(args.cache_dir, "job_queue.sqlite"), args.job_max_attempts,
+                             args.job_retry_backoff)
+            queue_infer.enqueue_manifest(queue, manifest)
+            start = time.perf_counter()
+            pools = queue_infer.run_job_queue(queue, args, resources)
+            elapsed = time.perf_counter() - start
+            resources["writer"].close()
+            resources["vlm"].close()
+            resources["client"].close()
+            with queue._connect() as conn:
+                retries = conn.execute("SELECT COALESCE(SUM(attempts - 1), 0) FROM job").fetchone()[0]
+            queued = (elapsed, count_lines(args.output_jsonl), pools["coarse"].busy_seconds, retries)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+    for name, (seconds, answers, coarse_seconds, retries) in (("batch", sequential), ("queue", queued)):
+        print(f"{name:>10} {seconds:>8.1f} {answers:>8} {coarse_seconds / seconds:>12.0%} {retries:>8}")
+
+
+if __name__ == "__main__":
+    main()
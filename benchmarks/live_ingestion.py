@@ -0,0 +1,109 @@
+"""
+Ingest lag of ``--follow`` coarse memory extraction on a video that is still being recorded.
+
+A recorder thread writes ``--minutes`` of synthetic MPEG-TS video with PyAV at ``--speed`` times
+real time, flushing after every frame. ``video_coarse_memory_follow`` follows the file with the
+stub VLM of ``period_search_modes.py`` while the main thread polls the memory log. For every
+window the lag is the time from the recorder writing the window's last frame to the window's
+entry appearing in the log. At the end, the followed memory is checked against a one-shot
+``video_coarse_memory_extraction`` of the finished file.
+
+    python benchmarks/live_ingestion.py --minutes 10 --speed 20 --poll 0.5
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import av
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from VLMs import vlm_roles
+from period_search_modes import StubModel, StubProcessor
+
+
+def record(path, seconds, fps, speed, written):
+    """Write a growing MPEG-TS file, noting the wall time each frame was flushed to disk."""
+    rng = np.random.default_rng(0)
+    noise = rng.integers(0, 255, (180, 320, 3), dtype=np.uint8)
+    with open(path, 'wb') as f:
+        container = av.open(f, mode='w', format='mpegts')
+        stream = container.add_stream('mpeg2video', rate=fps)
+        stream.width, stream.height, stream.pix_fmt = 320, 180, 'yuv420p'
+        start = time.perf_counter()
+        for i in range(int(seconds * fps)):
+            time.sleep(max(start + i / fps / speed - time.perf_counter(), 0))
+            frame = av.VideoFrame.from_ndarray(np.roll(noise, i * 4, axis=1), format='rgb24')
+            for packet in stream.encode(frame):
+                container.mux(packet)
+            f.flush()
+            written.append(time.perf_counter())
+        for packet in stream.encode():
+            container.mux(packet)
+        container.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--minutes', type=float, default=10)
+    parser.add_argument('--fps', type=int, default=4)
+    parser.add_argument('--speed', type=float, default=20.0, help="recording speed relative to real time")
+    parser.add_argument('--poll', type=float, default=0.5, help="--follow_poll_seconds")
+    parser.add_argument('--vlm_batch_latency', type=float, default=0.2)
+    parser.add_argument('--vlm_clip_latency', type=float, default=0.1)
+    cli = parser.parse_args()
+
+    sys.argv = ["demo"]
+    import demo
+    args = demo.parse_args()
+    args.cache_dir = tempfile.mkdtemp(prefix="live_ingestion_")
+    args.video_url = os.path.join(args.cache_dir, "live.ts")
+    args.in_memory_clips = True
+    args.follow = True
+    args.follow_poll_seconds = cli.poll
+    args.follow_idle_seconds = max(2.0, 4 * cli.poll)
+
+    written = []
+    recorder = threading.Thread(target=record, args=(args.video_url, cli.minutes * 60, cli.fps, cli.speed, written))
+    recorder.start()
+    while not written:
+        time.sleep(0.01)
+    followed = {}
+    follower = threading.Thread(target=lambda: followed.setdefault("memory", vlm_roles.video_coarse_memory_follow(
+        StubModel(cli.vlm_batch_latency, cli.vlm_clip_latency), StubProcessor(), args)))
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    try:
+        follower.start()
+        appeared = []
+        while follower.is_alive():
+            entries = vlm_roles.load_followed_coarse_memory(args)
+            appeared.extend([time.perf_counter()] * (len(entries) - len(appeared)))
+            time.sleep(0.05)
+        recorder.join()
+
+        reference_args = demo.parse_args()
+        reference_args.__dict__.update(args.__dict__)
+        reference_args.cache_dir = tempfile.mkdtemp(prefix="live_ingestion_reference_")
+        reference = vlm_roles.video_coarse_memory_extraction(StubModel(0.0, 0.0), StubProcessor(), reference_args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    memory = followed["memory"]
+    lags = []
+    for entry, seen in zip(memory, appeared):
+        last_frame = min(int(round(entry["time_period"][1] * cli.fps)) - 1, len(written) - 1)
+        lags.append(seen - written[last_frame])
+    closed = lags[:-1]
+    print(f"{len(memory)} windows of {args.short_video_frames}s followed, recorded at {cli.speed:g}x, poll {cli.poll}s")
+    print(f"ingest lag of closed windows in seconds: avg {np.mean(closed):.1f}, "
+          f"p95 {np.percentile(closed, 95):.1f}, max {np.max(closed):.1f}")
+    same = [list(m["time_period"]) for m in memory] == [list(m["time_period"]) for m in reference]
+    print(f"followed memory matches one-shot extraction of the finished file: {same}")
+
+
+if __name__ == "__main__":
+    main()
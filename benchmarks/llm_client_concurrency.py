@@ -0,0 +1,53 @@
+"""
+Latency of independent LLM calls through ``LLMs.client.LLMClient`` against a local stand-in server.
+
+Compares the blocking one-call-at-a-time pattern of ``llm_roles`` with ``chat_many`` from a
+plain thread and ``achat_many`` from an asyncio program, at several concurrency limits.
+
+    python benchmarks/llm_client_concurrency.py --calls 32 --latency 0.2 --concurrency 1 8 32
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from LLMs.client import LLMClient
+from mock_openai_server import MockOpenAIServer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds the stand-in server takes per request")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    cli = parser.parse_args()
+
+    prompts = [f"Question {k}: what happens in the video?" for k in range(cli.calls)]
+    with MockOpenAIServer(latency=cli.latency) as server:
+        for concurrency in cli.concurrency:
+            client = LLMClient("EMPTY", "mock", base_url=server.base_url, max_concurrency=concurrency)
+
+            start = time.perf_counter()
+            sequential = [client.chat(prompt) for prompt in prompts]
+            sequential_seconds = time.perf_counter() - start
+
+            server.reset_stats()
+            start = time.perf_counter()
+            threaded = client.chat_many(prompts)
+            threaded_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            overlapped = asyncio.run(client.achat_many(prompts))
+            async_seconds = time.perf_counter() - start
+            client.close()
+
+            assert sequential == threaded == overlapped
+            print(f"concurrency {concurrency:3d}: sequential {sequential_seconds:6.2f}s, "
+                  f"chat_many {threaded_seconds:6.2f}s, achat_many {async_seconds:6.2f}s, "
+                  f"peak {server.peak} in flight")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Success rate and latency of ``LLMClient`` calls against a faulty server.
+
+Sends ``--calls`` time-search style prompts through ``LLMClient`` to a ``MockOpenAIServer`` whose
+``FaultInjector`` fails some requests with HTTP 500/429, unparsable replies, or a slow tail. Each
+configuration is reported with its share of successful calls, latency percentiles and the
+client's retry and hedge counts. Hedging only helps while the slow share stays below 5%; above it,
+the p95 threshold itself lands in the slow tail.
+
+    python benchmarks/llm_fault_tolerance.py --calls 200 --error_rate 0.1 --slow_rate 0.03
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from LLMs.client import LLMClient, LLMCallError
+from LLMs.utils import reply_has_keys
+from mock_openai_server import FaultInjector, MockOpenAIServer
+
+
+def reply(request):
+    return str({"Time Period": [(0.0, 60.0)], "Instruction": "Describe it.", "Reason": "mock"})
+
+
+def run_config(name, server, cli, **client_kwargs):
+    server.faults = FaultInjector({"http_500": cli.error_rate / 3, "http_429": cli.error_rate / 3,
+                                   "garbage": cli.error_rate / 3, "slow": cli.slow_rate},
+                                  slow_latency=cli.slow_latency, seed=cli.seed)
+    client = LLMClient("EMPTY", "mock", base_url=server.base_url, max_concurrency=cli.concurrency,
+                       backoff_base=0.05, backoff_max=0.5, **client_kwargs)
+    validate = reply_has_keys("Time Period", "Instruction")
+    # 先用少量无故障请求积累延迟样本，供对冲阈值使用
+    faults, server.faults = server.faults, None
+    client.chat_many([f"warm-up {i}" for i in range(20)], phase="time_search", validate=validate)
+    server.faults = faults
+
+    def call(i):
+        start = time.perf_counter()
+        try:
+            client.chat(f"question {i}", phase="time_search", validate=validate)
+            ok = True
+        except LLMCallError:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    with ThreadPoolExecutor(cli.concurrency) as pool:
+        results = list(pool.map(call, range(cli.calls)))
+    stats = client.call_stats()
+    client.close()
+    latencies = sorted(seconds for _, seconds in results)
+    pct = lambda q: latencies[int(q * (len(latencies) - 1))]
+    print(f"{name:>16} {sum(ok for ok, _ in results) / len(results):>8.1%} {pct(0.5):>6.2f} {pct(0.95):>6.2f} "
+          f"{pct(0.99):>6.2f} {stats['retries']:>7} {stats['hedges']:>6} {stats['hedge_wins']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.1, help="seconds per normal mock reply")
+    parser.add_argument('--error_rate', type=float, default=0.1, help="share of 500/429/unparsable replies")
+    parser.add_argument('--slow_rate', type=float, default=0.03, help="share of replies delayed by --slow_latency")
+    parser.add_argument('--slow_latency', type=float, default=3.0)
+    parser.add_argument('--seed', type=int, default=0)
+    cli = parser.parse_args()
+
+    print(f"{'config':>16} {'success':>8} {'p50':>6} {'p95':>6} {'p99':>6} {'retries':>7} {'hedges':>6} {'hedge wins':>9}")
+    with MockOpenAIServer(reply, latency=cli.latency) as server:
+        run_config("no retries", server, cli, max_retries=0)
+        run_config("retries", server, cli, max_retries=4)
+        run_config("retries+hedge", server, cli, max_retries=4, hedge=True)
+        run_config("deadline 1s", server, cli, max_retries=4, deadlines={"time_search": 1.0})
+
+
+if __name__ == "__main__":
+    main()
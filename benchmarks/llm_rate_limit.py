@@ -0,0 +1,72 @@
+"""
+Throughput, 429s and fairness of concurrent questions under a provider rate quota.
+
+A ``MockOpenAIServer`` enforces ``--rpm`` requests and ``--tpm`` prompt tokens per minute with a
+``RateQuota`` and answers 429 above them. ``--questions`` threads each send ``--calls`` sequential
+prompts through one shared ``LLMClient``; the first question sends prompts ``--heavy_factor``
+times longer than the others. The run is repeated without and with the client-side
+``RateLimiter`` set to the same quota. Reported: wall time, requests per second against the quota,
+429s the server sent, calls that still failed after all retries, the finish time of the slowest light question, and queue waits.
+
+    python benchmarks/llm_rate_limit.py --rpm 600 --tpm 200000 --questions 8 --calls 15
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from LLMs.client import LLMCallError, LLMClient
+from LLMs.rate_limit import RateLimiter
+from mock_openai_server import MockOpenAIServer, RateQuota
+
+
+def run_config(name, server, cli, rate_limiter):
+    quota = RateQuota(cli.rpm, cli.tpm)
+    server.faults = quota
+    server.reset_stats()
+    client = LLMClient("EMPTY", "mock", base_url=server.base_url, max_concurrency=32, max_retries=8,
+                       backoff_base=0.2, backoff_max=5.0, rate_limiter=rate_limiter)
+    start = time.perf_counter()
+
+    def question(q):
+        words = cli.prompt_words * (cli.heavy_factor if q == 0 else 1)
+        for i in range(cli.calls):
+            try:
+                client.chat(f"question {q} call {i} " + "word " * words, phase="bench")
+            except LLMCallError:
+                pass
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(cli.questions) as pool:
+        finish = list(pool.map(question, range(cli.questions)))
+    elapsed = time.perf_counter() - start
+    stats = client.call_stats()
+    client.close()
+    done = cli.questions * cli.calls - stats["failed_calls"]
+    wait = stats.get("rate_limiter", {}).get("queue_wait_p95", 0.0)
+    print(f"{name:>12} {elapsed:>8.1f} {done / elapsed:>8.2f} {quota.rejected:>6} {stats['failed_calls']:>7} {max(finish[1:]):>12.1f} "
+          f"{finish[0]:>10.1f} {wait:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rpm', type=float, default=600)
+    parser.add_argument('--tpm', type=float, default=200000)
+    parser.add_argument('--questions', type=int, default=8)
+    parser.add_argument('--calls', type=int, default=15)
+    parser.add_argument('--prompt_words', type=int, default=200)
+    parser.add_argument('--heavy_factor', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.05)
+    cli = parser.parse_args()
+
+    print(f"quota: {cli.rpm / 60:.1f} requests/s, {cli.tpm / 60:.0f} tokens/s")
+    print(f"{'config':>12} {'seconds':>8} {'req/s':>8} {'429s':>6} {'failed':>7} {'light done':>12} {'heavy done':>10} {'wait p95':>10}")
+    with MockOpenAIServer(latency=cli.latency) as server:
+        run_config("no limiter", server, cli, None)
+        run_config("limiter", server, cli, RateLimiter(cli.rpm, cli.tpm))
+
+
+if __name__ == "__main__":
+    main()
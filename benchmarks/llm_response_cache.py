@@ -0,0 +1,77 @@
+"""
+Cold run vs. replay of ``demo_infer`` with the persistent LLM response cache.
+
+Runs the same questions three times against a ``MockOpenAIServer`` with ``--llm_latency`` seconds
+per call and the stub VLM of ``period_search_modes.py``: once with an empty cache, once replaying
+from it, and once with ``--llm_cache_bypass True``. Fine memories come from the fine memory store
+after the first run in all cases, so the timings isolate the LLM side.
+
+    python benchmarks/llm_response_cache.py --llm_latency 2.0 --questions 3
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from LLMs import llm_roles
+from frame_decoding import make_synthetic_video
+from mock_openai_server import MockOpenAIServer
+from period_search_modes import StubModel, StubProcessor, make_llm_reply
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--llm_latency', type=float, default=2.0, help="seconds per mock LLM call")
+    parser.add_argument('--questions', type=int, default=3)
+    parser.add_argument('--minutes', type=int, default=8)
+    cli = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp(prefix="llm_response_cache_")
+    video_path = os.path.join(cache_dir, "video.mp4")
+    make_synthetic_video(video_path, cli.minutes * 60, 4, 320, 180)
+    coarse_memory = [{"time_period": (float(start), float(start + 60)),
+                      "general_memory": f"A rough description of minute {start // 60}. " * 20}
+                     for start in range(0, cli.minutes * 60, 60)]
+    periods = [list(mem["time_period"]) for mem in coarse_memory]
+    target_period = periods[len(periods) // 2]
+    ranked = [p for p in periods if p != target_period]
+    ranked.insert(1, target_period)
+
+    sys.argv = ["demo"]
+    import demo
+    stdout = sys.stdout
+    rows = []
+    with MockOpenAIServer(make_llm_reply(ranked, target_period), latency=cli.llm_latency) as server:
+        for run, bypass in (("cold", False), ("replay", False), ("bypass", True)):
+            args = demo.parse_args()
+            args.video_url = video_path
+            args.cache_dir = cache_dir
+            args.in_memory_clips = True
+            args.api_base_url = server.base_url
+            args.llm_cache_bypass = bypass
+            server.reset_stats()
+            client = llm_roles.create_llm(args)
+            start = time.perf_counter()
+            sys.stdout = open(os.devnull, "w")
+            try:
+                answers = [demo.demo_infer(StubModel(0.0, 0.0), StubProcessor(), args, f"What happens in scene {q}?",
+                                           client, coarse_memory=coarse_memory)
+                           for q in range(cli.questions)]
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            rows.append((run, answers, time.perf_counter() - start, server.requests, client.cache_stats()))
+            client.close()
+
+    print(f"{'run':>6} {'seconds':>8} {'llm requests':>12} {'hit rate':>8} {'entries':>7}")
+    for run, answers, seconds, requests, stats in rows:
+        hit_rate = f"{stats['hit_rate']:.0%}" if stats else "-"
+        entries = stats['entries'] if stats else "-"
+        print(f"{run:>6} {seconds:>8.1f} {requests:>12} {hit_rate:>8} {entries:>7}")
+    print("replay answers identical:", rows[0][1] == rows[1][1])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Local stand-in for an OpenAI-compatible ``/chat/completions`` endpoint, used by the benchmarks.
+
+Every request is answered after ``latency`` seconds by ``reply_fn(request)``, and concurrency is
+tracked so a benchmark can check how many requests a client really keeps in flight. A
+``FaultInjector`` passed as ``faults`` turns some requests into HTTP errors, unparsable replies or
+slow replies, to exercise the client's retries, deadlines and hedging.
+
+    with MockOpenAIServer(latency=0.2) as server:
+        client = LLMClient("EMPTY", "mock", base_url=server.base_url)
+"""
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def echo_reply(request):
+    content = request["messages"][-1]["content"]
+    if not isinstance(content, str):
+        content = " ".join(part.get("text", part.get("type", "")) for part in content)
+    return f"Echo: {content[:80]}"
+
+
+class MockHTTPServer(ThreadingHTTPServer):
+    # 默认的监听队列只有 5，高并发客户端同时建连时会被重置
+    request_queue_size = 128
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端取消的请求（对冲、超时）会断开连接，不必打印
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+class FaultInjector:
+    """
+    Pick a fault for each request at the given rates.
+
+    Faults: ``"http_500"``, ``"http_429"`` and ``"http_400"`` answer with that status,
+    ``"garbage"`` replies with text holding no dictionary, and ``"slow"`` adds ``slow_latency``
+    seconds before a normal reply. Requests drawing no fault are answered normally.
+    """
+
+    def __init__(self, rates: dict, slow_latency: float = 5.0, seed: int = 0):
+        self.rates = rates
+        self.slow_latency = slow_latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def __call__(self, request):
+        with self.lock:
+            draw = self.random.random()
+            for fault, rate in self.rates.items():
+                if draw < rate:
+                    self.counts[fault] = self.counts.get(fault, 0) + 1
+                    return fault
+                draw -= rate
+        return None
+
+
+class RateQuota:
+    """
+    Provider-style quota: requests over ``rpm`` requests or ``tpm`` prompt tokens per minute get HTTP 429.
+
+    Usable as the ``faults`` of a ``MockOpenAIServer``. Both limits are token buckets holding
+    ``burst_seconds`` of quota, prompt tokens are estimated as the server's usage field does, and
+    ``rejected`` counts the 429 replies.
+    """
+
+    slow_latency = 0.0
+
+    def __init__(self, rpm: float, tpm: float, burst_seconds: float = 2.0):
+        self.limits = [(rpm / 60.0, rpm / 60.0 * burst_seconds), (tpm / 60.0, tpm / 60.0 * burst_seconds)]
+        self.levels = [capacity for _, capacity in self.limits]
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def __call__(self, request):
+        cost = [1.0, len(json.dumps(request["messages"])) // 4]
+        with self.lock:
+            now = time.monotonic()
+            self.levels = [min(capacity, level + (now - self.updated) * rate)
+                           for level, (rate, capacity) in zip(self.levels, self.limits)]
+            self.updated = now
+            if any(level < min(c, capacity) for level, c, (_, capacity) in zip(self.levels, cost, self.limits)):
+                self.rejected += 1
+                return "http_429"
+            self.levels = [level - c for level, c in zip(self.levels, cost)]
+        return None
+
+
+class MockOpenAIServer:
+    def __init__(self, reply_fn=echo_reply, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0,
+                 faults=None):
+        self.reply_fn = reply_fn
+        self.latency = latency
+        self.faults = faults
+        self.active = 0
+        self.peak = 0
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.lock = threading.Lock()
+        self.server = MockHTTPServer((host, port), self.make_handler())
+        self.base_url = f"http://{host}:{self.server.server_port}/v1"
+
+    def reset_stats(self):
+        with self.lock:
+            self.peak = self.requests = 0
+            self.prompt_tokens = self.completion_tokens = 0
+
+    def make_handler(self):
+        state = self
+
+        class ChatCompletionsHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                if not body:
+                    return
+                request = json.loads(body)
+                with state.lock:
+                    state.active += 1
+                    state.requests += 1
+                    state.peak = max(state.peak, state.active)
+                fault = state.faults(request) if state.faults is not None else None
+                try:
+                    time.sleep(state.latency + (state.faults.slow_latency if fault == "slow" else 0.0))
+                    content = state.reply_fn(request) if fault != "garbage" else "Sorry, I lost my train of thought."
+                finally:
+                    with state.lock:
+                        state.active -= 1
+                if fault in ("http_500", "http_429", "http_400"):
+                    self.send_error_json(int(fault[-3:]))
+                    return
+                prompt_tokens = len(json.dumps(request["messages"])) // 4
+                completion_tokens = len(content) // 4
+                with state.lock:
+                    state.prompt_tokens += prompt_tokens
+                    state.completion_tokens += completion_tokens
+                body = json.dumps({
+                    "id": f"mock-{state.requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "mock"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_tokens + completion_tokens},
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_error_json(self, status):
+                body = json.dumps({"error": {"message": f"injected fault {status}", "type": "mock_error",
+                                             "code": str(status)}}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return ChatCompletionsHandler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
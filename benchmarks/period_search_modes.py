@@ -0,0 +1,158 @@
+"""
+End-to-end latency and cost of the two fine-memory search modes of ``demo_infer``.
+
+``--period_search iterative`` asks the LLM for one time period per round and extracts and answers
+after each; ``--period_search top_k`` asks once for ``top_k`` ranked periods, extracts them in one
+batched run and answers once. Both run against a stub VLM that sleeps per batch and clip, and a
+local ``MockOpenAIServer`` whose replies rank the coarse periods so the period holding the answer
+comes at ``--target_rank``. The answer is only confident once that period's fine memory is shown.
+
+    python benchmarks/period_search_modes.py --target_rank 1 3 --llm_latency 2.0
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from LLMs import llm_roles
+from frame_decoding import make_synthetic_video
+from mock_openai_server import MockOpenAIServer
+
+
+class StubInputs(dict):
+    def __init__(self, batch_size):
+        super().__init__(input_ids=torch.zeros(batch_size, 4, dtype=torch.long))
+        self.input_ids = self["input_ids"]
+
+    def to(self, device):
+        return self
+
+
+class StubProcessor:
+    def apply_chat_template(self, message, tokenize=False, add_generation_prompt=True):
+        return message[1]["content"][0]["text"]
+
+    def tokenizer(self, text):
+        return {"input_ids": text.split()}
+
+    def __call__(self, text, videos=None, **kwargs):
+        return StubInputs(len(text))
+
+    def batch_decode(self, ids, **kwargs):
+        return ["A detailed description of the clip." for _ in ids]
+
+
+class StubModel:
+    """Sleeps ``batch_latency + clip_latency * batch size`` per generate call."""
+
+    def __init__(self, batch_latency, clip_latency):
+        self.batch_latency = batch_latency
+        self.clip_latency = clip_latency
+        self.calls = 0
+        self.clips = 0
+
+    def generate(self, input_ids=None, **kwargs):
+        time.sleep(self.batch_latency + self.clip_latency * len(input_ids))
+        self.calls += 1
+        self.clips += len(input_ids)
+        return torch.cat([input_ids, torch.ones(len(input_ids), 2, dtype=torch.long)], 1)
+
+
+def make_llm_reply(ranked_periods, target_period):
+    target_note = "from {} seconds to {} seconds".format(*target_period)
+
+    def reply(request):
+        prompt = request["messages"][-1]["content"]
+        if '"Time Periods"' in prompt:
+            k = int(re.search(r"at most (\d+) most relevant", prompt).group(1))
+            return str({"Time Periods": [tuple(p) for p in ranked_periods[:k]], "Instruction": "Describe it."})
+        if "caption model" in prompt:
+            for period in ranked_periods:
+                if "({},{});".format(*period) not in prompt:
+                    return str({"Time Period": [tuple(period)], "Instruction": "Describe it."})
+        if '"Flag"' in prompt:
+            return str({"Flag": False, "Time Period": "No Time Periods."})
+        if "provide the time periods you are referring to" in prompt:
+            return str({"Confidence": False, "Answer": "No Answer", "Time Period": "No Time"})
+        if '"Confidence"' in prompt:
+            found = target_note in prompt
+            return str({"Confidence": found, "Answer": "The answer." if found else "No Answer"})
+        if '"Answer"' in prompt:
+            return str({"Answer": "The answer." if target_note in prompt else "A guess."})
+        return "A summary of the video."
+
+    return reply
+
+
+def run_mode(mode, target_rank, cli, video_path, coarse_memory, server):
+    sys.argv = ["demo"]
+    import demo
+    args = demo.parse_args()
+    args.video_url = video_path
+    args.cache_dir = tempfile.mkdtemp(prefix="period_search_")
+    args.in_memory_clips = True
+    args.api_base_url = server.base_url
+    args.period_search = mode
+    args.top_k_periods = cli.top_k
+
+    periods = [list(mem["time_period"]) for mem in coarse_memory]
+    target_period = periods[len(periods) // 2]
+    ranked = [p for p in periods if p != target_period]
+    ranked.insert(target_rank - 1, target_period)
+    server.reply_fn = make_llm_reply(ranked, target_period)
+    server.reset_stats()
+
+    model = StubModel(cli.vlm_batch_latency, cli.vlm_clip_latency)
+    client = llm_roles.create_llm(args)
+    start = time.perf_counter()
+    answer = demo.demo_infer(model, StubProcessor(), args, "What happens?", client,
+                             coarse_memory=coarse_memory, coarse_summary=["A summary of the video."])
+    elapsed = time.perf_counter() - start
+    client.close()
+    return {"answer": answer, "seconds": elapsed, "llm_calls": server.requests,
+            "llm_prompt_tokens": server.prompt_tokens, "vlm_calls": model.calls, "vlm_clips": model.clips}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--target_rank', type=int, nargs='+', default=[1, 3])
+    parser.add_argument('--top_k', type=int, default=3)
+    parser.add_argument('--minutes', type=int, default=8)
+    parser.add_argument('--llm_latency', type=float, default=2.0, help="seconds per mock LLM call")
+    parser.add_argument('--vlm_batch_latency', type=float, default=0.5, help="seconds per stub generate call")
+    parser.add_argument('--vlm_clip_latency', type=float, default=0.2, help="extra seconds per clip in a batch")
+    cli = parser.parse_args()
+
+    video_path = os.path.join(tempfile.mkdtemp(prefix="period_search_"), "video.mp4")
+    make_synthetic_video(video_path, cli.minutes * 60, 4, 320, 180)
+    coarse_memory = [{"time_period": (float(start), float(start + 60)),
+                      "general_memory": "A rough description of the minute. " * 20}
+                     for start in range(0, cli.minutes * 60, 60)]
+
+    stdout = sys.stdout
+    rows = []
+    with MockOpenAIServer(latency=cli.llm_latency) as server:
+        for target_rank in cli.target_rank:
+            for mode in ("iterative", "top_k"):
+                sys.stdout = open(os.devnull, "w")
+                try:
+                    result = run_mode(mode, target_rank, cli, video_path, coarse_memory, server)
+                finally:
+                    sys.stdout.close()
+                    sys.stdout = stdout
+                rows.append((target_rank, mode, result))
+
+    print(f"{'rank':>4} {'mode':>9} {'answer':>12} {'seconds':>8} {'llm calls':>9} "
+          f"{'llm tokens':>10} {'vlm calls':>9} {'vlm clips':>9}")
+    for target_rank, mode, r in rows:
+        print(f"{target_rank:>4} {mode:>9} {str(r['answer']):>12} {r['seconds']:>8.1f} {r['llm_calls']:>9} "
+              f"{r['llm_prompt_tokens']:>10} {r['vlm_calls']:>9} {r['vlm_clips']:>9}")
+
+
+if __name__ == "__main__":
+    main()
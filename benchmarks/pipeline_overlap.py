@@ -0,0 +1,98 @@
+"""
+Overlap and termination of ``VLMs.pipeline.run_pipelined`` for different prefetch and worker counts.
+
+A source of ``--batches`` batches sleeps ``--decode_latency`` per batch, preparation sleeps
+``--prepare_latency`` and generation ``--generate_latency``. Every combination of ``--prefetch``
+and ``--workers`` is run, including more workers than prefetch slots, and must yield all batches
+in source order; a source or preparation error must be raised to the caller. Each run gets
+``--timeout`` seconds, so a pipeline that deadlocks is reported as such instead of hanging.
+
+    python benchmarks/pipeline_overlap.py --batches 20 --prefetch 1 2 --workers 1 2 4
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from VLMs.pipeline import run_pipelined
+
+
+def slow_source(batches, latency, fail_at=None):
+    for i in range(batches):
+        time.sleep(latency)
+        if i == fail_at:
+            raise RuntimeError("simulated decode error")
+        yield [i]
+
+
+def run_with_timeout(target, timeout):
+    """Run ``target`` on a daemon thread; returns (finished, result or exception)."""
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = target()
+        except Exception as e:
+            outcome["result"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive(), outcome.get("result")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batches', type=int, default=20)
+    parser.add_argument('--prefetch', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--decode_latency', type=float, default=0.02)
+    parser.add_argument('--prepare_latency', type=float, default=0.05)
+    parser.add_argument('--generate_latency', type=float, default=0.05)
+    parser.add_argument('--timeout', type=float, default=30.0)
+    cli = parser.parse_args()
+
+    def prepare(batch_idx, batch):
+        time.sleep(cli.prepare_latency)
+        return batch
+
+    def generate(prepared):
+        time.sleep(cli.generate_latency)
+        return prepared
+
+    def failing_prepare(batch_idx, batch):
+        if batch_idx == cli.batches // 2:
+            raise RuntimeError("simulated preprocessing error")
+        return prepare(batch_idx, batch)
+
+    print(f"{'prefetch':>8} {'workers':>8} {'case':>14} {'seconds':>8} {'result':>10}  utilization")
+    ok = True
+    for prefetch in cli.prefetch:
+        for workers in cli.workers:
+            cases = (("complete", lambda: slow_source(cli.batches, cli.decode_latency), prepare),
+                     ("source error", lambda: slow_source(cli.batches, cli.decode_latency, cli.batches // 2), prepare),
+                     ("prepare error", lambda: slow_source(cli.batches, cli.decode_latency), failing_prepare))
+            for case, source, prepare_fn in cases:
+                report = []
+                start = time.perf_counter()
+                finished, result = run_with_timeout(
+                    lambda: list(run_pipelined(source(), prepare_fn, generate, prefetch=prefetch,
+                                               num_workers=workers, report=report)), cli.timeout)
+                seconds = time.perf_counter() - start
+                if not finished:
+                    status = "deadlock"
+                elif case == "complete":
+                    status = "ok" if result == [(i, [i]) for i in range(cli.batches)] else "wrong"
+                else:
+                    status = "ok" if isinstance(result, RuntimeError) else "not raised"
+                ok &= status == "ok"
+                utilization = ", ".join(f"{name} {share:.0%}" for name, share in report[0].utilization().items()) \
+                    if report else "-"
+                print(f"{prefetch:>8} {workers:>8} {case:>14} {seconds:>8.2f} {status:>10}  {utilization}")
+    print(f"all runs terminated with the expected result: {ok}")
+
+
+if __name__ == "__main__":
+    main()
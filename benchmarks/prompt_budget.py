@@ -0,0 +1,71 @@
+"""
+Size and build time of the fine-memory prompts of a long video, with and without a token cap.
+
+Builds the prompts of ``get_single_related_time_prompt`` and
+``must_answer_with_coarse_and_fine_memory_prompt`` for a synthetic video with one coarse entry per
+``--clip_seconds`` and a growing number of fine memory blocks, as in successive search rounds.
+Reports each prompt's token count, the coarse entries kept, and whether the entry holding the
+answer survived.
+
+    python benchmarks/prompt_budget.py --hours 3 --max_prompt_tokens 32000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from LLMs.utils import (PROMPT_BUDGET, get_single_related_time_prompt,
+                        must_answer_with_coarse_and_fine_memory_prompt)
+
+
+def make_memories(hours, clip_seconds, fine_blocks):
+    coarse_memory = [{"time_period": (float(start), float(start + clip_seconds)),
+                      "general_memory": f"People talk in a room while the camera pans slowly, shot {i}. " * 6}
+                     for i, start in enumerate(range(0, hours * 3600, clip_seconds))]
+    answer_idx = len(coarse_memory) * 2 // 3
+    coarse_memory[answer_idx]["general_memory"] += "A woman opens a red umbrella at the door."
+    entire_fine, divided_fine = [], []
+    for b in range(fine_blocks):
+        start = coarse_memory[b * 7 % len(coarse_memory)]["time_period"][0]
+        entire_fine.append([{"time_period": (start, start + clip_seconds),
+                             "general_memory": f"A detailed description of round {b}. " * 40}])
+        divided_fine.append([{"time_period": (start + s, start + s + 10),
+                              "general_memory": f"Second {s} of round {b}. " * 10}
+                             for s in range(0, clip_seconds, 10)])
+    return coarse_memory, entire_fine, divided_fine, answer_idx
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hours', type=int, default=3)
+    parser.add_argument('--clip_seconds', type=int, default=60)
+    parser.add_argument('--fine_blocks', type=int, nargs='+', default=[0, 4, 8, 16])
+    parser.add_argument('--max_prompt_tokens', type=int, default=32000)
+    parser.add_argument('--prompt_tokenizer_path', type=str, default="")
+    cli = parser.parse_args()
+
+    question = "What color is the umbrella the woman opens?"
+    print(f"{'cap':>6} {'blocks':>6} {'prompt':>12} {'tokens':>7} {'coarse kept':>11} {'answer kept':>11} {'ms':>6}")
+    for cap in (0, cli.max_prompt_tokens):
+        PROMPT_BUDGET.configure(cap, cli.prompt_tokenizer_path)
+        for fine_blocks in cli.fine_blocks:
+            coarse_memory, entire_fine, divided_fine, answer_idx = make_memories(cli.hours, cli.clip_seconds, fine_blocks)
+            builders = {
+                "single_time": lambda: get_single_related_time_prompt(
+                    coarse_memory, entire_fine, divided_fine, question, [], []),
+                "must_answer": lambda: must_answer_with_coarse_and_fine_memory_prompt(
+                    coarse_memory, entire_fine, divided_fine, [], [], question, []),
+            }
+            for name, build in builders.items():
+                start = time.perf_counter()
+                prompt = build()
+                elapsed = (time.perf_counter() - start) * 1000
+                kept = sum(1 for i in range(len(coarse_memory)) if f"\n{i + 1}. Time Period:" in prompt)
+                answer_kept = f"\n{answer_idx + 1}. Time Period:" in prompt
+                print(f"{cap:>6} {fine_blocks:>6} {name:>12} {PROMPT_BUDGET.count(prompt):>7} "
+                      f"{kept:>5}/{len(coarse_memory):<5} {str(answer_kept):>11} {elapsed:>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+How much of each LLM prompt in a ``demo_infer`` run repeats a prompt sent before it.
+
+Runs ``demo_infer`` with the stub VLM and mock LLM of ``period_search_modes.py``, records every
+prompt and reports, per call, the longest prefix it shares with any earlier prompt. Providers and
+local servers with prefix caching only re-process the part after that prefix.
+
+    python benchmarks/prompt_prefix_sharing.py --target_rank 3 --questions 2
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from LLMs import llm_roles
+from frame_decoding import make_synthetic_video
+from mock_openai_server import MockOpenAIServer
+from period_search_modes import StubModel, StubProcessor, make_llm_reply
+
+
+def common_prefix_length(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--target_rank', type=int, default=3)
+    parser.add_argument('--questions', type=int, default=2)
+    parser.add_argument('--minutes', type=int, default=8)
+    cli = parser.parse_args()
+
+    video_path = os.path.join(tempfile.mkdtemp(prefix="prefix_sharing_"), "video.mp4")
+    make_synthetic_video(video_path, cli.minutes * 60, 4, 320, 180)
+    coarse_memory = [{"time_period": (float(start), float(start + 60)),
+                      "general_memory": f"A rough description of minute {start // 60}. " * 20}
+                     for start in range(0, cli.minutes * 60, 60)]
+    periods = [list(mem["time_period"]) for mem in coarse_memory]
+    target_period = periods[len(periods) // 2]
+    ranked = [p for p in periods if p != target_period]
+    ranked.insert(cli.target_rank - 1, target_period)
+
+    prompts = []
+    reply = make_llm_reply(ranked, target_period)
+
+    def recording_reply(request):
+        prompts.append(request["messages"][-1]["content"])
+        return reply(request)
+
+    sys.argv = ["demo"]
+    import demo
+    args = demo.parse_args()
+    args.video_url = video_path
+    args.cache_dir = tempfile.mkdtemp(prefix="prefix_sharing_")
+    args.in_memory_clips = True
+
+    stdout = sys.stdout
+    with MockOpenAIServer(recording_reply) as server:
+        args.api_base_url = server.base_url
+        client = llm_roles.create_llm(args)
+        sys.stdout = open(os.devnull, "w")
+        try:
+            summary = llm_roles.coarse_memory_summarization(coarse_memory, args, client=client)
+            for q in range(cli.questions):
+                demo.demo_infer(StubModel(0.0, 0.0), StubProcessor(), args, f"What happens in scene {q}?", client,
+                                coarse_memory=coarse_memory, coarse_summary=summary)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        client.close()
+
+    total_chars = shared_chars = 0
+    print(f"{'call':>4} {'chars':>7} {'shared prefix':>13} {'ratio':>6}")
+    for i, prompt in enumerate(prompts):
+        shared = max((common_prefix_length(prompt, earlier) for earlier in prompts[:i]), default=0)
+        total_chars += len(prompt)
+        shared_chars += shared
+        print(f"{i:>4} {len(prompt):>7} {shared:>13} {shared / len(prompt):>6.1%}")
+    print(f"{len(prompts)} prompts, shared prefix ratio {shared_chars / total_chars:.1%} "
+          f"({shared_chars} of {total_chars} chars)")
+
+
+if __name__ == "__main__":
+    main()
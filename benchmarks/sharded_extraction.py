@@ -0,0 +1,74 @@
+"""
+Coarse memory extraction split across worker processes.
+
+``video_coarse_memory_extraction`` runs on a synthetic video with ``--coarse_shards`` 1, 2, 4, ...
+Each worker process loads the stub VLM of ``period_search_modes.py`` through ``make_stub_vlm``,
+standing in for one model instance per accelerator or CPU socket. Reported: wall time, speedup
+over one process and whether the merged memory is identical to the single-process one. Each
+worker imports torch and transformers on start-up, which takes seconds of CPU time per process.
+
+    python benchmarks/sharded_extraction.py --minutes 60 --shards 1 2 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from VLMs import vlm_roles
+from frame_decoding import make_synthetic_video
+from period_search_modes import StubModel, StubProcessor
+
+
+def make_stub_vlm(args):
+    # 工作进程中代替 create_vlm 加载模型
+    return StubModel(args.stub_batch_latency, args.stub_clip_latency), StubProcessor()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--minutes', type=int, default=60)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--vlm_batch_latency', type=float, default=0.5)
+    parser.add_argument('--vlm_clip_latency', type=float, default=0.1)
+    cli = parser.parse_args()
+
+    sys.argv = ["demo"]
+    import demo
+    video_path = os.path.join(tempfile.mkdtemp(prefix="sharded_video_"), "video.mp4")
+    make_synthetic_video(video_path, cli.minutes * 60, 2, 320, 180)
+
+    print(f"{'shards':>6} {'seconds':>8} {'speedup':>8} {'identical':>10}")
+    reference = baseline = None
+    for shards in cli.shards:
+        args = demo.parse_args()
+        args.video_url = video_path
+        args.cache_dir = tempfile.mkdtemp(prefix="sharded_extraction_")
+        args.in_memory_clips = True
+        args.coarse_shards = shards
+        args.stub_batch_latency = cli.vlm_batch_latency
+        args.stub_clip_latency = cli.vlm_clip_latency
+        # 分片时主进程不加载模型，与 demo.py 一致
+        model, processor = make_stub_vlm(args) if shards == 1 else (None, None)
+        # 在文件描述符层面屏蔽输出，工作进程继承后同样静默
+        sys.stdout.flush()
+        stdout_fd = os.dup(1)
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        start = time.perf_counter()
+        try:
+            memory = vlm_roles.video_coarse_memory_extraction(model, processor, args, model_factory=make_stub_vlm)
+        finally:
+            sys.stdout.flush()
+            os.dup2(stdout_fd, 1)
+            os.close(devnull)
+            os.close(stdout_fd)
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            reference, baseline = memory, elapsed
+        print(f"{shards:>6} {elapsed:>8.1f} {baseline / elapsed:>8.2f} {str(memory == reference):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Single-prompt vs. hierarchical (map-reduce) summarization of a long coarse memory.
+
+A synthetic coarse memory of ``--hours`` hours is summarized by ``coarse_memory_summarization``
+against a ``MockOpenAIServer`` whose latency grows with the prompt, ``--seconds_per_1k_tokens``
+per thousand prompt tokens. The run is repeated with one prompt (``--summary_chunk_tokens 0``) and
+with parts of ``--chunk_tokens`` tokens, then ``--append_minutes`` of segments are appended and
+the hierarchical summary is rebuilt, reusing the cached part summaries. The LLM response cache is
+bypassed, so every request counted reaches the server.
+
+    python benchmarks/summarization_map_reduce.py --hours 6 --chunk_tokens 16000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from LLMs import llm_roles
+from LLMs.utils import PROMPT_BUDGET
+from mock_openai_server import MockOpenAIServer
+
+
+def make_coarse_memory(minutes, clip_seconds):
+    return [{"time_period": (float(start), float(start + clip_seconds)),
+             "general_memory": f"The host walks through a street market and tastes dish number {i}, "
+                               f"talking with the vendor about its history. " * 4}
+            for i, start in enumerate(range(0, minutes * 60, clip_seconds))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hours', type=int, default=6)
+    parser.add_argument('--clip_seconds', type=int, default=60)
+    parser.add_argument('--chunk_tokens', type=int, default=16000)
+    parser.add_argument('--append_minutes', type=int, default=30)
+    parser.add_argument('--seconds_per_1k_tokens', type=float, default=0.05)
+    cli = parser.parse_args()
+
+    largest = [0]
+
+    def reply(request):
+        tokens = PROMPT_BUDGET.count(request["messages"][0]["content"])
+        largest[0] = max(largest[0], tokens)
+        # 模拟预填充耗时随提示长度增长
+        time.sleep(tokens / 1000 * cli.seconds_per_1k_tokens)
+        return "A summary of the video part, covering its people, places and events in order. " * 8
+
+    sys.argv = ["demo"]
+    import demo
+    cache_dir = tempfile.mkdtemp(prefix="summarization_")
+    full = make_coarse_memory(cli.hours * 60 + cli.append_minutes, cli.clip_seconds)
+    base = full[:cli.hours * 60 * 60 // cli.clip_seconds]
+    print(f"{len(base)} coarse entries, single summary prompt "
+          f"{PROMPT_BUDGET.count(llm_roles.get_summary_prompt(base))} tokens")
+    print(f"{'run':>18} {'seconds':>8} {'requests':>9} {'largest prompt':>15}")
+    with MockOpenAIServer(reply) as server:
+        for name, coarse_memory, chunk_tokens in (("single prompt", base, 0),
+                                                  ("map-reduce", base, cli.chunk_tokens),
+                                                  ("map-reduce append", full, cli.chunk_tokens)):
+            args = demo.parse_args()
+            args.cache_dir = cache_dir
+            args.video_url = os.path.join(cache_dir, "video.mp4")
+            args.api_base_url = server.base_url
+            args.llm_cache_bypass = True
+            args.summary_chunk_tokens = chunk_tokens
+            args.max_prompt_tokens = 0
+            server.reset_stats()
+            largest[0] = 0
+            stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+            client = llm_roles.create_llm(args)
+            start = time.perf_counter()
+            try:
+                summary = llm_roles.coarse_memory_summarization(coarse_memory, args, client=client)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            elapsed = time.perf_counter() - start
+            client.close()
+            # 输出格式与单次摘要相同：只含一段文本的列表
+            assert isinstance(summary, list) and len(summary) == 1 and isinstance(summary[0], str)
+            json.dumps(summary)
+            print(f"{name:>18} {elapsed:>8.1f} {server.requests:>9} {largest[0]:>15}")
+
+
+if __name__ == "__main__":
+    main()
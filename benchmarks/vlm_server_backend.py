@@ -0,0 +1,68 @@
+"""
+Throughput of clip captioning through the OpenAI-compatible server backend (``--vllm``).
+
+Starts a local ``MockOpenAIServer`` that answers every request after a fixed latency,
+as a continuously batching server does while it has free capacity, and captions synthetic clips
+through ``VLMs.vlm_roles.run_clip_batches`` at several client concurrencies.
+
+    python benchmarks/vlm_server_backend.py --clips 64 --latency 0.5 --concurrency 1 4 16
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from VLMs.backends import OpenAIServerBackend
+from VLMs.utils import batched
+from VLMs.vlm_roles import run_clip_batches
+from mock_openai_server import MockOpenAIServer
+
+
+def describe_clip(request):
+    video_url = request["messages"][-1]["content"][1]["video_url"]["url"]
+    assert video_url.startswith("data:video/jpeg;base64,")
+    return f"A clip of {len(video_url.split(',')) - 1} frames."
+
+
+def synthetic_clips(num_clips, clip_frames, height, width):
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 255, (clip_frames, height, width, 3), dtype=np.uint8)
+    for k in range(num_clips):
+        yield frames, (float(k * clip_frames), float((k + 1) * clip_frames))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clips', type=int, default=64)
+    parser.add_argument('--clip_frames', type=int, default=20)
+    parser.add_argument('--height', type=int, default=252)
+    parser.add_argument('--width', type=int, default=448)
+    parser.add_argument('--latency', type=float, default=0.5, help="seconds the mock server takes per request")
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    cli = parser.parse_args()
+
+    server = MockOpenAIServer(describe_clip, latency=cli.latency).start()
+
+    args = argparse.Namespace(cache_dir=None, temp_video_dir=None, in_memory_clips=True,
+                              infer_batch_size=cli.batch_size, prefetch_batches=2, preprocess_workers=2)
+    for concurrency in cli.concurrency:
+        backend = OpenAIServerBackend(server.base_url, "mock", max_concurrency=concurrency)
+        server.reset_stats()
+        clip_batches = batched(synthetic_clips(cli.clips, cli.clip_frames, cli.height, cli.width), cli.batch_size)
+        start = time.perf_counter()
+        outputs = [text for _, texts in run_clip_batches(backend, clip_batches, "Describe the clip.",
+                                                          cli.height * cli.width, 1.0, args) for text in texts]
+        elapsed = time.perf_counter() - start
+        backend.close()
+        assert len(outputs) == cli.clips
+        print(f"concurrency {concurrency:3d}: {cli.clips / elapsed:7.2f} clips/s, "
+              f"{server.requests} requests, peak {server.peak} concurrent")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
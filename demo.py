@@ -1,11 +1,18 @@
 import torch
 import argparse
+import copy
 import os
+import threading
+import time
 from datetime import datetime
 
 from VLMs import vlm_roles
+from VLMs.backends import get_vlm_backend
+from VLMs.coalescer import CoalescingBackend
 from LLMs import llm_roles
+from LLMs.client import LLMCallError
 from utils import *
+from memory_index import load_coarse_memory_index
 
 torch.manual_seed(1037)
 
@@ -20,6 +27,11 @@ def parse_args():
 
     # Video and memory extraction settings
     parser.add_argument('--video_url', type=str, default="")
+    parser.add_argument('--follow', type=str2bool, default=False,
+                        help="follow a video file that is still being written and extract coarse memory window by window")
+    parser.add_argument('--follow_poll_seconds', type=float, default=5.0)
+    parser.add_argument('--follow_idle_seconds', type=float, default=60.0,
+                        help="stop following once the file has not grown for this long")
     parser.add_argument('--coarse_memory_extract_prompt', type=str,
                         default="Please observe and understand the given video carefully. "
                                 "Describe all the details of this video as comprehensively as possible "
@@ -42,24 +54,111 @@ def parse_args():
     parser.add_argument('--fine_sampling_fps', type=float, default=2.0)
     parser.add_argument('--minimal_duration', type=int, default=10)
     parser.add_argument('--fine_overlapping_frames', type=int, default=0)
+    parser.add_argument('--period_search', type=str, default="iterative",
+                        help="choose from [iterative, top_k]: search fine memory one period per round, or all top-k candidates at once")
+    parser.add_argument('--top_k_periods', type=int, default=3)
+    parser.add_argument('--retrieval_top_k', type=int, default=0,
+                        help="show the period searches only this many coarse entries retrieved for the question, 0 shows all")
+    parser.add_argument('--retrieval_embedding_model', type=str, default="",
+                        help="sentence-transformers model fused with BM25 for the retrieval, BM25 only if empty")
 
     # Model and API settings
-    parser.add_argument('--vllm', type=bool, default=False)
+    parser.add_argument('--vllm', type=str2bool, default=False,
+                        help="caption clips through an OpenAI-compatible server (e.g. vLLM) instead of loading the VLM")
+    parser.add_argument('--vllm_base_url', type=str, default="http://localhost:8000/v1")
+    parser.add_argument('--vllm_model', type=str, default=None, help="served model name, defaults to --vlm_model_path")
+    parser.add_argument('--vllm_api_key', type=str, default="EMPTY")
+    parser.add_argument('--vllm_max_concurrency', type=int, default=16)
     parser.add_argument('--api_call', type=bool, default=True)
     parser.add_argument('--api_key', type=str, default="xxxx", help="you should input your api key")
     parser.add_argument('--api_model', type=str, default="deepseek-v3-1-terminus")
+    parser.add_argument('--api_base_url', type=str, default="https://ark.cn-beijing.volces.com/api/v3",
+                        help="any OpenAI-compatible chat completions endpoint")
+    parser.add_argument('--llm_max_concurrency', type=int, default=8)
     parser.add_argument('--thinking', type=str, default="disabled", help="choose from [disabled, enabled]")
+    parser.add_argument('--llm_max_retries', type=int, default=4,
+                        help="retries of LLM calls failing with timeouts, rate limits, server errors or unparsable replies")
+    parser.add_argument('--llm_deadline', type=float, default=1800,
+                        help="seconds an LLM call may take including its retries")
+    parser.add_argument('--llm_phase_deadlines', type=str, default="",
+                        help='per-phase overrides of --llm_deadline as JSON, e.g. {"time_search": 300, "summary": 3600}')
+    parser.add_argument('--llm_hedge', type=str2bool, default=False,
+                        help="send a duplicate LLM request once a call exceeds the p95 latency of its phase")
+    parser.add_argument('--llm_rpm', type=float, default=0,
+                        help="client-side limit of LLM requests per minute shared by all questions, 0 for none")
+    parser.add_argument('--llm_tpm', type=float, default=0,
+                        help="client-side limit of LLM tokens (prompt + completion) per minute, 0 for none")
+    parser.add_argument('--llm_cache_bypass', type=str2bool, default=False,
+                        help="neither read nor write the LLM response cache, e.g. for sampled or timing runs")
+    parser.add_argument('--llm_cache_max_bytes', type=int, default=256 * 1024 * 1024,
+                        help="size of cached LLM replies above which least recently used ones are evicted, 0 for no limit")
+    parser.add_argument('--llm_cache_ttl', type=float, default=0,
+                        help="seconds after which cached LLM replies expire, 0 for never")
+    parser.add_argument('--max_prompt_tokens', type=int, default=100000,
+                        help="token cap of LLM prompts, low-value memories are dropped above it; 0 disables it")
+    parser.add_argument('--prompt_tokenizer_path', type=str, default="",
+                        help="local tokenizer for counting prompt tokens, estimated from characters if empty")
+    parser.add_argument('--summary_chunk_tokens', type=int, default=32000,
+                        help="summarize longer coarse memories in parts of at most this many tokens, then merge them; 0 always uses one prompt")
 
     # Directory settings
     parser.add_argument('--cache_dir', type=str, default='demo_cache')
     parser.add_argument('--fine_memory_dir', type=str, default='fine_memory')
     parser.add_argument('--temp_video_dir', type=str, default='temp_videos')
     parser.add_argument('--infer_batch_size', type=int, default=10)
+    parser.add_argument('--batch_token_budget', type=int, default=0,
+                        help="pack clips into batches of at most this many padded tokens (0: fixed --infer_batch_size batches)")
+    parser.add_argument('--prefetch_batches', type=int, default=2,
+                        help="batches decoded and preprocessed ahead of the one being generated")
+    parser.add_argument('--preprocess_workers', type=int, default=1)
+    parser.add_argument('--coarse_cache_max_bytes', type=int, default=0,
+                        help="size limit of the coarse memory cache directory, 0 for unlimited")
+    parser.add_argument('--fine_memory_store_max_bytes', type=int, default=256 * 1024 * 1024,
+                        help="size of stored fine memory clips above which least recently used ones are evicted, 0 for no limit")
+    parser.add_argument('--coarse_shards', type=int, default=1,
+                        help="split coarse extraction into this many contiguous shards run by worker processes with their own models")
+    parser.add_argument('--coarse_shard_devices', type=str, default="",
+                        help="comma-separated CUDA devices assigned to the shards in turn, e.g. 0,1,2,3; empty assigns the visible devices in turn, or runs on the CPU without CUDA")
+    parser.add_argument('--ignore_legacy_coarse_memory', type=str2bool, default=False,
+                        help="ignore coarse memories cached under the old path-derived names")
+    parser.add_argument('--in_memory_clips', type=str2bool, default=False,
+                        help="pass sampled frames straight to the processor instead of writing temp MP4 clips")
+    parser.add_argument('--frame_cache_bytes', type=int, default=1024 * 1024 * 1024,
+                        help="byte budget of the decoded-frame LRU cache shared by fine memory extractions")
+
+    # Batch mode settings (batch_infer.py)
+    parser.add_argument('--questions_jsonl', type=str, default="",
+                        help="JSONL of {\"video\", \"question\", \"options\"} records")
+    parser.add_argument('--output_jsonl', type=str, default="batch_answers.jsonl")
+    parser.add_argument('--concurrent_questions', type=int, default=4)
+    parser.add_argument('--coalesce_wait', type=float, default=0.05,
+                        help="seconds the VLM waits for clips from other questions before running a batch")
+
+    # Job queue settings (queue_infer.py)
+    parser.add_argument('--queue_db', type=str, default="",
+                        help="SQLite job queue shared by queue_infer.py processes, <cache_dir>/job_queue.sqlite if empty")
+    parser.add_argument('--queue_stages', type=str, default="download,coarse,summary,qa",
+                        help="stages this process works on")
+    parser.add_argument('--download_workers', type=int, default=4)
+    parser.add_argument('--coarse_workers', type=int, default=1)
+    parser.add_argument('--summary_workers', type=int, default=4)
+    parser.add_argument('--qa_workers', type=int, default=4)
+    parser.add_argument('--download_ahead', type=int, default=4,
+                        help="downloaded videos allowed to wait for coarse extraction before downloads pause")
+    parser.add_argument('--lease_seconds', type=float, default=600,
+                        help="jobs of a worker that stops renewing its lease for this long are handed out again")
+    parser.add_argument('--job_max_attempts', type=int, default=3)
+    parser.add_argument('--job_retry_backoff', type=float, default=30,
+                        help="seconds before the first retry of a failed job, doubled for each further one")
+    parser.add_argument('--retry_failed_jobs', type=str2bool, default=False,
+                        help="give jobs that failed for good a fresh set of attempts")
+    parser.add_argument('--queue_poll_seconds', type=float, default=1.0)
+    parser.add_argument('--report_seconds', type=float, default=30)
 
     return parser.parse_args()
 
 
-def demo_infer(vlm_model, vlm_processor, args, question, client):
+def demo_infer(vlm_model, vlm_processor, args, question, client, options=None, coarse_memory=None, coarse_summary=None):
     """
     Main inference function for video question answering.
 
@@ -69,24 +168,37 @@ def demo_infer(vlm_model, vlm_processor, args, question, client):
         args: Command line arguments
         question (str): Question to answer
         client: API client (if using API)
+        options (list): Answer options, empty for open-ended questions
+        coarse_memory (list): Coarse memory of the video, extracted if not given
+        coarse_summary (list): Summary of the coarse memory, generated if not given
 
     Returns:
         str: Answer to the question
     """
     print(f"Current Time: {datetime.now()}")
     print(f"Video: {args.video_url}")
+    options = options or []
 
     # Phase 1: Coarse memory extraction and summarization
-    coarse_memory = vlm_roles.video_coarse_memory_extraction(vlm_model, vlm_processor, args)
-    coarse_summary = llm_roles.coarse_memory_summarization(coarse_memory, args, client=client)
+    if coarse_memory is None and args.follow:
+        # 跟随模式下使用截至最近一个完整窗口的记忆
+        coarse_memory = vlm_roles.load_followed_coarse_memory(args)
+        if not coarse_memory:
+            print("No Closed Video Segment Yet")
+            return None
+    if coarse_memory is None:
+        coarse_memory = vlm_roles.video_coarse_memory_extraction(vlm_model, vlm_processor, args)
+    if coarse_summary is None:
+        coarse_summary = llm_roles.coarse_memory_summarization(coarse_memory, args, client=client)
 
     print("Video Summary:")
     print(coarse_summary)
+    print(f"Video Context Prefix: {llm_roles.video_context_hash(coarse_memory)}")
     print("-" * 20)
     print(f"Question: {question}")
 
     # Phase 2: Answer with coarse memory
-    coarse_answer = llm_roles.video_question_answer_with_coarse_memory(coarse_memory, question=question, options=[],args=args, client=client)
+    coarse_answer = llm_roles.video_question_answer_with_coarse_memory(coarse_memory, question=question, options=options,args=args, client=client)
 
     coarse_answer_dict = parse_answer(coarse_answer)
     if coarse_answer_dict is None:
@@ -100,13 +212,21 @@ def demo_infer(vlm_model, vlm_processor, args, question, client):
 
     # Determine if time-based filtering is needed
     time_flag = not contains_ordinal_number(question)
-    video_duration = coarse_memory[-1]['time_period'][1] - coarse_memory[0]['time_period'][0]
+
+    # 先用检索索引找出与问题最相关的粗粒度记忆，时间段搜索只在这些候选中进行
+    candidates = None
+    if args.retrieval_top_k > 0:
+        memory_index = load_coarse_memory_index(coarse_memory, args)
+        candidates = memory_index.search(" ".join([question] + options), args.retrieval_top_k)
+        print(f"Retrieved Time Periods: {[coarse_memory[i]['time_period'] for i in sorted(candidates)]}")
 
     print(f"Time-based filtering: {time_flag}")
 
     if time_flag:
         # Get relevant time periods for filtering
-        question_type_answer = llm_roles.video_question_type_judge_with_coarse_memory(coarse_memory, question, options=[],args=args, client=client)
+        question_type_answer = llm_roles.video_question_type_judge_with_coarse_memory(
+            coarse_memory, question, options=options, args=args, client=client, candidates=candidates
+        )
 
         question_type_dict = parse_answer(question_type_answer)
         if question_type_dict is None:
@@ -118,13 +238,23 @@ def demo_infer(vlm_model, vlm_processor, args, question, client):
                 coarse_memory, related_periods,
                 overlap=args.coarse_overlapping_frames / args.sampling_fps
             )
+            # 完整粗粒度记忆作为共享前缀，相关时间段只作为提示附在后面
+            focus_periods = [mem['time_period'] for mem in filtered_coarse_memory]
+            if candidates is not None:
+                focus_set = {tuple(period) for period in focus_periods}
+                candidates = sorted(set(candidates) | {i for i, mem in enumerate(coarse_memory)
+                                                       if tuple(mem['time_period']) in focus_set})
             max_iterations = 5
         else:
             max_iterations = 5
-            filtered_coarse_memory = coarse_memory
+            focus_periods = None
     else:
         max_iterations = 5
-        filtered_coarse_memory = coarse_memory
+        focus_periods = None
+
+    if args.period_search == "top_k":
+        return answer_with_top_k_periods(vlm_model, vlm_processor, args, question, options, client,
+                                         coarse_memory, focus_periods, candidates)
 
     # Initialize memory storage
     fine_memory_history = {
@@ -144,14 +274,20 @@ def demo_infer(vlm_model, vlm_processor, args, question, client):
         print(f"Remaining iterations: {max_iterations - iteration}")
 
         # Find next relevant time period
-        time_search_answer = llm_roles.video_question_get_single_related_time_with_coarse_memory(
-            filtered_coarse_memory,
-            fine_memory_history['entire_memories'], fine_memory_history['divided_memories'],
-            question, options=[],
-            excluded_time_periods=(fine_memory_history['time_periods'] +
-                                   super_fine_memory_history['time_periods']),
-            args=args, client=client, duration=video_duration
-        )
+        try:
+            time_search_answer = llm_roles.video_question_get_single_related_time_with_coarse_memory(
+                coarse_memory,
+                fine_memory_history['entire_memories'], fine_memory_history['divided_memories'],
+                question, options=options,
+                excluded_time_periods=(fine_memory_history['time_periods'] +
+                                       super_fine_memory_history['time_periods']),
+                args=args, client=client, focus_periods=focus_periods,
+                candidates=candidates
+            )
+        except LLMCallError as e:
+            # 搜索失败时不丢弃已提取的细粒度记忆，直接进入最终回答
+            print(f"Time search failed, answering with the memories gathered so far: {e}")
+            break
 
         time_search_dict = parse_answer(time_search_answer)
         if time_search_dict is None:
@@ -216,12 +352,16 @@ def demo_infer(vlm_model, vlm_processor, args, question, client):
             memory_history['divided_memories'].append(divided_memory)
 
         # Answer with fine memory
-        fine_answer = llm_roles.video_question_answer_with_coarse_and_fine_memory(
-            filtered_coarse_memory,
-            fine_memory_history['entire_memories'], fine_memory_history['divided_memories'],
-            super_fine_memory_history['entire_memories'], super_fine_memory_history['divided_memories'],
-            question=question, options=[], args=args, client=client, duration=video_duration
-        )
+        try:
+            fine_answer = llm_roles.video_question_answer_with_coarse_and_fine_memory(
+                coarse_memory,
+                fine_memory_history['entire_memories'], fine_memory_history['divided_memories'],
+                super_fine_memory_history['entire_memories'], super_fine_memory_history['divided_memories'],
+                question=question, options=options, args=args, client=client, focus_periods=focus_periods
+            )
+        except LLMCallError as e:
+            print(f"Answering with fine memory failed, moving on to the final answer: {e}")
+            break
 
         fine_answer_dict = parse_answer(fine_answer)
         if fine_answer_dict is None:
@@ -238,7 +378,100 @@ def demo_infer(vlm_model, vlm_processor, args, question, client):
         coarse_memory,
         fine_memory_history['entire_memories'], fine_memory_history['divided_memories'],
         super_fine_memory_history['entire_memories'], super_fine_memory_history['divided_memories'],
-        question=question, options=[], args=args, client=client, duration=video_duration
+        question=question, options=options, args=args, client=client
+    )
+
+    final_answer_dict = parse_answer(final_answer)
+    if final_answer_dict is None:
+        return None
+
+    print("="*30)
+    print(f"Question: {question}")
+    print(f"Answer: {final_answer_dict['Answer']}")
+    return final_answer_dict['Answer']
+
+
+def answer_with_top_k_periods(vlm_model, vlm_processor, args, question, options, client,
+                              coarse_memory, focus_periods, candidates=None):
+    """
+    Single-round alternative to the iterative fine-grained memory search of ``demo_infer``.
+
+    Asks the LLM once for the ``args.top_k_periods`` most relevant time periods, extracts the fine
+    memory of all of them in batched VLM runs and answers once with everything gathered. This
+    trades extra VLM work on candidates the loop might never visit for fewer LLM round trips.
+
+    Returns:
+        str: Answer to the question
+    """
+    # Phase 3: Ranked candidate periods in one LLM call
+    time_search_answer = llm_roles.video_question_get_top_k_related_times_with_coarse_memory(
+        coarse_memory, question, options=options, top_k=args.top_k_periods,
+        args=args, client=client, focus_periods=focus_periods,
+        candidates=candidates
+    )
+
+    time_search_dict = parse_answer(time_search_answer)
+    if time_search_dict is None:
+        return None
+
+    candidate_periods = []
+    # 模型可能只返回一个 (start, end)，或混入格式不对的条目
+    for period in normalize_time_periods(time_search_dict['Time Periods']):
+        if period not in candidate_periods:
+            candidate_periods.append(period)
+    candidate_periods = candidate_periods[:args.top_k_periods]
+    print(f"Candidate time periods: {candidate_periods}")
+
+    args.fine_memory_extract_prompt = (
+            "You should explicitly and in detail describe any visible subtitles, "
+            "text overlays, or voice-overs in the video. In addition: " +
+            time_search_dict['Instruction']
+    )
+
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    save_name = f'demo_{timestamp}'
+
+    fine_memory_history = {'time_periods': [], 'entire_memories': [], 'divided_memories': []}
+    super_fine_memory_history = {'time_periods': [], 'entire_memories': [], 'divided_memories': []}
+
+    # Extract fine memory of all candidates, one batched run per granularity
+    for is_super_fine in (False, True):
+        periods = [period for period in candidate_periods
+                   if (period[1] - period[0] == args.minimal_duration) == is_super_fine]
+        if not periods:
+            continue
+
+        if not is_super_fine:
+            args.fine_sampling_fps = args.sampling_fps
+            args.fine_short_video_frames = args.short_video_frames
+        else:
+            args.fine_sampling_fps = 2
+            args.fine_short_video_frames = 2 * args.minimal_duration
+        entire_memories = vlm_roles.video_multi_period_fine_memory_extraction(
+            vlm_model, vlm_processor, periods, save_name, args, split="entire"
+        )
+
+        if not is_super_fine:
+            args.fine_sampling_fps = 2
+            args.fine_short_video_frames = 2 * args.minimal_duration
+        else:
+            args.fine_sampling_fps = 2
+            args.fine_short_video_frames = 2
+        divided_memories = vlm_roles.video_multi_period_fine_memory_extraction(
+            vlm_model, vlm_processor, periods, save_name, args, split="divided"
+        )
+
+        memory_history = super_fine_memory_history if is_super_fine else fine_memory_history
+        memory_history['time_periods'].extend(periods)
+        memory_history['entire_memories'].extend(entire_memories)
+        memory_history['divided_memories'].extend(divided_memories)
+
+    # Phase 4: Answer once with all candidate memories
+    final_answer = llm_roles.video_question_must_answer_with_coarse_and_fine_memory(
+        coarse_memory,
+        fine_memory_history['entire_memories'], fine_memory_history['divided_memories'],
+        super_fine_memory_history['entire_memories'], super_fine_memory_history['divided_memories'],
+        question=question, options=options, args=args, client=client
     )
 
     final_answer_dict = parse_answer(final_answer)
@@ -258,7 +491,6 @@ if __name__ == "__main__":
 
     # Initialize
     args = parse_args()
-    vlm_model, vlm_processor = vlm_roles.create_vlm(args)
     client = llm_roles.create_llm(args)
 
     # Setup directories with timestamp
@@ -285,6 +517,28 @@ if __name__ == "__main__":
             not (args.video_url.startswith('http://') or args.video_url.startswith('https://'))):
         raise ValueError(f"Video {args.video_url} does not exist.")
 
+    if args.coarse_shards > 1 and not args.follow:
+        # 分片进程各自加载模型；主进程等粗粒度提取结束、分片进程退出后再加载，避免多占一份显存
+        vlm_roles.video_coarse_memory_extraction(None, None, args)
+    vlm_model, vlm_processor = vlm_roles.create_vlm(args)
+
     # Run inference
+    if args.follow:
+        # 后台持续提取正在录制的视频，提问时使用已写入日志的记忆；两者共用一个合并批次的 VLM 后端
+        vlm_model = CoalescingBackend(get_vlm_backend(vlm_model, vlm_processor),
+                                      batch_size=args.infer_batch_size, max_wait=args.coalesce_wait)
+        vlm_processor = None
+        # 后台线程与前台问答同时切分视频，各用一个临时目录，避免同名片段互相覆盖
+        follow_args = copy.copy(args)
+        follow_args.temp_video_dir = f"{args.temp_video_dir}_follow"
+        follower = threading.Thread(target=vlm_roles.video_coarse_memory_follow,
+                                    args=(vlm_model, vlm_processor, follow_args), daemon=True)
+        follower.start()
+        while follower.is_alive() and not vlm_roles.load_followed_coarse_memory(args):
+            time.sleep(args.follow_poll_seconds)
     answer = demo_infer(vlm_model, vlm_processor, args, question, client=client)
-    print("=" * 30)
\ No newline at end of file
+    if args.follow:
+        follower.join()
+    print("=" * 30)
+    print(f"LLM Response Cache: {client.cache_stats()}")
+    print(f"LLM Calls: {client.call_stats()}")
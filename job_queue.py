@@ -0,0 +1,204 @@
+import json
+import time
+
+from memory_cache import connect_sqlite
+
+# 任务状态
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    """
+    Persistent SQLite queue of pipeline jobs, each belonging to a stage (e.g. "download", "coarse").
+
+    A worker leases a job for ``lease_seconds`` and must complete, fail or renew it before the lease
+    expires; an expired lease, e.g. because the process died, counts as a failed attempt. A job
+    is identified by its stage and key, so adding the same jobs again (re-running a manifest) is a
+    no-op for jobs already known. Failed attempts are retried after an exponential backoff until
+    ``max_attempts`` is reached. Like ``FineMemoryStore``, the queue can be shared by several
+    processes, e.g. one per machine or one per stage.
+    """
+
+    def __init__(self, db_path, max_attempts: int = 3, backoff_base: float = 10.0):
+        """
+        Args:
+            db_path (str): SQLite file
+            max_attempts (int): Attempts after which a failing job is marked as failed for good
+            backoff_base (float): Seconds before the first retry, doubled with every further attempt
+        """
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, stage TEXT, key TEXT, payload TEXT, status TEXT, "
+                "attempts INTEGER DEFAULT 0, not_before REAL DEFAULT 0, lease_until REAL DEFAULT 0, worker TEXT, "
+                "result TEXT, error TEXT, created REAL, started REAL, finished REAL, UNIQUE (stage, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS job_stage_status ON job (stage, status)")
+
+    def _connect(self):
+        # 自动提交模式，写事务由 BEGIN IMMEDIATE / COMMIT 显式控制；出错时未提交的事务会回滚
+        return connect_sqlite(self.db_path, isolation_level=None)
+
+    @staticmethod
+    def _insert(conn, jobs, now):
+        conn.executemany(
+            "INSERT OR IGNORE INTO job (stage, key, payload, status, created) VALUES (?, ?, ?, ?, ?)",
+            [(stage, key, json.dumps(payload, ensure_ascii=False), PENDING, now) for stage, key, payload in jobs],
+        )
+
+    def add(self, jobs):
+        """
+        Enqueue jobs that are not known yet.
+
+        Args:
+            jobs (list): (stage, key, payload) tuples with JSON-serializable payloads
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._insert(conn, jobs, time.time())
+            conn.execute("COMMIT")
+
+    def _retry_or_fail(self, conn, job_id, attempts, error, now):
+        """Schedule a retry after the backoff, or mark the job as failed once it is out of attempts."""
+        if attempts >= self.max_attempts:
+            conn.execute("UPDATE job SET status = ?, error = ?, finished = ? WHERE id = ?",
+                         (FAILED, error, now, job_id))
+            return True
+        conn.execute("UPDATE job SET status = ?, error = ?, not_before = ? WHERE id = ?",
+                     (PENDING, error, now + self.backoff_base * 2 ** (attempts - 1), job_id))
+        return False
+
+    def lease(self, stage, worker, lease_seconds: float, on_failed=None):
+        """
+        Take the oldest pending job of a stage that is past its backoff.
+
+        Running jobs whose lease expired, e.g. because their process died, first count as a failed
+        attempt: they are retried after the same backoff as ``fail`` or, out of attempts, marked as
+        failed, so a job that keeps killing its worker is not handed out forever.
+
+        Args:
+            on_failed: Called as ``on_failed(job, error)`` for each job that expired on its last attempt
+
+        Returns:
+            dict: The job ("id", "key", "payload", "attempts"), or None if there is none
+        """
+        now = time.time()
+        with self._connect() as conn:
+            # BEGIN IMMEDIATE 取得写锁，保证同一任务不会被两个进程同时领取
+            conn.execute("BEGIN IMMEDIATE")
+            failed = []
+            for job_id, key, payload, attempts, lost_worker in conn.execute(
+                    "SELECT id, key, payload, attempts, worker FROM job WHERE stage = ? AND status = ? AND lease_until < ?",
+                    (stage, RUNNING, now)).fetchall():
+                error = f"Lease of {lost_worker} expired"
+                if self._retry_or_fail(conn, job_id, attempts, error, now):
+                    failed.append(({"id": job_id, "key": key, "payload": json.loads(payload), "attempts": attempts},
+                                   error))
+            row = conn.execute(
+                "SELECT id, key, payload, attempts FROM job WHERE stage = ? AND status = ? AND not_before <= ? "
+                "ORDER BY id LIMIT 1",
+                (stage, PENDING, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE job SET status = ?, attempts = attempts + 1, lease_until = ?, worker = ?, "
+                    "started = COALESCE(started, ?) WHERE id = ?",
+                    (RUNNING, now + lease_seconds, worker, now, row[0]),
+                )
+            conn.execute("COMMIT")
+        if on_failed is not None:
+            for job, error in failed:
+                on_failed(job, error)
+        if row is None:
+            return None
+        return {"id": row[0], "key": row[1], "payload": json.loads(row[2]), "attempts": row[3] + 1}
+
+    def renew(self, job_ids, worker, lease_seconds: float):
+        """Extend the leases a worker still holds."""
+        with self._connect() as conn:
+            conn.executemany("UPDATE job SET lease_until = ? WHERE id = ? AND worker = ? AND status = ?",
+                             [(time.time() + lease_seconds, job_id, worker, RUNNING) for job_id in job_ids])
+
+    def complete(self, job_id, worker, result=None, next_jobs=(), on_done=None):
+        """
+        Mark a job as done and enqueue the jobs of the next stages in the same transaction.
+
+        ``on_done()`` runs inside that transaction once the job is marked done, so its side effect
+        (e.g. writing the answer) happens only for the attempt that completes the job; if it raises,
+        nothing is committed and the job is retried once its lease expires.
+
+        Returns:
+            bool: False if the lease had been lost to another worker, whose result then counts
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            updated = conn.execute(
+                "UPDATE job SET status = ?, result = ?, error = NULL, finished = ? WHERE id = ? AND worker = ? AND status = ?",
+                (DONE, json.dumps(result, ensure_ascii=False), now, job_id, worker, RUNNING),
+            ).rowcount
+            if updated:
+                self._insert(conn, next_jobs, now)
+                if on_done is not None:
+                    on_done()
+            conn.execute("COMMIT")
+        return bool(updated)
+
+    def fail(self, job_id, worker, error: str):
+        """
+        Record a failed attempt; the job is retried after a backoff or, out of attempts, marked as failed.
+
+        Returns:
+            bool: True if the job is now failed for good
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT attempts FROM job WHERE id = ? AND worker = ? AND status = ?",
+                               (job_id, worker, RUNNING)).fetchone()
+            failed = row is not None and self._retry_or_fail(conn, job_id, row[0], error, now)
+            conn.execute("COMMIT")
+        return failed
+
+    def retry_failed(self, stage=None):
+        """Give jobs that failed for good a fresh set of attempts."""
+        with self._connect() as conn:
+            query = "UPDATE job SET status = ?, attempts = 0, not_before = 0 WHERE status = ?"
+            params = (PENDING, FAILED)
+            if stage is not None:
+                query += " AND stage = ?"
+                params += (stage,)
+            return conn.execute(query, params).rowcount
+
+    def count(self, stage, status):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM job WHERE stage = ? AND status = ?", (stage, status)).fetchone()[0]
+
+    def unfinished(self):
+        """Number of jobs still pending or running, in any stage."""
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM job WHERE status IN (?, ?)", (PENDING, RUNNING)).fetchone()[0]
+
+    def progress(self, since: float = 0):
+        """
+        Per-stage job counts by status, plus the jobs finished since ``since`` and their average duration.
+
+        Returns:
+            dict: stage -> {"pending", "running", "done", "failed", "done_since", "avg_seconds"}
+        """
+        report = {}
+        with self._connect() as conn:
+            for stage, status, count in conn.execute("SELECT stage, status, COUNT(*) FROM job GROUP BY stage, status"):
+                report.setdefault(stage, {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0})[status] = count
+            for stage, count, avg_seconds in conn.execute(
+                    "SELECT stage, COUNT(*), AVG(finished - started) FROM job WHERE status = ? AND finished >= ? "
+                    "GROUP BY stage", (DONE, since)):
+                report[stage]["done_since"] = count
+                report[stage]["avg_seconds"] = avg_seconds
+        return report
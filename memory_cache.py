@@ -0,0 +1,372 @@
+import fcntl
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+def make_cache_key(*parts):
+    """
+    Build a stable cache key from JSON-serializable parts.
+
+    Args:
+        *parts: Values identifying the cached content, e.g. a video fingerprint and the extraction parameters
+
+    Returns:
+        str: Hex SHA-256 digest of the canonical JSON encoding of the parts
+    """
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def atomic_write_json(path, data):
+    """Write JSON to a temporary file and rename it into place so readers never see a partial file."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class MemoryCache:
+    """
+    Content-addressed store of JSON memories with a manifest and size-based LRU eviction.
+
+    Entries live in ``cache_dir/<key>.json`` and are described in ``cache_dir/manifest.json``
+    (size, creation and last access time, free-form metadata). Manifest updates take an exclusive
+    file lock and entries are written atomically, so one cache directory can be shared by several
+    processes or machines on a shared filesystem.
+    """
+
+    def __init__(self, cache_dir, max_bytes: int = 0):
+        """
+        Args:
+            cache_dir (str): Directory holding the entries and the manifest
+            max_bytes (int): Total size above which least recently used entries are evicted, 0 for no limit
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key, suffix: str = '.json'):
+        return os.path.join(self.cache_dir, key + suffix)
+
+    @contextmanager
+    def _manifest(self):
+        with open(self.manifest_path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                manifest = {}
+                if os.path.exists(self.manifest_path):
+                    with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                        manifest = json.load(f)
+                yield manifest
+                atomic_write_json(self.manifest_path, manifest)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, key, suffix: str = '.json'):
+        """Return the cached entry for ``key`` or None, marking it as recently used."""
+        path = self.path(key, suffix)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        with self._manifest() as manifest:
+            if key in manifest:
+                manifest[key]['last_access'] = time.time()
+        return data
+
+    def put(self, key, data, meta: dict = None, suffix: str = '.json'):
+        """Store ``data`` under ``key``, record it in the manifest and evict entries over the size budget."""
+        path = self.path(key, suffix)
+        atomic_write_json(path, data)
+        now = time.time()
+        with self._manifest() as manifest:
+            manifest[key] = {
+                "file": os.path.basename(path),
+                "bytes": os.path.getsize(path),
+                "created": manifest.get(key, {}).get("created", now),
+                "last_access": now,
+                "meta": meta or {},
+            }
+            self._evict(manifest, keep=key)
+        return path
+
+    def _evict(self, manifest, keep=None):
+        if not self.max_bytes:
+            return
+        total_bytes = sum(entry['bytes'] for entry in manifest.values())
+        for key in sorted(manifest, key=lambda k: manifest[k]['last_access']):
+            if total_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = manifest.pop(key)
+            total_bytes -= entry['bytes']
+            file_path = os.path.join(self.cache_dir, entry['file'])
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            print("Memory Cache Evicted:", file_path)
+
+
+class MemoryLog:
+    """
+    Append-only JSONL file of memory entries, one JSON object per line.
+
+    Appends take an exclusive file lock and are flushed and synced to disk, so readers in other
+    threads or processes always see a prefix of complete entries. A torn last line left by a crash
+    is ignored when reading and cut off before the next append.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def load(self):
+        """Return all complete entries in the order they were appended."""
+        entries = []
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                entries.append(json.loads(line))
+        return entries
+
+    def append(self, entries):
+        lines = "".join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries)
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(self.path, 'a+b') as f:
+                    f.seek(0)
+                    data = f.read()
+                    if data and not data.endswith(b'\n'):
+                        f.truncate(data.rfind(b'\n') + 1)
+                    f.write(lines.encode('utf-8'))
+                    f.flush()
+                    os.fsync(f.fileno())
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def remove(self):
+        for path in (self.path, self.path + '.lock'):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+@contextmanager
+def connect_sqlite(db_path, **kwargs):
+    """
+    Open a SQLite connection for one block of work: committed on success, rolled back on error, always closed.
+
+    ``with sqlite3.connect(...)`` alone only commits or rolls back and leaves the connection open
+    until it is garbage-collected.
+    """
+    conn = sqlite3.connect(db_path, timeout=60, **kwargs)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+class FineMemoryStore:
+    """
+    SQLite store of fine memories at clip granularity, reusable across questions.
+
+    Each row is one clip description keyed by (video fingerprint, parameter key, clip start, clip end),
+    with times stored in milliseconds. A fine extraction over any period looks up the clips it would
+    produce, so exact repeats, periods contained in earlier ones and overlapping periods whose clip
+    boundaries line up are all served from the store.
+
+    The parameter key includes the extraction prompt, which carries the instruction the LLM wrote for
+    the question, because that instruction decides what the caption describes. Reuse therefore hits for
+    repeated questions (with the LLM response cache, the same question yields the same instruction)
+    and for questions whose search asks for the same details, and misses for unrelated questions
+    about the same period. Once the stored descriptions exceed ``max_bytes``, the least recently used
+    ones are evicted, like in ``LLMResponseCache``.
+    """
+
+    def __init__(self, db_path, max_bytes: int = 0):
+        """
+        Args:
+            db_path (str): SQLite file
+            max_bytes (int): Total description size above which least recently used clips are evicted, 0 for no limit
+        """
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fine_memory ("
+                "video TEXT, params TEXT, start_ms INTEGER, end_ms INTEGER, memory TEXT, created REAL, "
+                "bytes INTEGER, last_access REAL, PRIMARY KEY (video, params, start_ms, end_ms))"
+            )
+            # 早期版本的表没有大小和访问时间列，补上并按已有内容回填
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(fine_memory)")}
+            if "bytes" not in columns:
+                conn.execute("ALTER TABLE fine_memory ADD COLUMN bytes INTEGER")
+                conn.execute("UPDATE fine_memory SET bytes = LENGTH(CAST(memory AS BLOB))")
+            if "last_access" not in columns:
+                conn.execute("ALTER TABLE fine_memory ADD COLUMN last_access REAL")
+                conn.execute("UPDATE fine_memory SET last_access = created")
+            conn.execute("CREATE INDEX IF NOT EXISTS fine_memory_access ON fine_memory (last_access)")
+
+    def _connect(self):
+        return connect_sqlite(self.db_path)
+
+    @staticmethod
+    def _to_ms(seconds):
+        return int(round(seconds * 1000))
+
+    def lookup(self, video, params, time_ranges):
+        """
+        Args:
+            video (str): Video fingerprint
+            params (str): Parameter key of the extraction
+            time_ranges (list): Clip time ranges in seconds
+
+        Returns:
+            dict: Stored memory for each time range that is in the store, marked as recently used
+        """
+        if not time_ranges:
+            return {}
+        start_ms = min(self._to_ms(t[0]) for t in time_ranges)
+        end_ms = max(self._to_ms(t[1]) for t in time_ranges)
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT start_ms, end_ms, memory FROM fine_memory "
+                "WHERE video = ? AND params = ? AND start_ms >= ? AND end_ms <= ?",
+                (video, params, start_ms, end_ms),
+            ).fetchall()
+            stored = {(row[0], row[1]): row[2] for row in rows}
+            found = {}
+            for time_range in time_ranges:
+                key = (self._to_ms(time_range[0]), self._to_ms(time_range[1]))
+                if key in stored:
+                    found[tuple(time_range)] = stored[key]
+            conn.executemany(
+                "UPDATE fine_memory SET last_access = ? WHERE video = ? AND params = ? AND start_ms = ? AND end_ms = ?",
+                [(time.time(), video, params, self._to_ms(t[0]), self._to_ms(t[1])) for t in found],
+            )
+        return found
+
+    def put(self, video, params, memories):
+        """
+        Store clip descriptions and evict least recently used clips over the size budget.
+
+        Args:
+            video (str): Video fingerprint
+            params (str): Parameter key of the extraction
+            memories (list): (time range in seconds, memory text) pairs
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO fine_memory (video, params, start_ms, end_ms, memory, created, bytes, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(video, params, self._to_ms(t[0]), self._to_ms(t[1]), memory, now, len(memory.encode('utf-8')), now)
+                 for t, memory in memories],
+            )
+            if self.max_bytes > 0:
+                total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM fine_memory").fetchone()[0]
+                if total > self.max_bytes:
+                    evicted = 0
+                    for rowid, entry_bytes in conn.execute(
+                            "SELECT rowid, bytes FROM fine_memory ORDER BY last_access").fetchall():
+                        if total - evicted <= self.max_bytes:
+                            break
+                        conn.execute("DELETE FROM fine_memory WHERE rowid = ?", (rowid,))
+                        evicted += entry_bytes
+
+
+class LLMResponseCache:
+    """
+    SQLite cache of LLM chat replies keyed by (model, thinking mode, prompt hash).
+
+    Entries older than ``ttl`` seconds count as missing and are deleted. Once the stored replies
+    exceed ``max_bytes``, the least recently used ones are evicted. Hits and misses are counted per
+    process for ``stats``, and the store can be shared by several processes like ``FineMemoryStore``.
+    """
+
+    def __init__(self, db_path, max_bytes: int = 0, ttl: float = 0):
+        """
+        Args:
+            db_path (str): SQLite file
+            max_bytes (int): Total reply size above which least recently used entries are evicted, 0 for no limit
+            ttl (float): Seconds after which an entry expires, 0 for never
+        """
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_response ("
+                "key TEXT PRIMARY KEY, model TEXT, thinking TEXT, response TEXT, bytes INTEGER, "
+                "created REAL, last_access REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS llm_response_access ON llm_response (last_access)")
+            if self.ttl > 0:
+                conn.execute("DELETE FROM llm_response WHERE created < ?", (time.time() - self.ttl,))
+
+    def _connect(self):
+        return connect_sqlite(self.db_path)
+
+    @staticmethod
+    def key(model, thinking, prompt):
+        return make_cache_key(model, thinking, hashlib.sha256(prompt.encode('utf-8')).hexdigest())
+
+    def get(self, model, thinking, prompt):
+        """Return the cached reply to ``prompt`` or None, marking it as recently used."""
+        key = self.key(model, thinking, prompt)
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT response, created FROM llm_response WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl > 0 and row[1] < now - self.ttl:
+                conn.execute("DELETE FROM llm_response WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                conn.execute("UPDATE llm_response SET last_access = ? WHERE key = ?", (now, key))
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[0]
+
+    def put(self, model, thinking, prompt, response):
+        """Store a reply and evict least recently used entries over the size budget."""
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_response VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.key(model, thinking, prompt), model, thinking, response, size, now, now),
+            )
+            if self.max_bytes > 0:
+                total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM llm_response").fetchone()[0]
+                if total > self.max_bytes:
+                    evicted = 0
+                    for key, entry_bytes in conn.execute(
+                            "SELECT key, bytes FROM llm_response ORDER BY last_access").fetchall():
+                        if total - evicted <= self.max_bytes:
+                            break
+                        conn.execute("DELETE FROM llm_response WHERE key = ?", (key,))
+                        evicted += entry_bytes
+
+    def stats(self):
+        with self._connect() as conn:
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM llm_response").fetchone()
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries, "bytes": total}
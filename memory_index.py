@@ -0,0 +1,144 @@
+import math
+import os
+import re
+from collections import Counter
+
+from LLMs.prompt_budget import STOPWORDS
+from memory_cache import MemoryCache, make_cache_key
+
+INDEX_VERSION = 2
+
+_ENCODERS = {}
+
+
+def tokenize(text: str):
+    """Lower-cased English words without stopwords, plus single characters and bigrams of Chinese runs."""
+    tokens = []
+    for run in re.findall(r"[a-z0-9]+|[一-鿿]+", text.lower()):
+        if run[0] < '一':
+            if run not in STOPWORDS:
+                tokens.append(run)
+        else:
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25:
+    """Okapi BM25 over a fixed list of documents, stored as per-document term counts."""
+
+    def __init__(self, doc_terms: list, k1: float = 1.5, b: float = 0.75):
+        self.doc_terms = doc_terms
+        self.k1 = k1
+        self.b = b
+        self.doc_lengths = [sum(terms.values()) for terms in doc_terms]
+        self.avg_length = sum(self.doc_lengths) / len(doc_terms) if doc_terms else 0.0
+        doc_freq = Counter()
+        for terms in doc_terms:
+            doc_freq.update(terms.keys())
+        n = len(doc_terms)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+    @classmethod
+    def from_texts(cls, texts: list):
+        return cls([dict(Counter(tokenize(text))) for text in texts])
+
+    def scores(self, query: str):
+        query_tokens = set(tokenize(query))
+        scores = []
+        for terms, length in zip(self.doc_terms, self.doc_lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / self.avg_length) if self.avg_length else self.k1
+            for token in query_tokens:
+                tf = terms.get(token, 0)
+                if tf:
+                    score += self.idf[token] * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+
+def get_encoder(model_name: str):
+    if model_name not in _ENCODERS:
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError("--retrieval_embedding_model requires sentence-transformers: pip install sentence-transformers")
+        _ENCODERS[model_name] = SentenceTransformer(model_name, device="cpu")
+    return _ENCODERS[model_name]
+
+
+class CoarseMemoryIndex:
+    """
+    Retrieval index over the ``general_memory`` texts of one video's coarse memory.
+
+    Entries are ranked by BM25. With an embedding model, they are also ranked by cosine similarity
+    of sentence embeddings computed on the CPU, and the two rankings are merged by reciprocal rank
+    fusion.
+    """
+
+    def __init__(self, bm25: BM25, embedding_model: str = "", embeddings: list = None):
+        self.bm25 = bm25
+        self.embedding_model = embedding_model
+        self.embeddings = embeddings
+
+    @classmethod
+    def build(cls, coarse_memory: list, embedding_model: str = ""):
+        texts = [mem['general_memory'] for mem in coarse_memory]
+        embeddings = None
+        if embedding_model:
+            embeddings = get_encoder(embedding_model).encode(texts, normalize_embeddings=True).tolist()
+        return cls(BM25.from_texts(texts), embedding_model, embeddings)
+
+    def to_dict(self):
+        return {"version": INDEX_VERSION, "bm25": {"doc_terms": self.bm25.doc_terms, "k1": self.bm25.k1, "b": self.bm25.b},
+                "embedding_model": self.embedding_model, "embeddings": self.embeddings}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        bm25 = BM25(data["bm25"]["doc_terms"], data["bm25"]["k1"], data["bm25"]["b"])
+        return cls(bm25, data["embedding_model"], data["embeddings"])
+
+    def search(self, query: str, top_k: int):
+        """
+        Rank the coarse memory entries for a query.
+
+        Args:
+            query (str): Question text, optionally with its options
+            top_k (int): Number of entries to return
+
+        Returns:
+            list: Indices of the best ``top_k`` entries, best first
+        """
+        bm25_scores = self.bm25.scores(query)
+        order = sorted(range(len(bm25_scores)), key=lambda i: -bm25_scores[i])
+        if self.embeddings is not None:
+            query_embedding = get_encoder(self.embedding_model).encode([query], normalize_embeddings=True)[0]
+            cosine = [sum(q * e for q, e in zip(query_embedding, emb)) for emb in self.embeddings]
+            dense_order = sorted(range(len(cosine)), key=lambda i: -cosine[i])
+            # 倒数排名融合 (RRF)
+            fused = Counter()
+            for ranking in (order, dense_order):
+                for rank, i in enumerate(ranking):
+                    fused[i] += 1.0 / (60 + rank)
+            order = sorted(fused, key=lambda i: -fused[i])
+        return order[:top_k]
+
+
+def load_coarse_memory_index(coarse_memory: list, args):
+    """
+    Load the retrieval index of a coarse memory from the coarse memory cache, building it on first use.
+
+    The index is stored next to the coarse memory JSON under a key derived from the memory texts and
+    the embedding model, so it is rebuilt whenever either changes.
+    """
+    embedding_model = args.retrieval_embedding_model
+    memory_cache = MemoryCache(os.path.join(args.cache_dir, "coarse_memory"), args.coarse_cache_max_bytes)
+    key = make_cache_key("coarse_memory_index", INDEX_VERSION, embedding_model,
+                         [[mem['time_period'], mem['general_memory']] for mem in coarse_memory])
+    data = memory_cache.get(key, suffix='.index.json')
+    if data is not None:
+        return CoarseMemoryIndex.from_dict(data)
+    index = CoarseMemoryIndex.build(coarse_memory, embedding_model)
+    memory_cache.put(key, index.to_dict(), meta={"kind": "coarse_memory_index", "entries": len(coarse_memory)},
+                     suffix='.index.json')
+    return index
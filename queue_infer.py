@@ -0,0 +1,290 @@
+import copy
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+
+from VLMs import vlm_roles
+from VLMs.backends import get_vlm_backend
+from VLMs.coalescer import CoalescingBackend
+from LLMs import llm_roles
+from batch_infer import JsonlWriter, load_question_records
+from demo import parse_args, demo_infer
+from job_queue import JobQueue, PENDING
+from utils import *
+
+STAGES = ("download", "coarse", "summary", "qa")
+
+
+def get_video_args(args, video_url):
+    video_args = copy.copy(args)
+    video_args.video_url = video_url
+    return video_args
+
+
+def enqueue_manifest(queue, path):
+    """Add one download job per video of a questions JSONL; its questions travel along to the QA stage."""
+    videos = load_question_records(path)
+    queue.add([("download", video_url, {"video": video_url, "questions": records})
+               for video_url, records in videos.items()])
+    return videos
+
+
+def run_download(job, args, resources):
+    video_url = job["payload"]["video"]
+    video_path = vlm_roles.get_video_path(video_url, args.cache_dir)
+    if not os.path.exists(video_path):
+        raise FileNotFoundError(f"Video {video_url} does not exist or failed to download.")
+    return {"video_path": video_path}, [("coarse", video_url, job["payload"])]
+
+
+def run_coarse(job, args, resources):
+    video_url = job["payload"]["video"]
+    # 多个粗粒度 worker 同时切分视频，每个任务使用独立的临时目录
+    video_args = get_video_args(args, video_url)
+    video_args.temp_video_dir = f"{args.temp_video_dir}_coarse{job['id']}"
+    coarse_memory = vlm_roles.video_coarse_memory_extraction(resources["vlm"], None, video_args)
+    return {"entries": len(coarse_memory)}, [("summary", video_url, job["payload"])]
+
+
+def load_coarse_memory(video_args):
+    """Coarse memory the coarse stage cached for the video; later stages never extract it themselves."""
+    coarse_memory = vlm_roles.load_cached_coarse_memory(video_args)
+    if coarse_memory is None:
+        raise RuntimeError(f"Coarse stage not done for {video_args.video_url}: no cached coarse memory "
+                           f"with the current extraction parameters.")
+    return coarse_memory
+
+
+def run_summary(job, args, resources):
+    video_url = job["payload"]["video"]
+    video_args = get_video_args(args, video_url)
+    # 粗粒度记忆已在上一阶段写入缓存，此处直接读取
+    coarse_memory = load_coarse_memory(video_args)
+    llm_roles.coarse_memory_summarization(coarse_memory, video_args, client=resources["client"])
+    next_jobs = [("qa", f"{video_url}#{record['id']}", {"video": video_url, "record": record})
+                 for record in job["payload"]["questions"]]
+    return {"questions": len(next_jobs)}, next_jobs
+
+
+def run_qa(job, args, resources):
+    video_url = job["payload"]["video"]
+    record = job["payload"]["record"]
+    video_args = get_video_args(args, video_url)
+    coarse_memory = load_coarse_memory(video_args)
+    coarse_summary = llm_roles.coarse_memory_summarization(coarse_memory, video_args, client=resources["client"])
+
+    # demo_infer 会修改细粒度提取参数，每个问题使用独立的 args 和临时目录
+    question_args = copy.copy(video_args)
+    question_args.fine_memory_dir = f"{args.fine_memory_dir}_{record['id']}"
+    question_args.temp_video_dir = f"{args.temp_video_dir}_{record['id']}"
+    start_time = time.perf_counter()
+    answer = demo_infer(resources["vlm"], None, question_args, record["question"], resources["client"],
+                        options=record["options"], coarse_memory=coarse_memory, coarse_summary=coarse_summary)
+    # 答案在任务完成的同一事务中写出（见 write_answer），租约丢失或重试的尝试不会重复写入
+    return {"answer": answer, "seconds": round(time.perf_counter() - start_time, 1)}, []
+
+
+STAGE_HANDLERS = {"download": run_download, "coarse": run_coarse, "summary": run_summary, "qa": run_qa}
+
+
+def write_answer(job, result, writer):
+    """Write the answer record of a completed QA job, in the format of ``batch_infer.answer_video_questions``."""
+    writer.write({**job["payload"]["record"], "answer": result["answer"], "error": None, "seconds": result["seconds"]})
+
+
+def write_failed_job(job, stage, error, writer):
+    """
+    Write an error record, like ``batch_infer.answer_video_questions``, for every question of a job that
+    failed for good: the question of a QA job, or all questions of a video whose earlier stage failed.
+    """
+    payload = job["payload"]
+    records = [payload["record"]] if stage == "qa" else payload["questions"]
+    if stage != "qa":
+        error = f"{stage} stage failed: {error}"
+    for record in records:
+        writer.write({**record, "answer": None, "error": error})
+
+
+class StageWorkers:
+    """
+    Worker threads of one pipeline stage, leasing jobs from the shared ``JobQueue``.
+
+    A job that raises is recorded as a failed attempt and retried by the queue; once it is out of
+    attempts, its questions get error records in the output. A job that completes enqueues the
+    jobs of the next stage, and a QA job writes its answer, in the transaction that marks it done.
+    Download workers stop leasing while ``args.download_ahead`` downloaded videos are already
+    waiting for coarse extraction, so downloads run ahead of the GPU stage without filling the disk.
+    """
+
+    def __init__(self, stage, num_workers, queue, args, resources, leases, stop):
+        self.stage = stage
+        self.handler = STAGE_HANDLERS[stage]
+        self.queue = queue
+        self.args = args
+        self.resources = resources
+        self.leases = leases
+        self.stop = stop
+        self.busy_seconds = 0.0
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.run, name=f"{stage}-{i}", daemon=True) for i in range(num_workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+    def write_failed(self, job, error):
+        print(f"{self.stage} Job {job['key']} Failed After {job['attempts']} Attempts: {error}")
+        write_failed_job(job, self.stage, error, self.resources["writer"])
+
+    def run(self):
+        worker = f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+        while not self.stop.is_set():
+            if self.stage == "download" and self.queue.count("coarse", PENDING) >= self.args.download_ahead:
+                self.stop.wait(self.args.queue_poll_seconds)
+                continue
+            job = self.queue.lease(self.stage, worker, self.args.lease_seconds, on_failed=self.write_failed)
+            if job is None:
+                self.stop.wait(self.args.queue_poll_seconds)
+                continue
+            self.leases.hold(job["id"], worker)
+            start_time = time.perf_counter()
+            try:
+                result, next_jobs = self.handler(job, self.args, self.resources)
+                on_done = None
+                if self.stage == "qa":
+                    on_done = lambda: write_answer(job, result, self.resources["writer"])
+                self.queue.complete(job["id"], worker, result, next_jobs, on_done=on_done)
+            except Exception as e:
+                print(f"{self.stage} Job {job['key']} Attempt {job['attempts']} Failed: {e!r}")
+                if self.queue.fail(job["id"], worker, repr(e)):
+                    self.write_failed(job, repr(e))
+            finally:
+                self.leases.release(job["id"])
+                with self.lock:
+                    self.busy_seconds += time.perf_counter() - start_time
+
+
+class LeaseKeeper:
+    """Renews the leases of all jobs this process is working on, every third of the lease time."""
+
+    def __init__(self, queue, lease_seconds, stop):
+        self.queue = queue
+        self.lease_seconds = lease_seconds
+        self.stop = stop
+        self.held = {}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name="lease-keeper", daemon=True)
+
+    def hold(self, job_id, worker):
+        with self.lock:
+            self.held[job_id] = worker
+
+    def release(self, job_id):
+        with self.lock:
+            self.held.pop(job_id, None)
+
+    def run(self):
+        while not self.stop.wait(self.lease_seconds / 3):
+            with self.lock:
+                held = dict(self.held)
+            for job_id, worker in held.items():
+                self.queue.renew([job_id], worker, self.lease_seconds)
+
+
+def format_progress(queue, pools, start_time):
+    elapsed = time.perf_counter() - start_time
+    since = time.time() - elapsed
+    lines = [f"Progress after {elapsed:.0f}s:"]
+    for stage, counts in queue.progress(since).items():
+        line = (f"  {stage:>8}: done {counts['done']}, running {counts['running']}, pending {counts['pending']}, "
+                f"failed {counts['failed']}, {counts.get('done_since', 0) / max(elapsed, 1e-9) * 60:.1f}/min")
+        if stage in pools:
+            pool = pools[stage]
+            line += f", busy {pool.busy_seconds / max(elapsed * len(pool.threads), 1e-9):.0%}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def run_job_queue(queue, args, resources, stages=STAGES):
+    """
+    Run worker pools for ``stages`` until no job in the queue is pending or running.
+
+    Several processes may work on the same queue, e.g. one running only the "coarse" stage per
+    GPU machine while another downloads and calls the LLM.
+
+    Returns:
+        dict: stage -> StageWorkers, with the busy time of each pool
+    """
+    stop = threading.Event()
+    leases = LeaseKeeper(queue, args.lease_seconds, stop)
+    leases.thread.start()
+    workers = {"download": args.download_workers, "coarse": args.coarse_workers,
+               "summary": args.summary_workers, "qa": args.qa_workers}
+    pools = {stage: StageWorkers(stage, workers[stage], queue, args, resources, leases, stop) for stage in stages}
+    start_time = time.perf_counter()
+    for pool in pools.values():
+        pool.start()
+    last_report = start_time
+    while queue.unfinished() > 0:
+        time.sleep(args.queue_poll_seconds)
+        if time.perf_counter() - last_report >= args.report_seconds:
+            print(format_progress(queue, pools, start_time))
+            last_report = time.perf_counter()
+    stop.set()
+    for pool in pools.values():
+        pool.join()
+    print(format_progress(queue, pools, start_time))
+    return pools
+
+
+if __name__ == "__main__":
+    # Setup logging
+    logger = Logger('videolucy_queue_infer.txt')
+    sys.stdout = logger
+
+    # Initialize
+    args = parse_args()
+    queue = JobQueue(args.queue_db or os.path.join(args.cache_dir, "job_queue.sqlite"),
+                     max_attempts=args.job_max_attempts, backoff_base=args.job_retry_backoff)
+    if args.retry_failed_jobs:
+        print(f"Retrying {queue.retry_failed()} Failed Jobs")
+    if args.questions_jsonl:
+        videos = enqueue_manifest(queue, args.questions_jsonl)
+        print(f"Queued {sum(len(records) for records in videos.values())} questions about {len(videos)} videos")
+    stages = [stage.strip() for stage in args.queue_stages.split(",") if stage.strip()]
+
+    resources = {"vlm": None, "client": None}
+    # 分片的粗粒度提取由子进程各自加载模型，只有细粒度提取（qa）或不分片时主进程才需要模型
+    if "qa" in stages or ("coarse" in stages and args.coarse_shards <= 1):
+        if "coarse" in stages and args.coarse_shards > 1:
+            print("Note: sharded coarse extraction runs next to this process's own VLM; "
+                  "run the coarse stage in a separate process (--queue_stages coarse) to hold only the shard replicas")
+        vlm_model, vlm_processor = vlm_roles.create_vlm(args)
+        # 粗粒度提取与各问题的细粒度提取同时进行，共用一个合并批次的 VLM 后端
+        resources["vlm"] = CoalescingBackend(get_vlm_backend(vlm_model, vlm_processor),
+                                             batch_size=args.infer_batch_size, max_wait=args.coalesce_wait)
+    if "summary" in stages or "qa" in stages:
+        resources["client"] = llm_roles.create_llm(args)
+
+    # Setup directories with timestamp
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+    args.fine_memory_dir = f"{args.fine_memory_dir}_{timestamp}"
+    args.temp_video_dir = f"{args.temp_video_dir}_{timestamp}"
+
+    resources["writer"] = JsonlWriter(args.output_jsonl)
+    run_job_queue(queue, args, resources, stages)
+    resources["writer"].close()
+    if resources["vlm"] is not None:
+        resources["vlm"].close()
+
+    print("=" * 30)
+    print(f"Answers written to {args.output_jsonl}")
+    if resources["client"] is not None:
+        print(f"LLM Response Cache: {resources['client'].cache_stats()}")
+        print(f"LLM Calls: {resources['client'].call_stats()}")
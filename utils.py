@@ -1,6 +1,7 @@
 import sys
 import re
 import ast
+import argparse
 
 class Logger:
     """Logger class to redirect stdout to both console and file."""
@@ -21,6 +22,17 @@ class Logger:
         self.log_file.close()
 
 
+def str2bool(value):
+    """argparse type for boolean flags; ``type=bool`` would turn any non-empty string, even "False", into True."""
+    if isinstance(value, bool):
+        return value
+    if value.strip().lower() in ("true", "1", "yes", "y"):
+        return True
+    if value.strip().lower() in ("false", "0", "no", "n"):
+        return False
+    raise argparse.ArgumentTypeError(f"expected True or False, got {value!r}")
+
+
 def parse_answer(answer_string):
     """
     Parse the answer string to extract dictionary output from LLM.
@@ -112,6 +124,25 @@ def filter_coarse_memory_by_time_periods(coarse_memory, related_time_periods, ov
     return filtered_memory
 
 
+def is_time_period(period):
+    return (isinstance(period, (list, tuple)) and len(period) == 2 and
+            all(isinstance(t, (int, float)) and not isinstance(t, bool) for t in period) and period[0] < period[1])
+
+
+def normalize_time_periods(periods):
+    """
+    Time periods of an LLM reply as a list of [start, end] pairs.
+
+    A single flat (start, end) pair is wrapped into a list, and entries that are not two increasing
+    numbers are dropped.
+    """
+    if is_time_period(periods):
+        periods = [periods]
+    if not isinstance(periods, (list, tuple)):
+        return []
+    return [list(period) for period in periods if is_time_period(period)]
+
+
 def contains_ordinal_number(text):
     """
     Check if text contains ordinal numbers.